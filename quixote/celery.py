@@ -0,0 +1,24 @@
+"""
+Celery application of the project. The tasks of the apps (e.g. sancho/tasks.py) are
+discovered automatically and configured with the CELERY_* settings.
+
+Without CELERY_BROKER_URL the tasks run eagerly, in the process that sends them (local
+development and tests). In production start a worker with (the worker process of the
+Procfile):
+
+    celery -A quixote worker --loglevel=info
+
+The web process stores the uploaded reports in the database (sancho.models.IngestFile), so
+the worker can run on another machine. On fly.io it is the worker process group of fly.toml
+and the broker URL is a secret (fly secrets set CELERY_BROKER_URL=redis://...).
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "quixote.settings")
+
+app = Celery("quixote")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
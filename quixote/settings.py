@@ -74,6 +74,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # timings of the parser and metrics layers (see SANCHO_INSTRUMENT)
+    "sancho.middleware.InstrumentationMiddleware",
     # django debug toolbar
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     # corsheaders
@@ -184,5 +186,47 @@ MEDIA_ROOT = "uploads/"
 
 DATA_UPLOAD_MAX_NUMBER_FILES = 1000
 
+# The reports are parsed while they are uploaded (sancho/uploadhandlers.py), then stored in
+# temporary files (not in memory: a batch of reports doesn't grow the memory of the request)
+FILE_UPLOAD_HANDLERS = [
+    "sancho.uploadhandlers.ReportUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Daily returns store for the correlation between sets (disabled when empty)
+SANCHO_DAILY_RETURNS_DIR = config("SANCHO_DAILY_RETURNS_DIR", default="")
+SANCHO_DAILY_RETURNS_CALENDAR = ("2010-01-01", "2030-12-31")
+
+# Timings of the parser and metrics layers per request (can also be switched at runtime)
+SANCHO_INSTRUMENT = config("SANCHO_INSTRUMENT", default=False, cast=bool)
+
+# Stale metrics recalculated from their stored operations when a list is read (per request);
+# the rest are left to manage.py recompute_metrics --stale
+SANCHO_LAZY_RECOMPUTE = config("SANCHO_LAZY_RECOMPUTE", default=20, cast=int)
+
+# Background jobs (Celery). Without a broker the tasks run eagerly in the web process (local
+# development and tests). With a broker (e.g. redis://...) the worker process of the Procfile
+# and of fly.toml runs them; the uploaded reports wait in the database (IngestFile), which
+# both processes share
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default="")
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=not CELERY_BROKER_URL, cast=bool)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Processes that parse and measure the reports of a job when it runs outside a Celery
+# prefork worker (e.g. eagerly in the web process); 1 processes them one by one
+SANCHO_INGEST_WORKERS = config("SANCHO_INGEST_WORKERS", default=1, cast=int)
+# Reports saved together by the pool (one COPY per table on PostgreSQL, bulk_create in batches
+# of as many rows elsewhere)
+SANCHO_PERSIST_BATCH = config("SANCHO_PERSIST_BATCH", default=200, cast=int)
+
+# Ingest job progress pushed by server-sent events instead of polled by the browser. A stream
+# holds a server worker while it lasts, so only enable it with workers that can hold streams
+# (gunicorn gthread or gevent, ASGI), not with the sync workers of the Procfile
+SANCHO_PROGRESS_EVENTS = config("SANCHO_PROGRESS_EVENTS", default=False, cast=bool)
+# Seconds between updates and length of a stream (the browser then reconnects)
+SANCHO_PROGRESS_INTERVAL = config("SANCHO_PROGRESS_INTERVAL", default=1.0, cast=float)
+SANCHO_PROGRESS_STREAM_SECONDS = config("SANCHO_PROGRESS_STREAM_SECONDS", default=30, cast=int)
+
 CSRF_TRUSTED_ORIGINS = ["https://*.fly.dev"]
 CROS_ORIGIN_ALLOW_ALL = True
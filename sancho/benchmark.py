@@ -0,0 +1,175 @@
+# Python imports
+import math
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from .ingest import metrics_fields
+from .src.parser import btkernels
+from .src.parser.btmetrics import BtMetrics
+from .src.parser.btsynthetic import synthetic_trades
+from .src.parser.bttrades import BtTrades
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Sizes (number of operations) benchmarked by default
+BENCHMARK_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+# A call estimated to take longer than this (seconds) is skipped
+BENCHMARK_BUDGET = 30.0
+# Public BtMetrics methods that are not benchmarked on their own: they write files or read
+# the values computed in __init__ (their cost is part of the row build)
+BENCHMARK_EXCLUDE = {'metrics_to_df', 'selected_metrics', 'is_valid'}
+# Name of the Metrics row build (BtMetrics plus every field computed in ProcessBacktests)
+ROW_BUILD = 'metrics_row'
+# Vectorized engines checked against BtMetrics: name -> (engine, BtMetrics method, reduction)
+PARITY_CHECKS = {
+    'Kratio': (lambda t: btkernels.kratio(t.pips), 'calculate_kratio', None),
+    'RF': (lambda t: btkernels.recovery_factor(t.pips), 'calculate_rf', None),
+    'PF': (lambda t: btkernels.profit_factor(t.pips), 'calculate_pf', None),
+    'EP': (lambda t: btkernels.expectancy(t.pips), 'esp', None),
+    'DD': (lambda t: btkernels.max_drawdown(t.pips), 'drawdown', lambda v: v.min()),
+    'SQN': (lambda t: btkernels.sqn(t.pips), 'calculate_sqn', None),
+    'Pct. Win': (lambda t: btkernels.pct_win(t.pips), 'pct_win', None),
+    'Avg Win': (lambda t: btkernels.avg_win(t.pips), 'calculate_avg_win', None),
+    'Avg Loss': (lambda t: btkernels.avg_loss(t.pips), 'calculate_avg_loss', None),
+    'Gross Profit': (lambda t: btkernels.gross_profit(t.pips), 'gross_profit', None),
+    'Gross Loss': (lambda t: btkernels.gross_loss(t.pips), 'gross_loss', None),
+    'Closing Days': (lambda t: btkernels.closing_days(t.close_time), 'calculate_closing_days', None),
+    'Max. Exposure': (lambda t: btkernels.max_exposure(t.open_time, t.close_time, t.volume),
+                      'exposures', lambda v: max(v[1])),
+}
+# BtMetrics rounds its results to 2 decimals (DEC_PREC)
+PARITY_TOLERANCE = 0.005 + 1e-9
+##########################################################################################################
+
+
+def metric_methods() -> List[str]:
+    """Public BtMetrics methods to benchmark"""
+    return sorted(name for name, value in vars(BtMetrics).items()
+                  if callable(value) and not name.startswith('_') and name not in BENCHMARK_EXCLUDE)
+
+
+def bare_metrics(trades: BtTrades) -> BtMetrics:
+    """BtMetrics over trades without running the eager calculations of __init__, so every
+       method can be timed on its own"""
+    mts = BtMetrics.__new__(BtMetrics)
+    mts.bt = trades
+    mts._ops = trades.operations
+    mts.calc_metrics_at_init = False
+    mts._pips_or_money = True
+    mts._all_metrics = None
+    return mts
+
+
+def build_row(trades: BtTrades) -> dict:
+    """Metrics fields of a backtest as ProcessBacktests builds them"""
+    start = trades.open_time.min().astype('datetime64[s]').astype(datetime)
+    end = trades.close_time.max().astype('datetime64[s]').astype(datetime)
+    return metrics_fields(trades, BtMetrics(trades), start, end, trades)
+
+
+def measure(func: Callable[[], Any], repeat: int = 1, memory: bool = True) -> Tuple[float, int, Any]:
+    """Best wall time (s) of repeat calls, peak of the memory allocated by one call (bytes,
+       -1 if memory is False) and the value returned"""
+    best = math.inf
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+    peak = -1
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak, value
+
+
+def estimate(history: List[Tuple[int, float]], size: int) -> float:
+    """Time at size extrapolated from the (size, seconds) already measured, assuming a
+       power law with the observed exponent (quadratic with a single measurement)"""
+    if not history:
+        return 0.0
+    if len(history) == 1:
+        exponent = 2.0
+    else:
+        (n1, t1), (n2, t2) = history[-2:]
+        exponent = min(max(math.log(max(t2, 1e-9) / max(t1, 1e-9)) / math.log(n2 / n1), 1.0), 2.0)
+    n, t = history[-1]
+    return t * (size / n) ** exponent
+
+
+def run_benchmark(sizes: Iterable[int] = BENCHMARK_SIZES, methods: List[str] = None, repeat: int = 1,
+                  budget: float = BENCHMARK_BUDGET, memory: bool = True, seed: int = 0,
+                  log: Callable[[str], None] = None) -> dict:
+    """Times every method (and the Metrics row build) on synthetic backtests of every size,
+       and checks the vectorized engines against BtMetrics where it could run
+
+    Returns:
+        (dict): Results, with the environment, one entry per (size, method) in 'timings'
+                and one per (size, metric) in 'parity'
+    """
+    methods = list(methods) if methods is not None else metric_methods() + [ROW_BUILD]
+    log = log or (lambda message: None)
+    history: Dict[str, List[Tuple[int, float]]] = {name: [] for name in methods}
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'budget': budget,
+        'timings': [],
+        'parity': [],
+    }
+    for size in sorted(sizes):
+        trades = synthetic_trades(size, seed)
+        values = {}
+        for name in methods:
+            entry = {'size': size, 'method': name}
+            expected = estimate(history[name], size)
+            if expected > budget:
+                entry.update(status='skipped', estimated_s=round(expected, 3))
+            else:
+                if name == ROW_BUILD:
+                    func = lambda: build_row(trades)
+                else:
+                    func = getattr(bare_metrics(trades), name)
+                try:
+                    seconds, peak, values[name] = measure(func, repeat, memory)
+                except Exception as error:
+                    entry.update(status='error', error=repr(error))
+                else:
+                    history[name].append((size, seconds))
+                    entry.update(status='ok', seconds=round(seconds, 6),
+                                 ops_per_s=round(size / seconds) if seconds > 0 else None,
+                                 peak_kb=round(peak / 1024, 1) if peak >= 0 else None)
+            results['timings'].append(entry)
+            log(f'{size:>9} {name:<28} {entry["status"]:<8} {entry.get("seconds", "")}')
+        for metric, (engine, reference, reduce) in PARITY_CHECKS.items():
+            if reference not in values:
+                continue
+            expected_value = values[reference] if reduce is None else reduce(values[reference])
+            start = time.perf_counter()
+            engine_value = engine(trades)
+            engine_s = time.perf_counter() - start
+            engine_value, expected_value = float(engine_value), float(expected_value)
+            diff = abs(engine_value - expected_value)
+            results['parity'].append({
+                'size': size, 'metric': metric, 'engine': engine_value, 'reference': expected_value,
+                'abs_diff': diff,
+                'ok': bool(diff <= PARITY_TOLERANCE or (math.isnan(engine_value) and math.isnan(expected_value))),
+                'engine_s': round(engine_s, 6),
+            })
+    return results
@@ -0,0 +1,701 @@
+# Python imports
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Sequence, Tuple
+
+# Non-standard library imports
+import numpy as np
+
+# Django imports
+import django
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Project imports
+from .models import Backtest, IngestFile, IngestJob, Metrics
+from .persist import persist_reports, update_reports
+from .src.analysis.btcalendar import CalendarCube
+from .src.analysis.btcorrelation import DailyReturns
+from .src.analysis.btcriteria import CRITERIA_FIELDS, CompiledCriteria
+from .src.analysis.btsimilarity import outcome_hash, trade_fingerprint
+from .src.parser.btgenbox import BtGenbox, BtPeriods, BtOrderType, report_key
+from .src.parser.btmetrics import BtMetrics, DEC_PREC, DEFAULT_CRITERIA
+from .src.parser.btrevisions import CRITERIA_HASH, METRIC_VERSION
+from .src.parser.btstream import ReportTableParser, load_table
+from .src.parser.bttrades import BtTrades
+
+logger = logging.getLogger(__name__)
+
+
+# Equivalencias entre los enumerados del parser y los del modelo
+ORDER_TYPES = {
+    BtOrderType.BUY: Backtest.OrderType.BUY,
+    BtOrderType.SELL: Backtest.OrderType.SELL,
+    BtOrderType.BOTH: Backtest.OrderType.BOTH,
+}
+PERIOD_TYPES = {
+    BtPeriods.IS: Backtest.PeriodType.IS,
+    BtPeriods.OS: Backtest.PeriodType.OS,
+    BtPeriods.ISOS: Backtest.PeriodType.ISOS,
+}
+# Campos de Metrics que no son métricas
+METRICS_OWN_FIELDS = ('id', 'backtest')
+# Extensions of the reports
+REPORT_SUFFIXES = ('.htm', '.html')
+# Bytes read at a time to hash a report
+HASH_CHUNK_SIZE = 64 * 1024
+# Reports in flight per process of the pool
+POOL_WINDOW = 2
+
+
+def build_backtest(bt_gbx: BtGenbox, user, opti_number: int, timeframe: str,
+                   bt_start: datetime, bt_end: datetime, fingerprint: str = '',
+                   trades: BtTrades = None, outcome: str = '') -> Backtest:
+    """Backtest model (not saved) for a parsed report, with its operations if trades is given
+       and the hashes of their entries (fingerprint) and of all their columns (outcome)"""
+    return Backtest(
+        user=user,
+        name=bt_gbx.name,
+        optimization=opti_number,
+        period_type=PERIOD_TYPES[bt_gbx.period],
+        symbol=bt_gbx.symbol,
+        timeframe=Backtest.TimeFrame(timeframe),
+        ordertype=ORDER_TYPES[bt_gbx.ordertype],
+        date_from=bt_start,
+        date_to=bt_end,
+        fingerprint=fingerprint,
+        outcome_hash=outcome,
+        trades=trades.to_bytes() if trades is not None else None,
+    )
+
+
+def metrics_fields(bt_gbx: BtGenbox, bt_mts: BtMetrics, bt_start: datetime, bt_end: datetime,
+                   trades: BtTrades = None) -> dict:
+    """Values of the Metrics fields calculated from a report"""
+    trades = trades if trades is not None else BtTrades.from_backtest(bt_gbx)
+    valido = bt_mts.valid == 'Y'
+    days, hours, minutes, seconds = bt_mts.calculate_time_in_market()
+    time_in_market = timedelta(days=days, hours=hours, \
+            minutes=minutes, seconds=seconds)
+    op_promedio = bt_gbx.operations.Duration.sum() / bt_gbx.operations.shape[0]
+    avg_days = op_promedio.days
+    avg_hours = (op_promedio - timedelta(days=avg_days)).seconds // 3600
+    avg_minutes = (op_promedio - timedelta(days=avg_days, hours=avg_hours)).seconds //60
+    return dict(
+        is_valid=valido,
+        profit=bt_mts.gross_profit(),
+        loss=bt_mts.gross_loss(),
+        num_ops=bt_mts.num_ops,
+        pf=bt_mts.calculate_pf(),
+        rf=bt_mts.calculate_rf(),
+        dd=Decimal(bt_mts.drawdown().min()).quantize(Decimal(DEC_PREC)),
+        ep=bt_mts.esp(),
+        kratio=bt_mts.calculate_kratio(),
+        max_losing_strike=bt_mts.get_max_losing_strike(),
+        max_winning_strike=bt_mts.get_max_winning_strike(),
+        avg_losing_strike=bt_mts.get_avg_losing_strike(),
+        avg_winning_strike=bt_mts.get_avg_winning_strike(),
+        max_lots=bt_gbx.operations.Volume.max(),
+        min_lots=bt_gbx.operations.Volume.min(),
+        max_exposure=Decimal(max(bt_mts.exposures()[1])).quantize(Decimal(DEC_PREC)),
+        time_in_market=time_in_market,
+        pct_winner=Decimal(bt_mts.pct_win()).quantize(Decimal(DEC_PREC)),
+        closing_days=bt_mts.calculate_closing_days(),
+        sqn=bt_mts.calculate_sqn(),
+        sharpe_ratio=bt_mts.calculate_sharpe(),
+        best_operation_pips=int(bt_mts.best_operation()[0]),
+        best_operation_datetime=bt_mts.best_operation()[1],
+        worst_operation_pips=int(bt_mts.worst_operation()[0]),
+        worst_operation_datetime=bt_mts.worst_operation()[1],
+        avg_win=bt_mts.calculate_avg_win(),
+        avg_loss=bt_mts.calculate_avg_loss(),
+        total_bt_duration=bt_end-bt_start,
+        avg_op_duration=timedelta(days=avg_days, hours=avg_hours, minutes=avg_minutes),
+        longest_op_duration=bt_gbx.operations.Duration.max(),
+        shortest_op_duration=bt_gbx.operations.Duration.min(),
+        calendar=CalendarCube.from_trades(trades).to_bytes(),
+        metric_version=METRIC_VERSION,
+        criteria_hash=CRITERIA_HASH,
+    )
+
+
+def copy_metrics(backtest: Backtest, original: Metrics) -> Metrics:
+    """Metrics for a backtest whose operations (all their columns, see outcome_hash) are the
+       same as those of original's backtest"""
+    fields = {field.attname: getattr(original, field.attname)
+              for field in Metrics._meta.concrete_fields if field.name not in METRICS_OWN_FIELDS}
+    fields['total_bt_duration'] = backtest.date_to - backtest.date_from
+    return Metrics(backtest=backtest, **fields)
+
+
+def recompute_fields(item: Tuple[int, bytes, date, date]) -> Tuple[int, dict, str]:
+    """Metrics fields recalculated from the stored operations of a backtest. Runs in the
+       worker processes of manage.py recompute_metrics.
+
+    Args:
+        item (tuple):   Metrics id, Backtest.trades blob, Backtest.date_from and date_to
+
+    Returns:
+        (tuple): The metrics id, the fields (None if they couldn't be calculated) and the error
+    """
+    metrics_id, blob, date_from, date_to = item
+    try:
+        trades = BtTrades.from_bytes(blob)
+        start = datetime.combine(date_from, datetime.min.time())
+        end = datetime.combine(date_to, datetime.min.time())
+        return metrics_id, metrics_fields(trades, BtMetrics(trades), start, end, trades), ''
+    except Exception as error:
+        return metrics_id, None, repr(error)
+
+
+def refresh_metrics(metrics: Sequence[Metrics], limit: int = None) -> int:
+    """Brings stale Metrics up to date, in place and in the database:
+        * the fields changed by a newer revision of their formula are recalculated from the
+          operations stored with the backtest (at most limit rows, the rest stay stale for
+          manage.py recompute_metrics --stale). Rows whose backtest has no stored operations
+          can't be recalculated and don't count (see recompute_metrics --legacy)
+        * is_valid is evaluated again from the stored fields if the criteria changed (also at
+          most limit rows)
+
+    Returns:
+        (int): Number of rows updated
+    """
+    updated, fields = set(), {'metric_version', 'criteria_hash'}
+    outdated = [mt for mt in metrics if mt.metric_version < METRIC_VERSION]
+    if outdated:
+        # Sin leer las operaciones (suelen estar diferidas)
+        with_trades = set(Metrics.objects.filter(id__in=[mt.id for mt in outdated], backtest__trades__isnull=False)
+                          .values_list('id', flat=True))
+        outdated = [mt for mt in outdated if mt.id in with_trades]
+    for mt in outdated[:limit]:
+        stale = mt.stale_fields()
+        blob = mt.backtest.trades
+        if not blob:
+            continue
+        _, values, error = recompute_fields((mt.id, blob, mt.backtest.date_from, mt.backtest.date_to))
+        if values is None:
+            continue
+        for field in stale | fields:
+            setattr(mt, field, values[field])
+        fields |= stale
+        updated.add(mt)
+    invalid = [mt for mt in metrics if mt.criteria_hash != CRITERIA_HASH][:limit]
+    if invalid:
+        table = {name: np.array([getattr(mt, CRITERIA_FIELDS[name]) for mt in invalid], dtype=float)
+                 for name in DEFAULT_CRITERIA}
+        criteria = CompiledCriteria(DEFAULT_CRITERIA).order_by_selectivity(table)
+        for mt, valid in zip(invalid, criteria.valid(table)):
+            mt.is_valid, mt.criteria_hash = bool(valid), CRITERIA_HASH
+        fields.add('is_valid')
+        updated.update(invalid)
+    if updated:
+        Metrics.objects.bulk_update(list(updated), sorted(fields))
+    return len(updated)
+
+
+def find_duplicate(user, backtest: Backtest, seen: dict = None):
+    """Metrics of a backtest (of this upload or stored) with the same operations, or None.
+       The operations must be equal in every column (outcome_hash), not only in their entries
+       (fingerprint): sets that differ in their exits or lots share the fingerprint."""
+    if not backtest.outcome_hash:
+        return None
+    seen = seen if seen is not None else {}
+    if (backtest.period_type, backtest.outcome_hash) in seen:
+        return seen[(backtest.period_type, backtest.outcome_hash)]
+    return Metrics.objects.select_related('backtest').defer('backtest__trades').filter(
+        backtest__user=user,
+        backtest__period_type=backtest.period_type,
+        backtest__outcome_hash=backtest.outcome_hash,
+    ).first()
+
+
+def read_report(directory: Path, name: str, content: bytes = None, table: bytes = None) -> BtGenbox:
+    """Report name, from the table parsed while it was uploaded if there is one (JSON, see
+       btstream.dump_table), else from its content (an upload) or from its file in directory"""
+    if table is not None:
+        return BtGenbox(directory, name, table=load_table(table))
+    if content is not None:
+        parser = ReportTableParser()
+        parser.feed(content)
+        return BtGenbox(directory, name, table=parser.close())
+    return BtGenbox(Path(directory), name)
+
+
+def report_source(job: IngestJob, name: str) -> Tuple[Path, bytes, bytes]:
+    """Where report name of job is read from (the arguments of read_report): the file in the
+       source directory of the job, or the upload stored in the database with its table
+
+    Raises:
+        FileNotFoundError: If the upload is not stored (anymore)
+    """
+    if job.source:
+        return job.directory, None, None
+    upload = IngestFile.objects.filter(job=job, name=name).values_list('content', 'table').first()
+    if upload is None:
+        raise FileNotFoundError(f'{name} is not stored in ingest job {job.pk}')
+    content, table = upload
+    return None, bytes(content), bytes(table) if table is not None else None
+
+
+def release_report(job: IngestJob, name: str) -> None:
+    """Removes an uploaded report of job once it's done with (the reports of a source
+       directory are never removed)"""
+    if not job.source:
+        IngestFile.objects.filter(job=job, name=name).delete()
+
+
+def ingest_report(directory: Path, name: str, user, opti_number: int, timeframe: str,
+                  bt_start: datetime, bt_end: datetime, seen: dict = None,
+                  on_stage: Callable[[str], None] = None, content: bytes = None,
+                  table: bytes = None) -> Tuple[Backtest, Metrics]:
+    """Backtest and Metrics models (not saved) of a report (see read_report). If its
+       operations were already measured (in seen or in the database) the metrics are copied
+       instead of calculated. on_stage is called with 'parsed' and 'computed' as the report
+       goes through them"""
+    on_stage = on_stage or (lambda stage: None)
+    bt_gbx = read_report(directory, name, content, table)
+    on_stage('parsed')
+    trades = BtTrades.from_backtest(bt_gbx)
+    backtest = build_backtest(bt_gbx, user, opti_number, timeframe, bt_start, bt_end,
+                              trade_fingerprint(trades), trades, outcome_hash(trades))
+    original = find_duplicate(user, backtest, seen)
+    if original is not None:
+        logger.info('%s duplicates the operations of %s', bt_gbx.name, original.backtest.name)
+        metrics = copy_metrics(backtest, original)
+    else:
+        metrics = Metrics(backtest=backtest, **metrics_fields(bt_gbx, BtMetrics(bt_gbx), bt_start, bt_end, trades))
+    on_stage('computed')
+    if seen is not None:
+        seen[(backtest.period_type, backtest.outcome_hash)] = metrics
+    return backtest, metrics
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Lists of up to size items of items"""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def store_daily_returns(backtests: Iterable[Backtest], opti_number: int, chunk_size: int = None) -> None:
+    """Adds the ISOS backtests to the daily returns store used for correlations, chunk_size
+       backtests at a time (SANCHO_PERSIST_BATCH) so that only their operations are in memory"""
+    if not settings.SANCHO_DAILY_RETURNS_DIR:
+        return
+    start, end = settings.SANCHO_DAILY_RETURNS_CALENDAR
+    returns = DailyReturns(settings.SANCHO_DAILY_RETURNS_DIR, start, end)
+    try:
+        for chunk in chunked(backtests, chunk_size or settings.SANCHO_PERSIST_BATCH):
+            trades = []
+            for backtest in chunk:
+                stored = backtest.load_trades() if backtest.period_type == Backtest.PeriodType.ISOS else None
+                if stored is not None:
+                    trades.append(stored.take(slice(None), f'{backtest.name}#{opti_number}'))
+            returns.add(trades)
+        returns.update_correlation()
+    except ValueError as error:
+        logger.warning('Daily returns not stored: %s', error)
+
+
+def file_hash(path: Path, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """SHA-256 of a file, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def create_ingest_job(user, uploads: Sequence, opti_number: int, timeframe: str,
+                      bt_start: datetime, bt_end: datetime, tables: dict = None,
+                      mode: str = IngestJob.Mode.INSERT, hashes: dict = None) -> IngestJob:
+    """IngestJob with the uploaded reports stored in the database (IngestFile), ready to be
+       processed by any worker. tables (files with the raw tables, stored with the reports)
+       and hashes are what the upload handler worked out by file name (request.report_tables
+       and request.report_hashes, see sancho/uploadhandlers.py); the missing hashes are
+       calculated here. mode is what to do with the backtests already stored (IngestJob.Mode)
+
+    Raises:
+        ValueError: If a file is not a report (REPORT_SUFFIXES); no job is created then
+    """
+    tables = tables or {}
+    hashes = dict(hashes or {})
+    names = [Path(upload.name).name for upload in uploads]
+    for name in names:
+        if Path(name).suffix.lower() not in REPORT_SUFFIXES:
+            raise ValueError(f'{name} is not a report ({", ".join(REPORT_SUFFIXES)})')
+    job = IngestJob.objects.create(user=user, optimization=opti_number, timeframe=timeframe,
+                                   date_from=bt_start, date_to=bt_end, files=names, mode=mode)
+    # Uno a uno: en memoria solo hay un informe a la vez
+    for name, upload in zip(names, uploads):
+        content = b''.join(upload.chunks())
+        hashes.setdefault(name, hashlib.sha256(content).hexdigest())
+        table = Path(tables[name]).read_bytes() if name in tables else None
+        IngestFile.objects.update_or_create(job=job, name=name, defaults={'content': content, 'table': table})
+    job.hashes = hashes
+    job.save(update_fields=['hashes'])
+    return job
+
+
+def existing_reports(job: IngestJob, names: Sequence[str]) -> dict:
+    """Reports of names whose backtest (name, optimization and period) the user of job already
+       has, found from the file names alone in one query
+
+    Returns:
+        (dict): file name -> (backtest id, metrics id or None)
+    """
+    keys = {}
+    for name in names:
+        bt_name, period = report_key(name)
+        keys[(bt_name, PERIOD_TYPES[period].value)] = name
+    rows = Backtest.objects.filter(user=job.user, optimization=job.optimization,
+                                   name__in={bt_name for bt_name, _ in keys}) \
+        .values_list('name', 'period_type', 'pk', 'metrics').order_by('pk', 'metrics')
+    existing = {}
+    for bt_name, period, backtest_id, metrics_id in rows:
+        if (bt_name, period) in keys:
+            existing.setdefault(keys[(bt_name, period)], (backtest_id, metrics_id))
+    return existing
+
+
+def known_contents(user, hashes: dict, deferred: Sequence[str] = ()) -> dict:
+    """Reports (hashes: file name -> SHA-256) whose very file the user already ingested, found
+       in one query
+
+    Returns:
+        (dict): file name -> Metrics (with its backtest) of the stored report
+    """
+    stored = {}
+    for mt in Metrics.objects.select_related('backtest').defer(*deferred).filter(
+            backtest__user=user, backtest__content_hash__in=set(hashes.values())).order_by('pk'):
+        stored.setdefault(mt.backtest.content_hash, mt)
+    return {name: stored[content_hash] for name, content_hash in hashes.items() if content_hash in stored}
+
+
+def is_same_report(name: str, optimization: int, original: Metrics) -> bool:
+    """Whether original (a stored report with the same file as report name, see known_contents)
+       is that very report of optimization: same backtest name, period and optimization"""
+    bt_name, period = report_key(name)
+    stored = original.backtest
+    return (stored.name, stored.period_type, stored.optimization) == \
+        (bt_name, PERIOD_TYPES[period].value, optimization)
+
+
+def clone_report(job: IngestJob, name: str, original: Metrics) -> Tuple[Backtest, Metrics]:
+    """Backtest and Metrics (not saved) of report name of job from the stored report with the
+       same file, without parsing it"""
+    bt_name, period = report_key(name)
+    start, end = job_dates(job)
+    stored = original.backtest
+    backtest = Backtest(user=job.user, name=bt_name, optimization=job.optimization,
+                        period_type=PERIOD_TYPES[period], symbol=stored.symbol,
+                        timeframe=Backtest.TimeFrame(job.timeframe), ordertype=stored.ordertype,
+                        family=stored.family, initial_balance=stored.initial_balance,
+                        date_from=start, date_to=end, fingerprint=stored.fingerprint,
+                        outcome_hash=stored.outcome_hash, trades=stored.trades)
+    return backtest, copy_metrics(backtest, original)
+
+
+def plan_ingest_job(job: IngestJob) -> list:
+    """Looks for the reports of job already stored before any of them is parsed:
+        * a report whose file was already ingested (same SHA-256) for the same backtest is
+          skipped in every mode; for another backtest its models are copied from the stored
+          one and committed here
+        * in SKIP mode the backtests already stored are skipped too
+        * in UPDATE mode their ids are kept in the job so that their rows are updated
+        * in INSERT mode they are not looked up (they fail to save)
+       The skipped reports are counted and removed.
+
+    Returns:
+        (list): Names of the reports left to process
+    """
+    contents = known_contents(job.user, {name: job.hashes[name] for name in job.files if name in job.hashes})
+    skipped = {name for name, original in contents.items() if is_same_report(name, job.optimization, original)}
+    files = [name for name in job.files if name not in skipped]
+    if job.mode != IngestJob.Mode.INSERT:
+        existing = existing_reports(job, files)
+        if job.mode == IngestJob.Mode.SKIP:
+            skipped |= set(existing)
+            files = [name for name in files if name not in existing]
+        else:
+            job.existing = {name: list(ids) for name, ids in existing.items()}
+            job.save(update_fields=['existing'])
+    if skipped:
+        for name in skipped:
+            release_report(job, name)
+        IngestJob.objects.filter(pk=job.pk).update(skipped=len(skipped))
+        job.skipped = len(skipped)
+    clones = [name for name in files if name in contents]
+    for name in clones:
+        release_report(job, name)
+    commit_reports(job, [(name, *clone_report(job, name, contents[name])) for name in clones])
+    return [name for name in files if name not in contents]
+
+
+def bind_report(job: IngestJob, name: str, backtest: Backtest, metrics: Metrics) -> None:
+    """Ties the models of report name to job before they are saved: the hash of the file and
+       the ids of the stored rows they update (UPDATE mode), or None so that they are inserted"""
+    backtest.content_hash = job.hashes.get(name, '')
+    backtest.pk, metrics.pk = job.existing.get(name, (None, None))
+    backtest._state.adding = backtest.pk is None
+    metrics._state.adding = metrics.pk is None
+    metrics.backtest = backtest
+
+
+def advance_ingest_job(job: IngestJob, stage: str) -> None:
+    """Counts one more report of job through stage ('parsed' or 'computed')"""
+    IngestJob.objects.filter(pk=job.pk).update(**{stage: F(stage) + 1})
+
+
+def job_dates(job: IngestJob) -> Tuple[datetime, datetime]:
+    return (datetime.combine(job.date_from, datetime.min.time()),
+            datetime.combine(job.date_to, datetime.min.time()))
+
+
+def commit_report(job: IngestJob, backtest: Backtest, metrics: Metrics) -> None:
+    """Saves the models of one report of job"""
+    with transaction.atomic():
+        backtest.save()
+        metrics.save()
+        job.backtests.add(backtest)
+
+
+def record_report(job: IngestJob, name: str, error: str = '') -> bool:
+    """Counts one report of job as committed (or failed with error)
+
+    Returns:
+        (bool): True if it was the last report of the job
+    """
+    with transaction.atomic():
+        locked = IngestJob.objects.select_for_update().get(pk=job.pk)
+        if error:
+            locked.failed += 1
+            locked.errors = locked.errors + [{'file': name, 'error': error}]
+        else:
+            locked.processed += 1
+        locked.save(update_fields=['processed', 'failed', 'errors'])
+    return locked.done >= locked.total
+
+
+def ingest_job_file(job: IngestJob, name: str) -> bool:
+    """Processes one report of a job and commits its models. An error is recorded in the job
+       instead of raised.
+
+    Returns:
+        (bool): True if it was the last report of the job
+    """
+    start, end = job_dates(job)
+    error = ''
+    try:
+        directory, content, table = report_source(job, name)
+        backtest, metrics = ingest_report(directory, name, job.user, job.optimization, job.timeframe, start, end,
+                                          on_stage=lambda stage: advance_ingest_job(job, stage),
+                                          content=content, table=table)
+        bind_report(job, name, backtest, metrics)
+        commit_report(job, backtest, metrics)
+    except Exception as exc:
+        logger.exception('Report %s of ingest job %s failed', name, job.pk)
+        error = repr(exc)
+    finally:
+        release_report(job, name)
+    return record_report(job, name, error)
+
+
+# Outcomes ((period type, outcome_hash)) already stored, set in every worker of the pool
+_known_outcomes = frozenset()
+
+
+def _init_pool_worker(known: frozenset) -> None:
+    global _known_outcomes
+    django.setup()
+    _known_outcomes = known
+
+
+def analyse_report(directory: Path, name: str, bt_start: datetime, bt_end: datetime,
+                   content: bytes = None, table: bytes = None) -> tuple:
+    """Parses and measures one report in a worker of the pool (no database access). The
+       metrics of operations already stored are not calculated (the parent copies them).
+
+    Returns:
+        (tuple): name, (report, trades, fingerprint, outcome, metrics fields or None) or None, error
+    """
+    try:
+        bt_gbx = read_report(directory, name, content, table)
+        trades = BtTrades.from_backtest(bt_gbx)
+        fingerprint, outcome = trade_fingerprint(trades), outcome_hash(trades)
+        report = SimpleNamespace(name=bt_gbx.name, period=bt_gbx.period, symbol=bt_gbx.symbol,
+                                 ordertype=bt_gbx.ordertype)
+        fields = None
+        if (PERIOD_TYPES[bt_gbx.period].value, outcome) not in _known_outcomes:
+            fields = metrics_fields(bt_gbx, BtMetrics(bt_gbx), bt_start, bt_end, trades)
+        return name, (report, trades, fingerprint, outcome, fields), ''
+    except Exception as error:
+        return name, None, repr(error)
+
+
+def commit_reports(job: IngestJob, reports: Sequence[Tuple[str, Backtest, Metrics]]) -> None:
+    """Saves the models of many reports of job at once (see persist.persist_reports) and
+       records them. If the batch can't be saved every report is saved on its own, so that
+       only the ones that fail are recorded as failed."""
+    if not reports:
+        return
+    for name, backtest, metrics in reports:
+        bind_report(job, name, backtest, metrics)
+    try:
+        with transaction.atomic():
+            new = [(backtest, metrics) for _, backtest, metrics in reports if backtest.pk is None]
+            if new:
+                persist_reports(new)
+            if len(new) < len(reports):
+                update_reports([(backtest, metrics) for _, backtest, metrics in reports
+                                if backtest.pk is not None])
+            job.backtests.add(*[backtest for _, backtest, _ in reports])
+        errors = [''] * len(reports)
+    except Exception as exc:
+        logger.warning('Batch of %d reports of ingest job %s not saved (%r), saving them one by one',
+                       len(reports), job.pk, exc)
+        errors = []
+        for name, backtest, metrics in reports:
+            bind_report(job, name, backtest, metrics)
+            try:
+                commit_report(job, backtest, metrics)
+                errors.append('')
+            except Exception as error:
+                logger.exception('Report %s of ingest job %s failed', name, job.pk)
+                errors.append(repr(error))
+    for (name, _, _), error in zip(reports, errors):
+        record_report(job, name, error)
+
+
+def _new_pool(workers: int, known: frozenset) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(workers, initializer=_init_pool_worker, initargs=(known,))
+
+
+def ingest_job_pooled(job: IngestJob, workers: int, files: Sequence[str] = None) -> None:
+    """Processes every report of a job in a pool of processes (parse and metrics) and commits
+       the models here in batches of SANCHO_PERSIST_BATCH reports as they complete. A report
+       that fails is recorded in the job and the others go on. A report that kills its worker
+       breaks the pool for every report in flight: the pool is created again and those
+       reports are retried one at a time, so that only the one that kills a worker on its own
+       is recorded as failed. files are the reports to process (all of the job by default).
+       Only a few reports per process are submitted at a time, so the memory doesn't grow
+       with the number of reports."""
+    start, end = job_dates(job)
+    known = frozenset((period, outcome) for period, outcome in
+                      Backtest.objects.filter(user=job.user).exclude(outcome_hash='')
+                      .values_list('period_type', 'outcome_hash'))
+    names = iter(job.files if files is None else files)
+    pending, running, suspects = [], {}, deque()
+    pool = _new_pool(workers, known)
+    try:
+        while True:
+            # A lo sumo POOL_WINDOW informes por proceso en vuelo: los resultados no se acumulan.
+            # Tras una caída del pool, los informes que estaban en vuelo van de uno en uno
+            if suspects:
+                batch = [] if running else [suspects.popleft()]
+            else:
+                batch = list(islice(names, workers * POOL_WINDOW - len(running)))
+            broken = []
+            for name in batch:
+                try:
+                    directory, content, table = report_source(job, name)
+                except FileNotFoundError as error:
+                    record_report(job, name, repr(error))
+                    continue
+                try:
+                    running[pool.submit(analyse_report, directory, name, start, end, content, table)] = name
+                except BrokenProcessPool:
+                    broken.append(name)
+            if not running and not broken:
+                break
+            if not broken:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        broken.append(name)
+                    else:
+                        pending += ingest_pooled_result(job, name, future, start, end)
+            if broken:
+                broken += running.values()
+                running.clear()
+                pool.shutdown(cancel_futures=True)
+                if len(broken) == 1:
+                    logger.warning('Report %s of ingest job %s killed its worker', broken[0], job.pk)
+                    release_report(job, broken[0])
+                    record_report(job, broken[0], 'BrokenProcessPool: the worker died processing the report')
+                else:
+                    suspects.extend(broken)
+                pool = _new_pool(workers, known)
+            if len(pending) >= settings.SANCHO_PERSIST_BATCH:
+                commit_reports(job, pending)
+                pending = []
+    finally:
+        pool.shutdown(cancel_futures=True)
+    commit_reports(job, pending)
+
+
+def ingest_pooled_result(job: IngestJob, name: str, future, start: datetime, end: datetime) -> list:
+    """Models of a report analysed by the pool, ready to commit (an empty list if it failed,
+       which is recorded in the job)"""
+    result, error = None, ''
+    try:
+        _, result, error = future.result()
+        if result is not None:
+            report, trades, fingerprint, outcome, fields = result
+            backtest = build_backtest(report, job.user, job.optimization, job.timeframe, start, end,
+                                      fingerprint, trades, outcome)
+            original = find_duplicate(job.user, backtest) if fields is None else None
+            metrics = copy_metrics(backtest, original) if original is not None else \
+                Metrics(backtest=backtest, **fields)
+            IngestJob.objects.filter(pk=job.pk).update(parsed=F('parsed') + 1, computed=F('computed') + 1)
+            return [(name, backtest, metrics)]
+    except Exception as exc:
+        logger.exception('Report %s of ingest job %s failed', name, job.pk)
+        error = repr(exc)
+    finally:
+        release_report(job, name)
+    if result is None:
+        logger.warning('Report %s of ingest job %s failed: %s', name, job.pk, error)
+    record_report(job, name, error)
+    return []
+
+
+def finish_ingest_job(job: IngestJob) -> None:
+    """Stores the daily returns of the job and marks it as finished"""
+    job.refresh_from_db()
+    store_daily_returns(job.backtests.filter(period_type=Backtest.PeriodType.ISOS)
+                        .iterator(chunk_size=settings.SANCHO_PERSIST_BATCH), job.optimization)
+    job.status = IngestJob.Status.DONE if job.processed or job.skipped or not job.total else IngestJob.Status.FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'finished'])
+    if not job.source:
+        IngestFile.objects.filter(job=job).delete()
+
+
+def process_ingest_job(job: IngestJob, workers: int = 1) -> IngestJob:
+    """Processes every report of job here, in a pool of workers processes if workers > 1 (or
+       one by one), and finishes it. Used out of Celery (manage.py ingest_backtests).
+
+    Returns:
+        (IngestJob): The job, refreshed
+    """
+    IngestJob.objects.filter(pk=job.pk).update(status=IngestJob.Status.RUNNING, started=timezone.now())
+    files = plan_ingest_job(job)
+    if workers > 1 and len(files) > 1:
+        ingest_job_pooled(job, workers, files)
+    else:
+        for name in files:
+            ingest_job_file(job, name)
+    finish_ingest_job(job)
+    return job
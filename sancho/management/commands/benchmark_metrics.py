@@ -0,0 +1,42 @@
+# Python imports
+import json
+from datetime import datetime
+from pathlib import Path
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Project imports
+from sancho.benchmark import BENCHMARK_BUDGET, BENCHMARK_SIZES, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Times every BtMetrics method and the Metrics row build on synthetic backtests, "
+            "and checks the vectorized engines against BtMetrics")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES),
+                            help='Number of operations of the synthetic backtests')
+        parser.add_argument('--methods', nargs='+', default=None,
+                            help='Methods to time (all the public ones and metrics_row by default)')
+        parser.add_argument('--repeat', type=int, default=1, help='Calls per method (the best is kept)')
+        parser.add_argument('--budget', type=float, default=BENCHMARK_BUDGET,
+                            help='Skip calls estimated to take longer (seconds)')
+        parser.add_argument('--no-memory', action='store_true', help="Don't measure the peak memory")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=Path, default=None,
+                            help='Results file (benchmarks/metrics-<timestamp>.json by default)')
+
+    def handle(self, *args, **options):
+        results = run_benchmark(options['sizes'], options['methods'], options['repeat'], options['budget'],
+                                not options['no_memory'], options['seed'],
+                                log=lambda message: self.stdout.write(message))
+        output = options['output'] or Path('benchmarks') / f'metrics-{datetime.now():%Y%m%d-%H%M%S}.json'
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        failed = [p for p in results['parity'] if not p['ok']]
+        for parity in failed:
+            self.stderr.write(f"Parity failed for {parity['metric']} at {parity['size']} ops: "
+                              f"{parity['engine']} != {parity['reference']}")
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}') if not failed
+                          else f'Results written to {output} ({len(failed)} parity failures)')
@@ -0,0 +1,51 @@
+# Python imports
+from pathlib import Path
+
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+# Project imports
+from sancho.models import Metrics
+from sancho.src.parser.btexport import EXPORT_CHUNK_ROWS, EXPORT_FORMATS, METRICS_SCHEMA, MetricsExporter
+
+
+# Columns of METRICS_SCHEMA that come from the Backtest of every Metrics row
+BACKTEST_COLUMNS = {
+    'name': F('backtest__name'),
+    'optimization': F('backtest__optimization'),
+    'period': F('backtest__period_type'),
+    'symbol': F('backtest__symbol'),
+    'timeframe': F('backtest__timeframe'),
+}
+
+
+class Command(BaseCommand):
+    help = "Exports the metrics of the stored backtests to one CSV, Parquet or Arrow IPC file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=Path, help='Output file (.csv, .parquet, .arrow, .feather or .ipc)')
+        parser.add_argument('--format', choices=sorted(set(EXPORT_FORMATS.values())), default=None,
+                            help='Output format (from the suffix of the output by default)')
+        parser.add_argument('--user', default=None, help='Only the backtests of this username')
+        parser.add_argument('--symbol', default=None, help='Only the backtests of this symbol')
+        parser.add_argument('--optimization', type=int, default=None, help='Only this optimization')
+        parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS, help='Rows per write')
+
+    def handle(self, *args, **options):
+        metrics = Metrics.objects.order_by()
+        if options['user']:
+            metrics = metrics.filter(backtest__user__username=options['user'])
+        if options['symbol']:
+            metrics = metrics.filter(backtest__symbol=options['symbol'])
+        if options['optimization'] is not None:
+            metrics = metrics.filter(backtest__optimization=options['optimization'])
+        fields = [name for name in METRICS_SCHEMA if name not in BACKTEST_COLUMNS]
+        rows = metrics.values(*fields, **BACKTEST_COLUMNS).iterator(chunk_size=options['chunk_rows'])
+        try:
+            exporter = MetricsExporter(options['output'], options['format'], chunk_rows=options['chunk_rows'])
+        except (ValueError, ImportError) as error:
+            raise CommandError(error)
+        with exporter:
+            exporter.extend(rows)
+        self.stdout.write(self.style.SUCCESS(f'{exporter.rows} rows written to {exporter.path}'))
@@ -0,0 +1,91 @@
+# Python imports
+import json
+import time
+from pathlib import Path
+
+# Django imports
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+# Project imports
+from sancho.ingest import REPORT_SUFFIXES, chunked, file_hash, process_ingest_job
+from sancho.management.ingestargs import add_ingest_arguments, write_state
+from sancho.models import IngestJob
+
+
+# Progress of an interrupted run or of a run with failed reports, in the directory of the
+# reports (the next run with the same options resumes it and retries the failed reports)
+CHECKPOINT_NAME = '.ingest_backtests.json'
+# Reports per ingest job (the checkpoint is written after every job)
+DEFAULT_BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = ("Ingests the Genbox reports of a directory where they are (parse, metrics and "
+            "persistence), in batches processed by a pool of workers")
+
+    def add_arguments(self, parser):
+        add_ingest_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Reports per ingest job (and per checkpoint)')
+        parser.add_argument('--checkpoint', type=Path, default=None,
+                            help=f'Progress file used to resume an interrupted run (DIRECTORY/{CHECKPOINT_NAME})')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start again')
+
+    def handle(self, *args, **options):
+        directory = options['directory'].resolve()
+        if not directory.is_dir():
+            raise CommandError(f'{directory} is not a directory')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user {options['user']}")
+        params = {'directory': str(directory), 'user': user.username, 'optimization': options['optimization'],
+                  'timeframe': options['timeframe'], 'date_from': options['date_from'].isoformat(),
+                  'date_to': options['date_to'].isoformat(), 'mode': options['mode']}
+        checkpoint = options['checkpoint'] or directory / CHECKPOINT_NAME
+        state = self.load_checkpoint(checkpoint, params) if not options['restart'] else None
+        # done: informes guardados u omitidos; failed: los que fallaron, que se repiten al reanudar
+        state = state or {'params': params, 'done': [], 'failed': {}, 'processed': 0, 'skipped': 0}
+        if state['done']:
+            self.stdout.write(f"Resuming after {len(state['done'])} reports")
+
+        done = set(state['done'])
+        files = sorted(path.name for path in directory.iterdir()
+                       if path.suffix.lower() in REPORT_SUFFIXES and path.is_file() and path.name not in done)
+        total = len(files)
+        start, count = time.perf_counter(), 0
+        for batch in chunked(files, options['batch_size']):
+            job = IngestJob.objects.create(
+                user=user, optimization=options['optimization'], timeframe=options['timeframe'],
+                date_from=options['date_from'], date_to=options['date_to'], mode=options['mode'],
+                files=batch, source=str(directory), hashes={name: file_hash(directory / name) for name in batch})
+            job = process_ingest_job(job, max(options['workers'], 1))
+            for error in job.errors:
+                self.stderr.write(f"{error['file']}: {error['error']}")
+            count += len(batch)
+            failed = {error['file']: error['error'] for error in job.errors}
+            state.update(done=state['done'] + [name for name in batch if name not in failed],
+                         failed={**{name: error for name, error in state['failed'].items() if name not in batch},
+                                 **failed},
+                         processed=state['processed'] + job.processed, skipped=state['skipped'] + job.skipped)
+            write_state(checkpoint, state)
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed if elapsed else 0.0
+            eta = (total - count) / rate if rate else 0.0
+            self.stdout.write(f'{count}/{total} reports, {rate:.1f} files/s, ETA {eta:.0f}s'
+                              f' (job {job.pk}: {job.processed} saved, {job.skipped} skipped, {job.failed} errors)')
+        if not state['failed']:
+            checkpoint.unlink(missing_ok=True)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{state['processed']} reports saved, {state['skipped']} skipped, {len(state['failed'])} errors; "
+            f"{count} files in {elapsed:.1f}s ({count / elapsed if elapsed else 0.0:.1f} files/s)"))
+
+    def load_checkpoint(self, checkpoint: Path, params: dict):
+        """State of an interrupted run (or of a run with failed reports) with the same options,
+           or None"""
+        if not checkpoint.exists():
+            return None
+        state = json.loads(checkpoint.read_text())
+        return state if state.get('params') == params and isinstance(state.get('failed'), dict) else None
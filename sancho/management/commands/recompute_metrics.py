@@ -0,0 +1,154 @@
+# Python imports
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+# Django imports
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+# Project imports
+from sancho.ingest import recompute_fields
+from sancho.management.ingestargs import write_state
+from sancho.models import Metrics
+from sancho.src.parser.btrevisions import CRITERIA_HASH, METRIC_VERSION
+
+
+# Progress of an interrupted run or of a run with errors (the next run with the same filters
+# resumes it and retries the metrics that failed)
+DEFAULT_CHECKPOINT = Path('.recompute_metrics.json')
+# Metrics recalculated and written per batch
+DEFAULT_BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = ("Recalculates the stored Metrics from the operations stored with their backtests "
+            "(Backtest.trades), e.g. after a change of a formula or of DEFAULT_CRITERIA")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default=None, help='Only the backtests of this username')
+        parser.add_argument('--symbol', default=None, help='Only the backtests of this symbol')
+        parser.add_argument('--optimization', type=int, default=None, help='Only this optimization')
+        parser.add_argument('--metric-version', type=int, default=None,
+                            help='Only the metrics calculated with this revision of the formulas')
+        parser.add_argument('--stale', action='store_true',
+                            help='Only the metrics calculated with older formulas or criteria')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes (1 runs in this process)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Metrics written per bulk_update')
+        parser.add_argument('--checkpoint', type=Path, default=DEFAULT_CHECKPOINT,
+                            help='Progress file used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start again')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Only list the stale metrics whose backtests have no stored operations '
+                                 '(their reports must be uploaded again in UPDATE mode)')
+
+    def handle(self, *args, **options):
+        filters = {key: options[key] for key in ('user', 'symbol', 'optimization', 'metric_version')
+                   if options[key] is not None}
+        if options['legacy']:
+            return self.report_legacy(filters)
+        if options['stale']:
+            filters['stale'] = [METRIC_VERSION, CRITERIA_HASH]
+        checkpoint = options['checkpoint']
+        state = self.load_checkpoint(checkpoint, filters) if not options['restart'] else None
+        # failed: metrics id -> error, que se repiten al reanudar
+        state = state or {'filters': filters, 'last_id': 0, 'done': 0, 'failed': {}}
+        if state['last_id']:
+            self.stdout.write(f"Resuming after metrics id {state['last_id']} ({state['done']} done, "
+                              f"{len(state['failed'])} to retry)")
+
+        metrics = self.queryset(filters).filter(
+            Q(id__gt=state['last_id']) | Q(id__in=[int(metrics_id) for metrics_id in state['failed']]))
+        total = metrics.count()
+        items = metrics.values_list('id', 'backtest__trades', 'backtest__date_from', 'backtest__date_to') \
+            .iterator(chunk_size=options['batch_size'])
+        batches = iter(lambda: list(islice(items, options['batch_size'])), [])
+
+        start, done = time.perf_counter(), 0
+        workers = max(options['workers'], 1)
+        executor = ProcessPoolExecutor(workers, initializer=django.setup) if workers > 1 else None
+        try:
+            compute = (lambda batch: executor.map(recompute_fields, batch, chunksize=max(len(batch) // workers, 1))) \
+                if executor else (lambda batch: map(recompute_fields, batch))
+            for batch in batches:
+                results = list(compute(batch))
+                errors = self.write(results, options['batch_size'])
+                done += len(results)
+                ids = {str(item[0]) for item in batch}
+                state.update(last_id=max(state['last_id'], batch[-1][0]),
+                             done=state['done'] + len(results) - len(errors),
+                             failed={**{metrics_id: error for metrics_id, error in state['failed'].items()
+                                        if metrics_id not in ids}, **errors})
+                write_state(checkpoint, state)
+                elapsed = time.perf_counter() - start
+                rate = done / elapsed if elapsed else 0.0
+                eta = (total - done) / rate if rate else 0.0
+                self.stdout.write(f'{done}/{total} metrics, {rate:.1f}/s, ETA {eta:.0f}s'
+                                  + (f', {len(errors)} errors' if errors else ''))
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+        if not state['failed']:
+            checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"{state['done']} metrics recalculated ({len(state['failed'])} errors) in {time.perf_counter() - start:.1f}s"))
+
+    def report_legacy(self, filters: dict) -> None:
+        """Lists the stale metrics matching the filters that can't be recalculated here because
+           their backtests were ingested before Backtest.trades"""
+        metrics = self.queryset(filters, Metrics.objects.filter(backtest__trades__isnull=True)) \
+            .filter(metric_version__lt=METRIC_VERSION)
+        count = 0
+        for metrics_id, name, optimization, username in metrics.values_list(
+                'id', 'backtest__name', 'backtest__optimization', 'backtest__user__username').iterator():
+            self.stdout.write(f'Metrics {metrics_id}: {name} (optimization {optimization}, user {username})')
+            count += 1
+        self.stdout.write(self.style.WARNING(
+            f'{count} stale metrics without stored operations: upload their reports again in UPDATE mode'))
+
+    def queryset(self, filters: dict, metrics=None):
+        """Metrics with stored operations (or of metrics) matching the filters, by id"""
+        if metrics is None:
+            metrics = Metrics.objects.filter(backtest__trades__isnull=False)
+        metrics = metrics.order_by('id')
+        if 'user' in filters:
+            metrics = metrics.filter(backtest__user__username=filters['user'])
+        if 'symbol' in filters:
+            metrics = metrics.filter(backtest__symbol=filters['symbol'])
+        if 'optimization' in filters:
+            metrics = metrics.filter(backtest__optimization=filters['optimization'])
+        if 'metric_version' in filters:
+            metrics = metrics.filter(metric_version=filters['metric_version'])
+        if 'stale' in filters:
+            metrics = metrics.filter(Q(metric_version__lt=METRIC_VERSION) | ~Q(criteria_hash=CRITERIA_HASH))
+        return metrics
+
+    def load_checkpoint(self, checkpoint: Path, filters: dict):
+        """State of an interrupted run (or of a run with errors) with the same filters, or None"""
+        if not checkpoint.exists():
+            return None
+        state = json.loads(checkpoint.read_text())
+        return state if state.get('filters') == filters and isinstance(state.get('failed'), dict) else None
+
+    @transaction.atomic
+    def write(self, results: list, batch_size: int) -> dict:
+        """Saves the recalculated metrics with one bulk_update. Returns the errors by metrics id
+           (as text, like the keys of the checkpoint)"""
+        rows, fields, errors = [], None, {}
+        for metrics_id, values, error in results:
+            if values is None:
+                self.stderr.write(f'Metrics {metrics_id} not recalculated: {error}')
+                errors[str(metrics_id)] = error
+                continue
+            fields = fields or list(values)
+            rows.append(Metrics(id=metrics_id, **values))
+        if rows:
+            Metrics.objects.bulk_update(rows, fields, batch_size=batch_size)
+        return errors
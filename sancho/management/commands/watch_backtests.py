@@ -0,0 +1,130 @@
+# Python imports
+import json
+import time
+from pathlib import Path
+
+# Django imports
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+# Project imports
+from sancho.ingest import file_hash, process_ingest_job
+from sancho.management.ingestargs import add_ingest_arguments, write_state
+from sancho.models import IngestJob
+from sancho.watch import GROUP_TIMEOUT, SETTLE_SECONDS, ReportWatcher
+
+
+# Reports already ingested, by (size, mtime), in the directory of the reports (so that a
+# restart doesn't ingest them again). The reports that failed are left out, so they are retried
+STATE_NAME = '.watch_backtests.json'
+# Seconds between polls of the directory
+DEFAULT_INTERVAL = 2.0
+# Reports per ingest job (micro-batch)
+DEFAULT_BATCH_SIZE = 50
+# Seconds a ready report waits for more before a smaller batch is ingested
+DEFAULT_MAX_WAIT = 10.0
+
+
+class Command(BaseCommand):
+    help = ("Watches a directory where Genbox writes its reports and ingests the new ones, in "
+            "small batches processed by a pool of workers, until it is interrupted")
+
+    def add_arguments(self, parser):
+        add_ingest_arguments(parser)
+        parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='Seconds between polls')
+        parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                            help='Seconds without changes before a report is taken as written')
+        parser.add_argument('--group-timeout', type=float, default=GROUP_TIMEOUT,
+                            help='Seconds to wait for the IS/OS/ISOS reports of a backtest')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Reports per ingest job')
+        parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT,
+                            help='Seconds a ready report waits to fill a batch')
+        parser.add_argument('--state', type=Path, default=None,
+                            help=f'File with the reports already ingested (DIRECTORY/{STATE_NAME})')
+        parser.add_argument('--once', action='store_true',
+                            help='Ingest the reports already written and exit')
+
+    def handle(self, *args, **options):
+        directory = options['directory'].resolve()
+        if not directory.is_dir():
+            raise CommandError(f'{directory} is not a directory')
+        try:
+            self.user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user {options['user']}")
+        self.options = options
+        self.directory = directory
+        self.state = options['state'] or directory / STATE_NAME
+        seen = json.loads(self.state.read_text()) if self.state.exists() else {}
+        watcher = ReportWatcher(directory, settle=options['settle'], group_timeout=options['group_timeout'],
+                                seen=seen)
+        self.watcher = watcher
+        self.totals = {'files': 0, 'processed': 0, 'skipped': 0, 'failed': 0}
+        self.start = time.perf_counter()
+
+        self.stdout.write(f'Watching {directory} ({len(seen)} reports already ingested)')
+        queue, oldest = [], None
+        try:
+            while True:
+                ready = watcher.poll(flush=options['once'])
+                if ready and not queue:
+                    oldest = time.monotonic()
+                queue += ready
+                # Lotes completos en cuanto los hay; el resto, cuando lleva max_wait esperando.
+                # Un lote sigue en la cola hasta que se ha ingerido
+                while len(queue) >= options['batch_size']:
+                    self.ingest(queue[:options['batch_size']])
+                    queue = queue[options['batch_size']:]
+                    self.save_state(watcher, queue)
+                if queue and (options['once'] or time.monotonic() - oldest >= options['max_wait']):
+                    self.ingest(queue)
+                    queue = []
+                    self.save_state(watcher, queue)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            # Lo que quede en la cola (también el lote interrumpido) se vuelve a encontrar al
+            # reiniciar; lo que ya se guardó de ese lote se omite entonces por su hash
+            self.save_state(watcher, queue)
+            self.stdout.write('Interrupted')
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.totals['processed']} reports saved, {self.totals['skipped']} skipped, "
+            f"{self.totals['failed']} errors; {self.totals['files']} files in {elapsed:.1f}s"))
+
+    def ingest(self, batch: list) -> None:
+        """Runs one ingest job with the reports of batch"""
+        options = self.options
+        hashes = {}
+        for name in batch:
+            try:
+                hashes[name] = file_hash(self.directory / name)
+            except FileNotFoundError:
+                continue
+        files = list(hashes)
+        if not files:
+            return
+        job = IngestJob.objects.create(
+            user=self.user, optimization=options['optimization'], timeframe=options['timeframe'],
+            date_from=options['date_from'], date_to=options['date_to'], mode=options['mode'],
+            files=files, source=str(self.directory), hashes=hashes)
+        job = process_ingest_job(job, max(options['workers'], 1))
+        for error in job.errors:
+            self.stderr.write(f"{error['file']}: {error['error']}")
+            # No cuenta como visto: se repite en el siguiente listado completo del directorio
+            # (o al reiniciar)
+            self.watcher.seen.pop(error['file'], None)
+        self.totals['files'] += len(files)
+        self.totals['processed'] += job.processed
+        self.totals['skipped'] += job.skipped
+        self.totals['failed'] += job.failed
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(f"{len(files)} reports (job {job.pk}: {job.processed} saved, {job.skipped} skipped, "
+                          f"{job.failed} errors), {self.totals['files'] / elapsed if elapsed else 0.0:.1f} files/s")
+
+    def save_state(self, watcher: ReportWatcher, queue: list) -> None:
+        """Writes the reports already ingested, i.e. those handed out by watcher but not queued
+           (atomically, so an interruption doesn't lose the file)"""
+        queued = set(queue)
+        write_state(self.state, {name: stat for name, stat in watcher.seen.items() if name not in queued})
@@ -0,0 +1,34 @@
+# Python imports
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+# Project imports
+from sancho.models import Backtest, IngestJob
+
+
+def add_ingest_arguments(parser) -> None:
+    """Options of the reports shared by the commands that ingest a directory (ingest_backtests
+       and watch_backtests): owner, optimization, timeframe, dates, mode and workers. The dates
+       are required: they are those of the backtests, not of any sample"""
+    parser.add_argument('directory', type=Path, help='Directory with the reports')
+    parser.add_argument('--user', required=True, help='Username that owns the backtests')
+    parser.add_argument('--optimization', type=int, required=True, help='Optimization number')
+    parser.add_argument('--timeframe', required=True, choices=Backtest.TimeFrame.values)
+    parser.add_argument('--date-from', type=date.fromisoformat, required=True,
+                        help='First day of the backtests (YYYY-MM-DD)')
+    parser.add_argument('--date-to', type=date.fromisoformat, required=True,
+                        help='Last day of the backtests (YYYY-MM-DD)')
+    parser.add_argument('--mode', choices=IngestJob.Mode.values, default=IngestJob.Mode.SKIP,
+                        help='What to do with the backtests already stored')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (1 runs in this process)')
+
+
+def write_state(path: Path, state) -> None:
+    """Writes state as JSON through a temporary file, so that an interruption never leaves
+       a truncated file"""
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
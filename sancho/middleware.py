@@ -0,0 +1,33 @@
+# Python imports
+import logging
+import time
+
+# Django imports
+from django.conf import settings
+
+# Project imports
+from .src.parser import btinstrument
+
+logger = logging.getLogger('sancho.instrument')
+
+
+class InstrumentationMiddleware:
+    """Collects the timings of the parser and metrics layers for every request and writes
+       them as one JSON log line (only while btinstrument is enabled)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if settings.SANCHO_INSTRUMENT:
+            btinstrument.enable()
+
+    def __call__(self, request):
+        if not btinstrument.is_enabled():
+            return self.get_response(request)
+        start = time.perf_counter()
+        with btinstrument.collect() as collector:
+            response = self.get_response(request)
+        if collector:
+            logger.info(collector.as_log(method=request.method, path=request.path,
+                                         status=response.status_code,
+                                         total_ms=round((time.perf_counter() - start) * 1000, 3)))
+        return response
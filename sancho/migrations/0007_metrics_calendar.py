@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0006_backtest_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="metrics",
+            name="calendar",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
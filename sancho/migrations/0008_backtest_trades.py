@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0007_metrics_calendar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backtest",
+            name="trades",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0008_backtest_trades"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="metrics",
+            name="criteria_hash",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+        migrations.AddField(
+            model_name="metrics",
+            name="metric_version",
+            field=models.PositiveSmallIntegerField(db_index=True, default=1),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0010_ingestjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestjob",
+            name="computed",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="parsed",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="started",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0011_ingestjob_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestjob",
+            name="existing",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="mode",
+            field=models.CharField(
+                choices=[
+                    ("INSERT", "Insert"),
+                    ("SKIP", "Skip existing"),
+                    ("UPDATE", "Update existing"),
+                ],
+                default="INSERT",
+                max_length=6,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="skipped",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
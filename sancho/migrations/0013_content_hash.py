@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0012_ingestjob_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backtest",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="hashes",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
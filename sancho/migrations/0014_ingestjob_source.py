@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-19 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0013_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestjob",
+            name="source",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0014_ingestjob_source"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backtest",
+            name="outcome_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=32
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.1 on 2026-10-19 10:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sancho", "0015_backtest_outcome_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("content", models.BinaryField()),
+                ("table", models.BinaryField(blank=True, null=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="uploads",
+                        to="sancho.ingestjob",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("job", "name")},
+            },
+        ),
+    ]
@@ -1,9 +1,14 @@
+from pathlib import Path
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.query import QuerySet
 from django.utils import timezone
 
 # Project imports
+from .src.analysis.btcalendar import CalendarCube
+from .src.parser.btrevisions import CRITERIA_HASH, METRIC_VERSION, stale_fields
+from .src.parser.bttrades import BtTrades
 
 
 # Create your own managers here
@@ -110,6 +115,15 @@ class Backtest(models.Model):
         max_length=12, choices=Source.choices, default=Source.GENBOX
     )
 
+    # Hash de las horas de apertura y la dirección de las operaciones (duplicados exactos)
+    fingerprint = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    # Hash de todas las columnas de las operaciones: mismo outcome_hash, mismas métricas
+    outcome_hash = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    # SHA-256 del fichero del informe (el mismo fichero subido otra vez no se vuelve a procesar)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Operations del informe (BtTrades.to_bytes) para recalcular sin volver a subirlo
+    trades = models.BinaryField(null=True, blank=True)
+
     created = models.DateTimeField(default=timezone.now)
     date_from = models.DateField(default=timezone.now)
     date_to = models.DateField(default=timezone.now)
@@ -123,6 +137,10 @@ class Backtest(models.Model):
         indexes = [models.Index(fields=["name"])]
         unique_together = ('name', 'optimization', 'period_type')
 
+    def load_trades(self):
+        """BtTrades stored for the backtest, None if it was ingested without them"""
+        return BtTrades.from_bytes(self.trades) if self.trades else None
+
     def __str__(self) -> str:
         return f"""Backtest: {self.name.split()[0]} for pair: {self.symbol} 
                     and period: {self.period_type}"""
@@ -169,6 +187,11 @@ class Metrics(models.Model):
     avg_op_duration = models.DurationField()
     longest_op_duration = models.DurationField()
     shortest_op_duration = models.DurationField()
+    # PnL por día y por día de la semana x hora (ver CalendarCube)
+    calendar = models.BinaryField(null=True, blank=True)
+    # Revisión de las fórmulas (ver btrevisions) y de los criterios con que se calculó
+    metric_version = models.PositiveSmallIntegerField(default=1, db_index=True)
+    criteria_hash = models.CharField(max_length=16, blank=True, default='')
 
     objects = models.Manager()
     profitable = ProfitableBacktests()    
@@ -177,6 +200,22 @@ class Metrics(models.Model):
         ordering = ["-kratio", "-rf", "max_exposure", "closing_days", "-num_ops"]
         indexes = [models.Index(fields=["-kratio"])]
 
+    def stale_fields(self) -> set:
+        """Fields calculated with an older revision of their formula, plus is_valid if the
+           criteria changed since it was evaluated"""
+        fields = stale_fields(self.metric_version)
+        if self.criteria_hash != CRITERIA_HASH:
+            fields.add('is_valid')
+        return fields
+
+    @property
+    def is_stale(self) -> bool:
+        return self.metric_version < METRIC_VERSION or self.criteria_hash != CRITERIA_HASH
+
+    def calendar_cube(self):
+        """CalendarCube stored for the backtest, None if it was ingested without one"""
+        return CalendarCube.from_bytes(self.calendar) if self.calendar else None
+
     def __str__(self):
         valido = 'Sí' if self.is_valid is True else 'No'
         return f"""
@@ -186,3 +225,117 @@ class Metrics(models.Model):
                 Max. exposure: {self.max_exposure}, Closing Days: {self.closing_days}
                 Num. Ops: {self.num_ops}
                 """
+
+
+# IngestJob model
+class IngestJob(models.Model):
+    """Upload of reports processed in the background (see sancho/tasks.py)"""
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        DONE = "DONE", "Done"
+        FAILED = "FAILED", "Failed"
+
+    class Mode(models.TextChoices):
+        """What to do with the reports of backtests already stored (same name, optimization
+           and period of the user): fail, skip them without parsing or update their rows"""
+        INSERT = "INSERT", "Insert"
+        SKIP = "SKIP", "Skip existing"
+        UPDATE = "UPDATE", "Update existing"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING)
+    mode = models.CharField(max_length=6, choices=Mode.choices, default=Mode.INSERT)
+
+    # Datos del formulario, comunes a todos los informes
+    optimization = models.IntegerField()
+    timeframe = models.CharField(max_length=3, choices=Backtest.TimeFrame.choices)
+    date_from = models.DateField()
+    date_to = models.DateField()
+
+    # Nombres de los informes; leídos, medidos, guardados, con error ({'file': ..., 'error': ...})
+    # y omitidos por existir ya (mismo contenido, o mismo backtest en modo SKIP)
+    files = models.JSONField(default=list)
+    parsed = models.PositiveIntegerField(default=0)
+    computed = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    # Informes que ya existían (modo UPDATE): {file: [backtest id, metrics id]}
+    existing = models.JSONField(default=dict, blank=True)
+    # SHA-256 de cada informe: {file: hash}
+    hashes = models.JSONField(default=dict, blank=True)
+    # Directorio de los informes si se procesan donde están (manage.py ingest_backtests); si no,
+    # los informes subidos se guardan en la base de datos (IngestFile)
+    source = models.CharField(max_length=255, blank=True, default='')
+    backtests = models.ManyToManyField(Backtest, blank=True, related_name='ingest_jobs')
+
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created"]
+
+    @property
+    def directory(self) -> Path:
+        """Directory whose reports the job reads where they are (never removed), None if the
+           reports were uploaded: those are stored in the database (IngestFile), where every
+           worker can read them, and removed as they are processed"""
+        return Path(self.source) if self.source else None
+
+    @property
+    def total(self) -> int:
+        return len(self.files)
+
+    @property
+    def done(self) -> int:
+        """Reports already committed, failed or skipped"""
+        return self.processed + self.failed + self.skipped
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    def progress(self) -> dict:
+        """Counters of the job with its throughput (reports per second) and the estimated
+           seconds left"""
+        done = self.done
+        end = self.finished or timezone.now()
+        elapsed = (end - self.started).total_seconds() if self.started else 0.0
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        return {
+            'job': self.pk,
+            'status': self.status,
+            'total': self.total,
+            'parsed': self.parsed,
+            'computed': self.computed,
+            'committed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed_s': round(elapsed, 1),
+            'throughput': round(throughput, 3),
+            'eta_s': round((self.total - done) / throughput, 1) if throughput and not self.is_finished else None,
+            'errors': self.errors,
+        }
+
+    def __str__(self):
+        return f"Ingest job {self.pk} ({self.status}): {self.done}/{self.total}"
+
+
+# IngestFile model
+class IngestFile(models.Model):
+    """Uploaded report of an IngestJob waiting to be processed. The reports are kept in the
+       database, which the web process and the Celery workers share, until they are processed"""
+    job = models.ForeignKey(IngestJob, on_delete=models.CASCADE, related_name='uploads')
+    name = models.CharField(max_length=255)
+    content = models.BinaryField()
+    # Tabla leída mientras se subía el informe (ReportUploadHandler), si se pudo leer
+    table = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('job', 'name')
+
+    def __str__(self):
+        return f"{self.name} (ingest job {self.job_id})"
@@ -0,0 +1,139 @@
+# Python imports
+import logging
+import time
+from typing import List, NamedTuple, Sequence, Tuple
+
+# Django imports
+from django.conf import settings
+from django.db import connections, router, transaction
+
+# Project imports
+from .models import Backtest, Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PersistStats(NamedTuple):
+    """Rows written by persist_reports or update_reports, how long it took and how ('copy',
+       'bulk_create' or 'bulk_update')"""
+    rows: int
+    seconds: float
+    method: str
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def copy_supported(using: str) -> bool:
+    """True if the database is PostgreSQL through psycopg 3 (COPY FROM STDIN from Python)"""
+    if connections[using].vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def _allocate_ids(connection, model, count: int) -> List[int]:
+    """count values of the sequence of the primary key of model, in one query"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                       [model._meta.db_table, model._meta.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_objects(connection, model, objs: Sequence) -> None:
+    """Inserts objs (with their primary key already set) with one COPY"""
+    fields = model._meta.concrete_fields
+    quote = connection.ops.quote_name
+    sql = f'COPY {quote(model._meta.db_table)} ({", ".join(quote(field.column) for field in fields)}) FROM STDIN'
+    with connection.cursor() as cursor:
+        with cursor.copy(sql) as copy:
+            for obj in objs:
+                copy.write_row([field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields])
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = connection.alias
+
+
+def _resolve_backtest_ids(backtests: Sequence[Backtest], using: str) -> None:
+    """Primary keys of saved backtests that didn't get them back from the insert, found by
+       their unique key (name, optimization, period_type) in one query"""
+    missing = {(bt.name, bt.optimization, bt.period_type): bt for bt in backtests if bt.pk is None}
+    if not missing:
+        return
+    rows = Backtest.objects.using(using).filter(
+        name__in={name for name, _, _ in missing},
+        optimization__in={opti for _, opti, _ in missing},
+    ).values_list('pk', 'name', 'optimization', 'period_type')
+    for pk, *key in rows:
+        if tuple(key) in missing:
+            missing[tuple(key)].pk = pk
+
+
+def persist_reports(pairs: Sequence[Tuple[Backtest, Metrics]], batch_size: int = None,
+                    using: str = None) -> PersistStats:
+    """Saves the Backtest and Metrics (not saved yet) of many reports in one transaction:
+        * PostgreSQL with psycopg 3: the ids come from the sequences in one query and every
+          table is written with one COPY
+        * other databases: bulk_create in batches of batch_size rows (SANCHO_PERSIST_BATCH)
+       Either way the Metrics point to the ids of their Backtest when this returns.
+
+    Args:
+        pairs (Sequence):   (Backtest, Metrics) of every report
+        batch_size (int):   Rows per INSERT of bulk_create
+        using (str):        Database alias (the default for writing Backtest by default)
+
+    Returns:
+        (PersistStats): Rows written, seconds and method
+    """
+    batch_size = batch_size or settings.SANCHO_PERSIST_BATCH
+    using = using or router.db_for_write(Backtest)
+    backtests = [backtest for backtest, _ in pairs]
+    metrics = [mt for _, mt in pairs]
+    start = time.perf_counter()
+    with transaction.atomic(using=using):
+        if copy_supported(using):
+            method = 'copy'
+            connection = connections[using]
+            for backtest, pk in zip(backtests, _allocate_ids(connection, Backtest, len(backtests))):
+                backtest.pk = pk
+            _copy_objects(connection, Backtest, backtests)
+            for (backtest, mt), pk in zip(pairs, _allocate_ids(connection, Metrics, len(metrics))):
+                mt.pk, mt.backtest = pk, backtest
+            _copy_objects(connection, Metrics, metrics)
+        else:
+            method = 'bulk_create'
+            Backtest.objects.using(using).bulk_create(backtests, batch_size=batch_size)
+            _resolve_backtest_ids(backtests, using)
+            for backtest, mt in pairs:
+                mt.backtest = backtest
+            Metrics.objects.using(using).bulk_create(metrics, batch_size=batch_size)
+    stats = PersistStats(len(backtests) + len(metrics), time.perf_counter() - start, method)
+    logger.info('Persisted %d rows with %s in %.3fs (%.0f rows/s)',
+                stats.rows, stats.method, stats.seconds, stats.rows_per_second)
+    return stats
+
+
+def update_reports(pairs: Sequence[Tuple[Backtest, Metrics]], batch_size: int = None,
+                   using: str = None) -> PersistStats:
+    """Writes the Backtest and Metrics of reports already stored (their models carry the ids
+       of the stored rows) with bulk_update in batches of batch_size rows. Metrics without an
+       id are inserted.
+
+    Returns:
+        (PersistStats): Rows written, seconds and method
+    """
+    batch_size = batch_size or settings.SANCHO_PERSIST_BATCH
+    using = using or router.db_for_write(Backtest)
+    start = time.perf_counter()
+    with transaction.atomic(using=using):
+        for model, objs in ((Backtest, [backtest for backtest, _ in pairs]),
+                            (Metrics, [mt for _, mt in pairs if mt.pk is not None])):
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            model.objects.using(using).bulk_update(objs, fields, batch_size=batch_size)
+        for backtest, mt in pairs:
+            mt.backtest = backtest
+        Metrics.objects.using(using).bulk_create([mt for _, mt in pairs if mt.pk is None], batch_size=batch_size)
+    stats = PersistStats(2 * len(pairs), time.perf_counter() - start, 'bulk_update')
+    logger.info('Updated %d rows in %.3fs (%.0f rows/s)', stats.rows, stats.seconds, stats.rows_per_second)
+    return stats
@@ -2,6 +2,23 @@ from .parser import (
     btparser,
     btgenbox,
     btmetrics,
+    btkernels,
+    bttrades,
+    btblob,
+    btinstrument,
+    btsynthetic,
+    btexport,
+)
+from .analysis import (
+    btcalendar,
+    btcorrelation,
+    btcosts,
+    btcriteria,
+    btpareto,
+    btportfolio,
+    btsimilarity,
+    btsizing,
+    btsnooping,
 )
 
 __version__ = '0.1.0'
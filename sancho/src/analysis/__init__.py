@@ -0,0 +1,20 @@
+from .btcalendar import CalendarCube, calendar_matrix
+from .btcorrelation import DailyReturns
+from .btcosts import CostModel, CostScenarios, cost_grid
+from .btcriteria import CompiledCriteria, metrics_table
+from .btpareto import crowding_distance, non_dominated_fronts, pareto_ranking
+from .btportfolio import (
+    BtPortfolio,
+    PortfolioSearch,
+    merge_trades,
+)
+from .btsimilarity import SimilarityIndex, equity_vector, outcome_hash, trade_fingerprint
+from .btsizing import (
+    FixedFractional,
+    FixedLot,
+    SizingSimulator,
+    VolatilityScaled,
+)
+from .btsnooping import RealityCheck
+
+__version__ = '0.1.0'
@@ -0,0 +1,163 @@
+# Standard library imports
+from typing import Dict, Mapping
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser.btblob import pack_arrays, unpack_arrays
+from ..parser.btkernels import DAY_NS
+from ..parser.bttrades import BtTrades
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Buckets rolled up from the daily buckets and from the weekday x hour table
+DAY_FREQUENCIES = ('day', 'week', 'month', 'year')
+WEEKHOUR_FREQUENCIES = ('weekday', 'hour', 'weekhour')
+# Columns of every rolled up table
+CALENDAR_COLUMNS = ('Pips', 'Profit', 'Trades', 'Wins', 'Win Rate')
+# 1970-01-01 was a Thursday: days + 3 are days since a Monday
+EPOCH_WEEKDAY = 3
+##########################################################################################################
+
+
+def _bucket_keys(days: np.ndarray, freq: str) -> np.ndarray:
+    """Bucket of every day (days since 1970-01-01) as the first day of the bucket"""
+    match freq:
+        case 'day':
+            return days
+        case 'week':
+            return days - (days + EPOCH_WEEKDAY) % 7
+        case 'month' | 'year':
+            unit = 'M' if freq == 'month' else 'Y'
+            return days.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype('datetime64[D]').astype(np.int64)
+        case _:
+            raise ValueError(f'Unknown frequency {freq!r}, expected one of {DAY_FREQUENCIES + WEEKHOUR_FREQUENCIES}')
+
+
+def _table(pips: np.ndarray, profit: np.ndarray, trades: np.ndarray, wins: np.ndarray, index: pd.Index) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Pips': pips,
+        'Profit': profit,
+        'Trades': trades,
+        'Wins': wins,
+        'Win Rate': np.divide(wins, trades, out=np.zeros(np.shape(trades)), where=np.asarray(trades) > 0),
+    }, index=index)
+
+
+class CalendarCube:
+    """
+    PnL, number of operations and winners of a backtest by calendar bucket, aggregated by
+    close time. Only the finest buckets are kept:
+        * days with operations (sparse, days since 1970-01-01)
+        * a weekday x hour table (7 x 24, Monday = 0)
+    Weeks, months and years are rolled up from the days, and weekdays and hours from the
+    weekday x hour table, without going back to the operations. Winners are counted in pips.
+
+    Instance variables:
+        days (np.ndarray):                          Days with operations (int32, sorted)
+        pips, profit, trades, wins (np.ndarray):    Values for every day
+        weekhour (Dict[str, np.ndarray]):           pips, profit, trades and wins by weekday x hour
+
+    Instance methods:
+        * from_trades
+        * rollup
+        * to_bytes
+        * from_bytes
+    """
+
+    def __init__(self, days: np.ndarray, pips: np.ndarray, profit: np.ndarray, trades: np.ndarray,
+                 wins: np.ndarray, weekhour: Dict[str, np.ndarray]) -> None:
+        self.days = np.asarray(days, dtype=np.int32)
+        self.pips = np.asarray(pips, dtype=np.float64)
+        self.profit = np.asarray(profit, dtype=np.float64)
+        self.trades = np.asarray(trades, dtype=np.int32)
+        self.wins = np.asarray(wins, dtype=np.int32)
+        self.weekhour = {column: np.asarray(values).reshape(7, 24) for column, values in weekhour.items()}
+
+    def __len__(self) -> int:
+        return self.days.size
+
+    @classmethod
+    def from_trades(cls, trades: BtTrades) -> 'CalendarCube':
+        """Aggregates the operations with bincounts over the day and the weekday x hour of their close"""
+        close = trades.close_time.view(np.int64)
+        day = close // DAY_NS
+        hour = (close % DAY_NS) // (DAY_NS // 24)
+        weekhour = ((day + EPOCH_WEEKDAY) % 7) * 24 + hour
+        win = (trades.pips > 0).astype(np.int64)
+        days, bucket = np.unique(day, return_inverse=True)
+        bucket = bucket.reshape(-1)
+
+        def by_day(weights=None):
+            return np.bincount(bucket, weights=weights, minlength=days.size)
+
+        def by_weekhour(weights=None):
+            return np.bincount(weekhour, weights=weights, minlength=7 * 24)
+
+        return cls(
+            days=days,
+            pips=by_day(trades.pips),
+            profit=by_day(trades.profit),
+            trades=by_day(),
+            wins=by_day(win),
+            weekhour={
+                'pips': by_weekhour(trades.pips),
+                'profit': by_weekhour(trades.profit),
+                'trades': by_weekhour().astype(np.int32),
+                'wins': by_weekhour(win).astype(np.int32),
+            },
+        )
+
+    def rollup(self, freq: str = 'month') -> pd.DataFrame:
+        """Table (one row per bucket) with the columns in CALENDAR_COLUMNS
+
+        Args:
+            freq (str): 'day', 'week', 'month', 'year' (indexed by the first day of the
+                        bucket, only buckets with operations), 'weekday' (0 = Monday),
+                        'hour' or 'weekhour' (weekday, hour)
+        """
+        if freq in WEEKHOUR_FREQUENCIES:
+            wh = self.weekhour
+            match freq:
+                case 'weekday':
+                    sums = {column: values.sum(axis=1) for column, values in wh.items()}
+                    index = pd.RangeIndex(7, name='Weekday')
+                case 'hour':
+                    sums = {column: values.sum(axis=0) for column, values in wh.items()}
+                    index = pd.RangeIndex(24, name='Hour')
+                case _:
+                    sums = {column: values.ravel() for column, values in wh.items()}
+                    index = pd.MultiIndex.from_product([range(7), range(24)], names=['Weekday', 'Hour'])
+            return _table(sums['pips'], sums['profit'], sums['trades'], sums['wins'], index)
+        keys = _bucket_keys(self.days.astype(np.int64), freq)
+        buckets, starts = np.unique(keys, return_index=True)
+        index = pd.DatetimeIndex(buckets.astype('datetime64[D]'), name=freq.title())
+        if not buckets.size:
+            return _table([], [], [], [], index)
+        return _table(np.add.reduceat(self.pips, starts), np.add.reduceat(self.profit, starts),
+                      np.add.reduceat(self.trades, starts), np.add.reduceat(self.wins, starts), index)
+
+    def to_bytes(self) -> bytes:
+        """Compact blob (see btblob) to store the cube"""
+        arrays = {'days': self.days, 'pips': self.pips, 'profit': self.profit,
+                  'trades': self.trades, 'wins': self.wins}
+        arrays.update({f'weekhour_{column}': values for column, values in self.weekhour.items()})
+        return pack_arrays(arrays)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'CalendarCube':
+        arrays, _ = unpack_arrays(blob)
+        weekhour = {name[len('weekhour_'):]: values for name, values in arrays.items() if name.startswith('weekhour_')}
+        return cls(arrays['days'], arrays['pips'], arrays['profit'], arrays['trades'], arrays['wins'], weekhour)
+
+
+def calendar_matrix(cubes: Mapping[str, CalendarCube], freq: str = 'month', column: str = 'Pips') -> pd.DataFrame:
+    """One column of the rolled up cubes of many backtests as a (backtests x buckets) table,
+       with zeros where a backtest has no operations"""
+    rows = {name: cube.rollup(freq)[column] for name, cube in cubes.items() if cube is not None}
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).T.sort_index(axis=1).fillna(0)
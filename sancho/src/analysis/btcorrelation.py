@@ -0,0 +1,287 @@
+# Standard library imports
+import datetime as dt
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple, Union
+try:
+    import fcntl
+except ImportError:     # Windows: the store is not shared between processes there
+    fcntl = None
+
+# Non-standard library imports
+import numpy as np
+
+# Project imports
+from ..parser.btkernels import DAY_NS
+from ..parser.bttrades import BtTrades
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Files that make up a DailyReturns store
+META_FILE = 'meta.json'
+RETURNS_FILE = 'returns.f32'
+STATS_FILE = 'stats.npy'
+CORRELATION_FILE = 'correlation.f32'
+# Lock file of the writers (add and update_correlation), exclusive between processes
+LOCK_FILE = '.lock'
+# Rows per tile when computing correlations (a tile of 512 x 512 float32 fits in L2)
+CORRELATION_BLOCK = 512
+##########################################################################################################
+
+
+def _day_number(value: Union[dt.date, str]) -> int:
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+def resample_daily(trades: BtTrades, first_day: int, num_days: int, pips_mode: bool = True) -> np.ndarray:
+    """Sums the PnL of the operations closed on every day of the calendar that starts on
+       first_day (days since 1970-01-01) and has num_days days
+
+    Raises:
+        ValueError: If some operation closes outside the calendar
+    """
+    days = trades.close_time.view(np.int64) // DAY_NS - first_day
+    if days.size and (days.min() < 0 or days.max() >= num_days):
+        raise ValueError(f'{trades.name} has operations outside the calendar')
+    return np.bincount(days, weights=trades.pnl(pips_mode), minlength=num_days).astype(np.float32)
+
+
+def _tri_offset(row: int) -> int:
+    """Offset of row in the packed lower triangle (row i holds i + 1 values)"""
+    return row * (row + 1) // 2
+
+
+class DailyReturns:
+    """
+    Store with the closed-trade PnL of many backtests resampled on one daily calendar.
+
+    The matrix (backtests x days) is kept as float32 in a memory-mapped file and rows are
+    appended as backtests are ingested. Correlations are computed from standardised rows
+    in square tiles, and stored as a packed lower triangle that is only extended with the
+    rows of the new backtests, so an ingestion never recomputes the existing pairs.
+
+    Files in path:
+        meta.json:          calendar, pips mode, names and number of correlated rows
+        returns.f32:        daily PnL rows (float32, C order)
+        stats.npy:          mean and norm of every row (float64, shape (n, 2))
+        correlation.f32:    packed lower triangle of the correlation matrix
+        .lock:              lock of the writers
+
+    add and update_correlation hold an exclusive lock on .lock and reload the store before
+    writing, so that several ingest processes can share it; meta.json is written last (and
+    atomically), so an interrupted write leaves the store as it was before it.
+
+    Instance properties:
+        * names
+        * days
+        * returns
+
+    Instance methods:
+        * resample
+        * add
+        * update_correlation
+        * correlation
+        * correlation_blocks
+        * top_k
+    """
+
+    def __init__(self, path: Path, start: Union[dt.date, str] = None, end: Union[dt.date, str] = None,
+                 pips_mode: bool = True) -> None:
+        """Opens the store in path, or creates it with the calendar [start, end] if it doesn't exist
+
+        Args:
+            path (Path):        Directory for the store files
+            start, end (date):  First and last day of the calendar (only to create the store)
+            pips_mode (bool):   Resample Pips (True) or Profit (False)
+        """
+        self.path = Path(path)
+        if not (self.path / META_FILE).exists():
+            if start is None or end is None:
+                raise ValueError(f'{self.path} is not a DailyReturns store and no calendar was given')
+            first, last = _day_number(start), _day_number(end)
+            if last < first:
+                raise ValueError('The calendar ends before it starts')
+            self.path.mkdir(parents=True, exist_ok=True)
+            with self._locked():
+                if not (self.path / META_FILE).exists():
+                    self._meta = {'first_day': first, 'num_days': last - first + 1,
+                                  'pips_mode': pips_mode, 'names': [], 'corr_rows': 0}
+                    (self.path / RETURNS_FILE).touch()
+                    (self.path / CORRELATION_FILE).touch()
+                    self._save_stats(np.empty((0, 2)))
+                    self._save_meta()
+        self._reload()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock of the writers of the store (see the class docstring)"""
+        with open(self.path / LOCK_FILE, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _reload(self) -> None:
+        """Reads the store as another process may have left it"""
+        self._meta = json.loads((self.path / META_FILE).read_text())
+        self._index = {name: row for row, name in enumerate(self._meta['names'])}
+        self._stats = np.load(self.path / STATS_FILE)[:len(self._meta['names'])]
+        self._returns = None
+
+    def _save_meta(self) -> None:
+        tmp = self.path / (META_FILE + '.tmp')
+        tmp.write_text(json.dumps(self._meta))
+        os.replace(tmp, self.path / META_FILE)
+
+    def _save_stats(self, stats: np.ndarray) -> None:
+        tmp = self.path / (STATS_FILE + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, stats)
+        os.replace(tmp, self.path / STATS_FILE)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._meta['names'])
+
+    @property
+    def days(self) -> np.ndarray:
+        first = self._meta['first_day']
+        return np.arange(first, first + self._meta['num_days']).astype('datetime64[D]')
+
+    @property
+    def returns(self) -> np.ndarray:
+        """Read-only memory map of the matrix (backtests x days)"""
+        if self._returns is None:
+            shape = (len(self._meta['names']), self._meta['num_days'])
+            if shape[0] == 0:
+                return np.empty(shape, dtype=np.float32)
+            self._returns = np.memmap(self.path / RETURNS_FILE, dtype=np.float32, mode='r', shape=shape)
+        return self._returns
+
+    def resample(self, trades: BtTrades) -> np.ndarray:
+        """Sums the PnL of the operations closed on every day of the calendar"""
+        return resample_daily(trades, self._meta['first_day'], self._meta['num_days'], self._meta['pips_mode'])
+
+    def add(self, trades: Sequence[BtTrades]) -> List[int]:
+        """Resamples and stores the backtests. A backtest whose name is already stored
+           replaces its row, and the correlations from that row on are recomputed. Every
+           backtest is resampled before anything is written, so if one of them doesn't fit
+           the calendar none is stored.
+
+        Returns:
+            (List[int]): Row of every backtest in the matrix
+
+        Raises:
+            ValueError: If some operation closes outside the calendar
+        """
+        resampled = {}
+        for bt in trades:
+            values = self.resample(bt)
+            centred = values.astype(float) - values.mean(dtype=float)
+            resampled[bt.name] = (values, (values.mean(dtype=float), float(np.sqrt(centred @ centred))))
+        if not resampled:
+            return []
+        with self._locked():
+            self._reload()
+            names = self._meta['names'] + [name for name in resampled if name not in self._index]
+            index = {name: row for row, name in enumerate(names)}
+            stored = len(self._meta['names'])
+            replaced = min([index[name] for name in resampled if index[name] < stored], default=stored)
+            if replaced < self._meta['corr_rows']:
+                # Antes de tocar las filas, para que una escritura interrumpida no deje
+                # correlaciones de filas que ya han cambiado
+                self._meta['corr_rows'] = replaced
+                self._save_meta()
+            stats = np.vstack([self._stats, np.zeros((len(names) - stored, 2))])
+            row_bytes = self._meta['num_days'] * np.dtype(np.float32).itemsize
+            with open(self.path / RETURNS_FILE, 'r+b') as f:
+                for name, (values, stat) in resampled.items():
+                    f.seek(index[name] * row_bytes)
+                    f.write(values.tobytes())
+                    stats[index[name]] = stat
+                # Filas de sobra de una escritura interrumpida
+                f.truncate(len(names) * row_bytes)
+            self._save_stats(stats)
+            self._meta['names'] = names
+            self._save_meta()
+            self._reload()
+        return [self._index[bt.name] for bt in trades]
+
+    def _standardised(self, start: int, stop: int) -> np.ndarray:
+        """Rows scaled so that the dot product of two of them is their correlation"""
+        block = np.asarray(self.returns[start:stop], dtype=np.float32)
+        mean, norm = self._stats[start:stop, 0], self._stats[start:stop, 1]
+        scale = np.divide(1.0, norm, out=np.zeros_like(norm), where=norm > 0)
+        return ((block - mean[:, None].astype(np.float32)) * scale[:, None].astype(np.float32))
+
+    def correlation_blocks(self, block: int = CORRELATION_BLOCK, rows: range = None) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """Yields (row, column, tile) for the tiles of the lower triangle of the correlation
+           matrix, for the given rows against every row up to them."""
+        n = len(self._meta['names'])
+        rows = rows if rows is not None else range(n)
+        for i in range(rows.start, rows.stop, block):
+            stop_i = min(i + block, rows.stop)
+            zi = self._standardised(i, stop_i)
+            for j in range(0, stop_i, block):
+                stop_j = min(j + block, stop_i)
+                zj = zi[j - i:stop_j - i] if j >= i else self._standardised(j, stop_j)
+                yield i, j, zi @ zj.T
+
+    def update_correlation(self, block: int = CORRELATION_BLOCK) -> int:
+        """Extends the stored correlation triangle with the rows added since the last update
+
+        Returns:
+            (int): Number of rows computed
+        """
+        with self._locked():
+            self._reload()
+            done, n = self._meta['corr_rows'], len(self._meta['names'])
+            if done >= n:
+                return 0
+            # Lo que haya tras las filas ya correlacionadas es de una escritura interrumpida
+            with open(self.path / CORRELATION_FILE, 'r+b') as f:
+                f.truncate(_tri_offset(done) * 4)
+            for i in range(done, n, block):
+                stop = min(i + block, n)
+                band = np.empty((stop - i, stop), dtype=np.float32)
+                for row, col, tile in self.correlation_blocks(block, range(i, stop)):
+                    band[:, col:col + tile.shape[1]] = tile
+                with open(self.path / CORRELATION_FILE, 'ab') as f:
+                    for k in range(stop - i):
+                        f.write(band[k, :i + k + 1].tobytes())
+            self._meta['corr_rows'] = n
+            self._save_meta()
+        return n - done
+
+    def correlation(self, a: str, b: str) -> float:
+        """Stored correlation between two backtests (update_correlation must be up to date)"""
+        i, j = sorted((self._index[a], self._index[b]), reverse=True)
+        if i >= self._meta['corr_rows']:
+            self.update_correlation()
+        tri = np.memmap(self.path / CORRELATION_FILE, dtype=np.float32, mode='r',
+                        shape=(_tri_offset(self._meta['corr_rows']),))
+        return float(tri[_tri_offset(i) + j])
+
+    def top_k(self, name: str, k: int = 10, block: int = CORRELATION_BLOCK) -> List[Tuple[str, float]]:
+        """The k backtests most correlated with name. It streams the matrix in blocks of rows,
+           so the N x N matrix is never built."""
+        row = self._index[name]
+        target = self._standardised(row, row + 1)[0]
+        n = len(self._meta['names'])
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, block):
+            scores[start:start + block] = self._standardised(start, min(start + block, n)) @ target
+        scores[row] = -np.inf
+        k = min(k, n - 1)
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        names = self._meta['names']
+        return [(names[i], float(scores[i])) for i in best]
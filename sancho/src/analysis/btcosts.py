@@ -0,0 +1,135 @@
+# Standard library imports
+from itertools import product
+from typing import Dict, List, NamedTuple, Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser import btkernels
+from ..parser.btgenbox import BtGenbox
+from ..parser.btmetrics import DEFAULT_CRITERIA
+from ..parser.bttrades import BtTrades
+from .btcriteria import CompiledCriteria
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Default grid: slippage in pips per operation and commission in money per lot
+DEFAULT_SLIPPAGES = (0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0)
+DEFAULT_COMMISSIONS = (0.0, 3.5, 7.0)
+##########################################################################################################
+
+
+class CostModel(NamedTuple):
+    """Extra costs applied to every operation of a backtest
+
+    Fields:
+        slippage_pips (float):      Pips lost per operation (open + close)
+        commission_per_lot (float): Money paid per lot traded
+        recorded_costs (bool):      Also charge the Commission, Taxes and Swap in the report
+    """
+    slippage_pips: float = 0.0
+    commission_per_lot: float = 0.0
+    recorded_costs: bool = False
+
+    @property
+    def label(self) -> str:
+        label = f'slip={self.slippage_pips:g} comm={self.commission_per_lot:g}'
+        return label + ' +report' if self.recorded_costs else label
+
+
+def cost_grid(slippages: Sequence[float] = DEFAULT_SLIPPAGES,
+              commissions: Sequence[float] = DEFAULT_COMMISSIONS,
+              recorded_costs: Sequence[bool] = (False,)) -> List[CostModel]:
+    """Every combination of the given slippages, commissions and recorded costs"""
+    return [CostModel(s, c, r) for r, c, s in product(recorded_costs, commissions, slippages)]
+
+
+def money_per_pip(trades: BtTrades) -> np.ndarray:
+    """Value of one pip for every operation, inferred from its Profit and Pips. Operations
+       too close to break even (where Profit is mostly rounding) take the median value per
+       lot of the rest of the backtest."""
+    pips, profit, volume = trades.pips, trades.profit, trades.volume
+    known = (np.abs(pips) >= 1.0) & (volume > 0)
+    per_lot = np.divide(profit, pips * volume, out=np.full(pips.shape, np.nan), where=known)
+    per_lot[per_lot <= 0] = np.nan
+    fallback = np.nanmedian(per_lot) if np.isfinite(per_lot).any() else 1.0
+    return np.where(np.isfinite(per_lot), per_lot, fallback) * volume
+
+
+class CostScenarios:
+    """
+    Applies a grid of cost models to the operations of one backtest. The PnL of every
+    scenario is built in one broadcasted (scenarios x operations) matrix and the metrics
+    are computed for all the scenarios at once with the vectorized kernels.
+
+    Instance variables:
+        trades (BtTrades):          Operations of the backtest (with their recorded costs)
+        models (List[CostModel]):   Cost scenarios
+        pips_mode (bool):           Metrics in pips (True) or in money (False)
+
+    Instance methods:
+        * pnl
+        * metrics
+        * validity
+    """
+
+    def __init__(self, bt: Union[BtTrades, BtGenbox], models: Sequence[CostModel] = None,
+                 pips_mode: bool = True) -> None:
+        self.trades = bt if isinstance(bt, BtTrades) else BtTrades.from_backtest(bt)
+        self.models = list(models) if models is not None else cost_grid()
+        self.pips_mode = pips_mode
+        self._metrics = None
+
+    def pnl(self) -> np.ndarray:
+        """PnL (in pips or money) of every operation under every scenario, shape (scenarios, ops)"""
+        trades = self.trades
+        slippage = np.array([m.slippage_pips for m in self.models])[:, None]
+        commission = np.array([m.commission_per_lot for m in self.models])[:, None] * trades.volume
+        recorded = np.array([m.recorded_costs for m in self.models])[:, None] * \
+            (trades.commission + trades.taxes + trades.swap)
+        pip_value = money_per_pip(trades)
+        if self.pips_mode:
+            safe = np.where(pip_value != 0, pip_value, 1.0)
+            return trades.pips - slippage - (commission - recorded) / safe
+        return trades.profit - slippage * pip_value - commission + recorded
+
+    def metrics(self) -> pd.DataFrame:
+        """Table (one row per scenario) with the metrics named as in DEFAULT_CRITERIA/ALL_METRICS"""
+        if self._metrics is not None:
+            return self._metrics
+        pnl = self.pnl()
+        trades = self.trades
+        # The metrics that don't depend on the PnL are the same for every scenario
+        table = pd.DataFrame({
+            'Kratio': btkernels.kratio(pnl),
+            'RF': btkernels.recovery_factor(pnl),
+            'PF': btkernels.profit_factor(pnl),
+            'EP': btkernels.expectancy(pnl),
+            'DD': btkernels.max_drawdown(pnl),
+            'SQN': btkernels.sqn(pnl),
+            'Pct. Win': btkernels.pct_win(pnl),
+            'Avg Win': btkernels.avg_win(pnl),
+            'Avg Loss': btkernels.avg_loss(pnl),
+            'Gross Profit': btkernels.gross_profit(pnl),
+            'Gross Loss': btkernels.gross_loss(pnl),
+            'Num Ops': len(trades),
+            'Max. Exposure': btkernels.max_exposure(trades.open_time, trades.close_time, trades.volume),
+            'Closing Days': btkernels.closing_days(trades.close_time),
+        }, index=pd.Index([m.label for m in self.models], name='Scenario'))
+        table.insert(0, 'Commission', [m.commission_per_lot for m in self.models])
+        table.insert(0, 'Slippage', [m.slippage_pips for m in self.models])
+        self._metrics = table
+        return table
+
+    def validity(self, criteria: Dict[str, Dict[str, float]] = DEFAULT_CRITERIA) -> pd.DataFrame:
+        """Table (one row per scenario) telling whether every criterion holds, whether the
+           set is valid, and the names of the criteria that failed"""
+        passed = CompiledCriteria(criteria).passed(self.metrics())
+        names = np.array(passed.columns, dtype=object)
+        failed = ~passed.to_numpy(dtype=bool)
+        passed['Valid'] = ~failed.any(axis=1)
+        passed['Failed'] = [', '.join(names[row]) for row in failed]
+        return passed
@@ -0,0 +1,138 @@
+# Standard library imports
+from typing import Dict, List, Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser.btmetrics import DEFAULT_CRITERIA
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Field of the Metrics model that holds every criterion
+CRITERIA_FIELDS = {
+    'Kratio': 'kratio',
+    'RF': 'rf',
+    'PF': 'pf',
+    'EP': 'ep',
+    'DD': 'dd',
+    'SQN': 'sqn',
+    'Sharpe': 'sharpe_ratio',
+    'Pct. Win': 'pct_winner',
+    'Avg Win': 'avg_win',
+    'Avg Loss': 'avg_loss',
+    'Num Ops': 'num_ops',
+    'Max. Exposure': 'max_exposure',
+    'Closing Days': 'closing_days',
+    'Max. Lots': 'max_lots',
+    'Min. Lots': 'min_lots',
+}
+# Rows sampled to estimate how selective every predicate is
+SELECTIVITY_SAMPLE = 4096
+# Value of failed for the rows that pass every criterion
+PASSED = -1
+##########################################################################################################
+
+
+Table = Union[pd.DataFrame, Dict[str, np.ndarray]]
+
+
+def _num_rows(table: Table) -> int:
+    if isinstance(table, pd.DataFrame):
+        return len(table)
+    return len(next(iter(table.values()), ()))
+
+
+class CompiledCriteria:
+    """
+    A criteria dict (as DEFAULT_CRITERIA) compiled into arrays of min and max values, so
+    it can be evaluated over the metrics of many backtests at once.
+
+    The predicates are evaluated in the order of names, and every predicate only looks at
+    the rows that survived the previous ones: a row stops being evaluated at the first
+    criterion it fails. order_by_selectivity reorders them from the most to the least
+    selective (estimated on a sample of the rows), which is what saves work on big tables.
+
+    Instance variables:
+        names (List[str]):  Criteria in evaluation order
+        mins, maxs (np.ndarray): Limits of every criterion, in the same order
+
+    Instance methods:
+        * columns
+        * order_by_selectivity
+        * failed
+        * valid
+        * passed
+        * screen
+    """
+
+    def __init__(self, criteria: Dict[str, Dict[str, float]] = DEFAULT_CRITERIA) -> None:
+        self.names = list(criteria)
+        self.mins = np.array([float(criteria[c]['Min']) for c in self.names])
+        self.maxs = np.array([float(criteria[c]['Max']) for c in self.names])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def columns(self, table: Table) -> List[np.ndarray]:
+        """Float column of every criterion (in the order of names) from a table of metrics"""
+        return [np.asarray(table[name], dtype=float) for name in self.names]
+
+    def _test(self, k: int, values: np.ndarray) -> np.ndarray:
+        return (values >= self.mins[k]) & (values <= self.maxs[k])
+
+    def order_by_selectivity(self, table: Table, sample: int = SELECTIVITY_SAMPLE) -> 'CompiledCriteria':
+        """Reorders the criteria so the ones that fewer rows pass (on an even sample of
+           the table) are evaluated first. Returns self."""
+        columns = self.columns(table)
+        if not columns or not len(columns[0]):
+            return self
+        step = max(len(columns[0]) // sample, 1)
+        pass_rate = [self._test(k, column[::step]).mean() for k, column in enumerate(columns)]
+        order = np.argsort(pass_rate, kind='stable')
+        self.names = [self.names[k] for k in order]
+        self.mins, self.maxs = self.mins[order], self.maxs[order]
+        return self
+
+    def failed(self, table: Table) -> np.ndarray:
+        """Index (in names) of the first criterion that every row fails, PASSED (-1) if none.
+           NaN metrics fail their criterion."""
+        columns = self.columns(table)
+        failed = np.full(_num_rows(table), PASSED, dtype=np.int16)
+        alive = np.arange(failed.size)
+        for k, column in enumerate(columns):
+            if not alive.size:
+                break
+            ok = self._test(k, column[alive])
+            failed[alive[~ok]] = k
+            alive = alive[ok]
+        return failed
+
+    def valid(self, table: Table) -> np.ndarray:
+        """True for the rows that pass every criterion"""
+        return self.failed(table) == PASSED
+
+    def passed(self, table: Table) -> pd.DataFrame:
+        """Outcome of every criterion for every row (no short-circuit), one column per criterion"""
+        return pd.DataFrame({name: self._test(k, column)
+                             for k, (name, column) in enumerate(zip(self.names, self.columns(table)))},
+                            index=table.index if isinstance(table, pd.DataFrame) else None)
+
+    def screen(self, table: Table) -> pd.DataFrame:
+        """Table with Valid and the first Failed criterion ('' if valid) for every row"""
+        failed = self.failed(table)
+        labels = np.array(self.names + [''], dtype=object)
+        return pd.DataFrame({'Valid': failed == PASSED, 'Failed': labels[failed]},
+                            index=table.index if isinstance(table, pd.DataFrame) else None)
+
+
+def metrics_table(queryset, criteria: Sequence[str] = tuple(DEFAULT_CRITERIA)) -> pd.DataFrame:
+    """Column table of the criteria for a queryset of Metrics (one row per Metrics, indexed
+       by backtest id), read with a single values_list query"""
+    fields = [CRITERIA_FIELDS[c] for c in criteria]
+    rows = np.array(list(queryset.values_list('backtest_id', *fields)), dtype=float).reshape(-1, len(fields) + 1)
+    return pd.DataFrame(rows[:, 1:], columns=list(criteria),
+                        index=pd.Index(rows[:, 0].astype(np.int64), name='backtest_id'))
+
@@ -0,0 +1,213 @@
+# Standard library imports
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from .btcriteria import CRITERIA_FIELDS
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Direction in which every metric improves (1 = higher is better, -1 = lower is better).
+# DD and Avg Loss are negative, so they also improve upwards.
+OBJECTIVE_SENSES = {
+    'Kratio': 1,
+    'RF': 1,
+    'PF': 1,
+    'EP': 1,
+    'DD': 1,
+    'SQN': 1,
+    'Sharpe': 1,
+    'Pct. Win': 1,
+    'Avg Win': 1,
+    'Avg Loss': 1,
+    'Num Ops': 1,
+    'Max. Exposure': -1,
+    'Closing Days': 1,
+}
+# Objectives used when none are given (the first metrics of Metrics.Meta.ordering; up to
+# three objectives the fronts come from a sweep, beyond that from ENS-BS, much slower)
+DEFAULT_OBJECTIVES = ('Kratio', 'RF', 'Max. Exposure')
+##########################################################################################################
+
+
+def objective_names(fields: Union[str, Sequence[str]]) -> List[str]:
+    """Metric names (as in OBJECTIVE_SENSES) from metric names or Metrics field names, given
+       as a sequence or as a comma separated string (e.g. 'kratio,rf,max_exposure')
+
+    Raises:
+        ValueError: If some name is not a known objective
+    """
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    by_field = {field: name for name, field in CRITERIA_FIELDS.items()}
+    names = [by_field.get(f, f) for f in fields]
+    unknown = [n for n in names if n not in OBJECTIVE_SENSES]
+    if unknown:
+        raise ValueError(f'Unknown objectives: {unknown}')
+    return names
+
+
+def _fronts_1d(points: np.ndarray) -> np.ndarray:
+    return np.unique(points[:, 0], return_inverse=True)[1].reshape(-1)
+
+
+def _fronts_2d(points: np.ndarray) -> np.ndarray:
+    """Sweep in lexicographic order. The last point added to every front has its lowest
+       second objective, and those values increase with the front, so the front of every
+       point is found with a binary search."""
+    front = np.empty(len(points), dtype=np.int64)
+    lowest: List[float] = []
+    for i, y in enumerate(points[:, 1].tolist()):
+        k = bisect_right(lowest, y)
+        if k == len(lowest):
+            lowest.append(y)
+        else:
+            lowest[k] = y
+        front[i] = k
+    return front
+
+
+def _fronts_3d(points: np.ndarray) -> np.ndarray:
+    """Sweep in lexicographic order, keeping for every front the staircase (2D non-dominated
+       points on the last two objectives) of the points already swept. Being dominated by
+       a front is monotone in the front, so the front is found with a binary search."""
+    front = np.empty(len(points), dtype=np.int64)
+    stairs_y: List[List[float]] = []
+    stairs_z: List[List[float]] = []
+
+    def dominated(k: int, y: float, z: float) -> bool:
+        j = bisect_right(stairs_y[k], y) - 1
+        return j >= 0 and stairs_z[k][j] <= z
+
+    for i, (y, z) in enumerate(points[:, 1:].tolist()):
+        lo, hi = 0, len(stairs_y)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if dominated(mid, y, z):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(stairs_y):
+            stairs_y.append([])
+            stairs_z.append([])
+        ys, zs = stairs_y[lo], stairs_z[lo]
+        # Drop the points of the staircase that the new one dominates (a contiguous run)
+        start = bisect_left(ys, y)
+        stop = start
+        while stop < len(ys) and zs[stop] >= z:
+            stop += 1
+        ys[start:stop] = [y]
+        zs[start:stop] = [z]
+        front[i] = lo
+    return front
+
+
+def _fronts_nd(points: np.ndarray) -> np.ndarray:
+    """Efficient non-dominated sort with binary search (ENS-BS): in lexicographic order a
+       point can only be dominated by the points before it, so it is checked against
+       whole fronts at once. The first objective is already ordered by the sort, and the
+       rest are compared one at a time on the members that still could dominate."""
+    num, dims = points.shape
+    front = np.empty(num, dtype=np.int64)
+    # Members of every front by objective (objectives x capacity), skipping the first one
+    members: List[np.ndarray] = []
+    sizes: List[int] = []
+
+    def dominated(k: int, p: np.ndarray) -> bool:
+        candidates = members[k][0, :sizes[k]] <= p[0]
+        for d in range(1, dims - 1):
+            index = np.flatnonzero(candidates) if candidates.dtype == bool else candidates
+            if not index.size:
+                return False
+            candidates = index[members[k][d, index] <= p[d]]
+        return bool(candidates.any()) if candidates.dtype == bool else bool(candidates.size)
+
+    for i in range(num):
+        p = points[i, 1:]
+        lo, hi = 0, len(members)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if dominated(mid, p):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(members):
+            members.append(np.empty((dims - 1, 16)))
+            sizes.append(0)
+        if sizes[lo] == members[lo].shape[1]:
+            members[lo] = np.concatenate([members[lo], np.empty_like(members[lo])], axis=1)
+        members[lo][:, sizes[lo]] = p
+        sizes[lo] += 1
+        front[i] = lo
+    return front
+
+
+def non_dominated_fronts(points: np.ndarray) -> np.ndarray:
+    """Front (0 = Pareto optimal) of every row of points, all the objectives minimised.
+       Equal rows share their front. NaN values are treated as the worst possible."""
+    points = np.asarray(points, dtype=float)
+    if points.ndim != 2:
+        raise ValueError('points must be a (rows x objectives) matrix')
+    if not len(points):
+        return np.empty(0, dtype=np.int64)
+    points = np.where(np.isnan(points), np.inf, points)
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)   # Sorted lexicographically
+    inverse = inverse.reshape(-1)
+    match unique.shape[1]:
+        case 1:
+            fronts = _fronts_1d(unique)
+        case 2:
+            fronts = _fronts_2d(unique)
+        case 3:
+            fronts = _fronts_3d(unique)
+        case _:
+            fronts = _fronts_nd(unique)
+    return fronts[inverse]
+
+
+def crowding_distance(points: np.ndarray, fronts: np.ndarray) -> np.ndarray:
+    """NSGA-II crowding distance of every row inside its front (inf at the extremes)"""
+    points = np.asarray(points, dtype=float)
+    distance = np.zeros(len(points))
+    if not len(points):
+        return distance
+    for j in range(points.shape[1]):
+        values = np.where(np.isnan(points[:, j]), np.inf, points[:, j])
+        order = np.lexsort((values, fronts))
+        v, f = values[order], fronts[order]
+        first = np.r_[True, f[1:] != f[:-1]]
+        last = np.r_[f[1:] != f[:-1], True]
+        starts = np.flatnonzero(first)
+        span = np.maximum.reduceat(v, starts) - np.minimum.reduceat(v, starts)
+        span = np.repeat(span, np.diff(np.r_[starts, len(v)]))
+        gap = np.zeros(len(v))
+        inner = ~(first | last)
+        with np.errstate(invalid='ignore'):
+            gap[inner] = (v[2:] - v[:-2])[inner[1:-1]] / span[inner]
+        gap = np.where(np.isfinite(gap), gap, 0.0)
+        gap[first | last] = np.inf
+        distance[order] += gap
+    return distance
+
+
+def pareto_ranking(table: Union[pd.DataFrame, Dict[str, np.ndarray]],
+                   objectives: Union[str, Sequence[str]] = DEFAULT_OBJECTIVES) -> pd.DataFrame:
+    """Front and crowding distance of every row of a table of metrics (see metrics_table),
+       sorted by front and then by decreasing crowding distance
+
+    Returns:
+        (pd.DataFrame): The objectives plus the columns Front and Crowding
+    """
+    names = objective_names(objectives)
+    ranked = pd.DataFrame({name: np.asarray(table[name], dtype=float) for name in names},
+                          index=table.index if isinstance(table, pd.DataFrame) else None)
+    points = ranked.to_numpy() * -np.array([OBJECTIVE_SENSES[n] for n in names], dtype=float)
+    ranked['Front'] = non_dominated_fronts(points)
+    ranked['Crowding'] = crowding_distance(points, ranked['Front'].to_numpy())
+    order = np.lexsort((-ranked['Crowding'].to_numpy(), ranked['Front'].to_numpy()))
+    return ranked.iloc[order]
@@ -0,0 +1,301 @@
+# Standard library imports
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser import btkernels
+from ..parser.btgenbox import BtGenbox
+from ..parser.btmetrics import BtMetrics, DEFAULT_CRITERIA
+from ..parser.btparser import BtPeriods
+from ..parser.bttrades import BtTrades, TRADES_COLUMNS
+from .btshared import SharedArrays, attach_worker, worker_arrays
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Objectives available for the subset search
+OBJECTIVES = {
+    'kratio': btkernels.kratio,
+    'rf': btkernels.recovery_factor,
+}
+# Default exposure cap for a portfolio (same as for a single set)
+DEFAULT_MAX_EXPOSURE = DEFAULT_CRITERIA['Max. Exposure']['Max']
+# Max number of cells (subsets x operations) evaluated in one batch
+EVAL_CELLS = 2 ** 22
+##########################################################################################################
+
+
+def _as_trades(bt: Union[BtTrades, BtGenbox]) -> BtTrades:
+    return bt if isinstance(bt, BtTrades) else BtTrades.from_backtest(bt)
+
+
+def merge_trades(trades: Sequence[BtTrades], name: str = 'Portfolio') -> Tuple[BtTrades, np.ndarray]:
+    """Merges the operations of several backtests in one sequence ordered by close time.
+
+    Every backtest is a sorted run of close times, and the stable sort (timsort) detects
+    those runs and merges them pairwise, i.e. a k-way merge in O(n log k). Ties keep the
+    order of the input backtests.
+
+    Args:
+        trades (Sequence[BtTrades]):    Backtests to merge
+        name (str):                     Name for the merged backtest
+
+    Returns:
+        (BtTrades, np.ndarray): Merged operations and, for every operation, the index
+                                of the backtest it comes from
+    """
+    runs = [t.sorted_by_close() for t in trades]
+    keys = np.concatenate([t.close_time.view(np.int64) for t in runs]) if runs else np.empty(0, np.int64)
+    sources = np.repeat(np.arange(len(runs)), [len(t) for t in runs])
+    order = np.argsort(keys, kind='stable')
+    columns = {
+        column: np.concatenate([getattr(t, column) for t in runs])[order] if runs else
+                np.empty(0, dtype=dtype)
+        for column, dtype in TRADES_COLUMNS.items()
+    }
+    return BtTrades(name=name, period=BtPeriods.ISOS, **columns), sources[order]
+
+
+class BtPortfolio:
+    """
+    Represents a portfolio of backtests: the operations of all of them merged in one
+    equity curve. It exposes name, period and operations, so BtMetrics accepts it as
+    a backtest and computes the full set of metrics on the combined curve.
+
+    Instance variables:
+        members (List[BtTrades]):   Backtests in the portfolio
+
+    Instance properties:
+        * trades
+        * sources
+        * name
+        * period
+        * operations
+
+    Instance methods:
+        * metrics
+        * equity
+        * from_period_to_text
+    """
+
+    def __init__(self, backtests: Sequence[Union[BtTrades, BtGenbox]], name: str = 'Portfolio') -> None:
+        self.members = [_as_trades(bt) for bt in backtests]
+        self._trades, self._sources = merge_trades(self.members, name)
+
+    @property
+    def trades(self) -> BtTrades:
+        return self._trades
+
+    @property
+    def sources(self) -> np.ndarray:
+        """Index in self.members of the backtest each merged operation comes from"""
+        return self._sources
+
+    @property
+    def name(self) -> str:
+        return self._trades.name
+
+    @property
+    def period(self) -> BtPeriods:
+        return self._trades.period
+
+    @property
+    def operations(self) -> pd.DataFrame:
+        return self._trades.operations
+
+    def from_period_to_text(self, period: BtPeriods) -> str:
+        return self._trades.from_period_to_text(period)
+
+    def metrics(self, pips_mode: bool = True) -> BtMetrics:
+        return BtMetrics(self._trades, pips_mode=pips_mode)
+
+    def equity(self, pips_mode: bool = True) -> pd.Series:
+        """Combined equity curve indexed by close time"""
+        return pd.Series(btkernels.equity(self._trades.pnl(pips_mode)), index=self._trades.close_time)
+
+
+class PortfolioCandidate(NamedTuple):
+    members: Tuple[int, ...]
+    score: float
+    max_exposure: float
+
+
+def _contained_volumes(trades: BtTrades, sources: np.ndarray, num_sets: int) -> np.ndarray:
+    """Matrix (operations x backtests) with the volume of every backtest's operations contained
+       in each merged operation. The exposure of any subset is then a sum of its columns."""
+    per_set = np.zeros((len(trades), num_sets))
+    per_set[np.arange(len(trades)), sources] = trades.volume
+    out = np.empty_like(per_set)
+    for start, tile in btkernels.containment_blocks(trades.open_time, trades.close_time):
+        out[start:start + tile.shape[0]] = tile.astype(float) @ per_set
+    return out
+
+
+def _evaluate(arrays: Dict[str, np.ndarray], members: np.ndarray, objective: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Scores a batch of subsets (rows of the boolean matrix members) on the merged arrays"""
+    pnl, sources, contained = arrays['pnl'], arrays['sources'], arrays['contained']
+    scores = np.empty(members.shape[0])
+    exposures = np.empty(members.shape[0])
+    step = max(1, EVAL_CELLS // max(pnl.size, 1))
+    for start in range(0, members.shape[0], step):
+        batch = members[start:start + step]
+        where = batch[:, sources]
+        scores[start:start + step] = OBJECTIVES[objective](pnl, where)
+        exposure = (contained @ batch.T.astype(float)).T
+        exposures[start:start + step] = np.where(where, exposure, 0.0).max(axis=-1, initial=0.0)
+    return np.nan_to_num(scores, nan=-np.inf), exposures
+
+
+def _evaluate_in_worker(members: np.ndarray, objective: str) -> Tuple[np.ndarray, np.ndarray]:
+    return _evaluate(worker_arrays(), members, objective)
+
+
+class PortfolioSearch:
+    """
+    Searches the subset of backtests with the best K-ratio or RF whose max. exposure
+    does not exceed a cap.
+
+    The operations of all the backtests are merged once; a subset is then just a mask
+    over the merged arrays, so candidates are scored in batches with the vectorized
+    kernels. With workers > 1 the batches are spread over a process pool that reads the
+    merged arrays from shared memory.
+
+    Instance variables:
+        members (List[BtTrades]):   Candidate backtests
+        objective (str):            'kratio' or 'rf'
+        max_exposure (float):       Exposure cap
+        workers (int):              Processes used to evaluate candidates
+        evaluated (int):            Number of subsets evaluated so far
+
+    Instance methods:
+        * evaluate
+        * greedy
+        * exhaustive
+        * portfolio
+    """
+
+    def __init__(self, backtests: Sequence[Union[BtTrades, BtGenbox]], objective: str = 'kratio',
+                 max_exposure: float = DEFAULT_MAX_EXPOSURE, pips_mode: bool = True,
+                 workers: int = 1) -> None:
+        if objective not in OBJECTIVES:
+            raise ValueError(f'Unknown objective {objective!r}, expected one of {sorted(OBJECTIVES)}')
+        self.members = [_as_trades(bt) for bt in backtests]
+        self.objective = objective
+        self.max_exposure = max_exposure
+        self.workers = workers
+        self.evaluated = 0
+        merged, sources = merge_trades(self.members)
+        self._arrays = {
+            'pnl': merged.pnl(pips_mode),
+            'sources': sources,
+            'contained': _contained_volumes(merged, sources, len(self.members)),
+        }
+        self._executor = None
+
+    @contextmanager
+    def _session(self) -> Iterator[None]:
+        """Keeps a process pool attached to the shared arrays while a search runs"""
+        if self.workers <= 1 or self._executor is not None:
+            yield
+            return
+        with SharedArrays(self._arrays) as shared:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=attach_worker,
+                                     initargs=(shared.spec,)) as executor:
+                self._executor = executor
+                try:
+                    yield
+                finally:
+                    self._executor = None
+
+    def _score(self, members: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self._executor is None or members.shape[0] < 2:
+            return _evaluate(self._arrays, members, self.objective)
+        chunks = np.array_split(members, min(self.workers * 4, members.shape[0]))
+        results = list(self._executor.map(_evaluate_in_worker, chunks, repeat(self.objective)))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def evaluate(self, subsets: Sequence[Sequence[int]]) -> List[PortfolioCandidate]:
+        """Scores the given subsets (sequences of indices in self.members)"""
+        subsets = [tuple(sorted(set(subset))) for subset in subsets]
+        if not subsets:
+            return []
+        members = np.zeros((len(subsets), len(self.members)), dtype=bool)
+        for row, subset in enumerate(subsets):
+            members[row, list(subset)] = True
+        with self._session():
+            scores, exposures = self._score(members)
+        self.evaluated += len(subsets)
+        return [PortfolioCandidate(subset, float(score), float(exposure))
+                for subset, score, exposure in zip(subsets, scores, exposures)]
+
+    def _feasible(self, subsets: Sequence[Sequence[int]]) -> List[PortfolioCandidate]:
+        return [c for c in self.evaluate(subsets) if c.max_exposure <= self.max_exposure]
+
+    def greedy(self, max_size: int = None) -> PortfolioCandidate:
+        """Adds, one at a time, the backtest that improves the objective the most while
+           the exposure cap holds. Stops when no addition improves the objective.
+
+        Returns:
+            (PortfolioCandidate): Best subset found, or None if no backtest fits the cap
+        """
+        max_size = max_size or len(self.members)
+        chosen: Tuple[int, ...] = ()
+        best = None
+        with self._session():
+            while len(chosen) < max_size:
+                rest = [i for i in range(len(self.members)) if i not in chosen]
+                feasible = self._feasible([chosen + (i,) for i in rest])
+                if not feasible:
+                    break
+                top = max(feasible, key=lambda c: c.score)
+                if best is not None and top.score <= best.score:
+                    break
+                best, chosen = top, top.members
+        return best
+
+    def exhaustive(self, max_size: int = None) -> PortfolioCandidate:
+        """Evaluates every subset up to max_size backtests, level by level.
+
+        The exposure of a subset never decreases when a backtest is added, so a subset
+        that breaks the cap prunes all its supersets: a candidate of size k is only
+        generated when all its subsets of size k - 1 were feasible.
+
+        Returns:
+            (PortfolioCandidate): Best subset found, or None if no backtest fits the cap
+        """
+        max_size = max_size or len(self.members)
+        with self._session():
+            level = self._feasible([(i,) for i in range(len(self.members))])
+            best = max(level, key=lambda c: c.score, default=None)
+            for _ in range(1, max_size):
+                candidates = _join_level([c.members for c in level])
+                if not candidates:
+                    break
+                level = self._feasible(candidates)
+                best = max(level + ([best] if best else []), key=lambda c: c.score, default=best)
+        return best
+
+    def portfolio(self, candidate: PortfolioCandidate, name: str = 'Portfolio') -> BtPortfolio:
+        return BtPortfolio([self.members[i] for i in candidate.members], name)
+
+
+def _join_level(level: Sequence[Tuple[int, ...]]) -> List[Tuple[int, ...]]:
+    """Apriori join: subsets of size k + 1 whose k-subsets are all in level"""
+    known = set(level)
+    by_prefix: Dict[Tuple[int, ...], List[int]] = {}
+    for subset in sorted(known):
+        by_prefix.setdefault(subset[:-1], []).append(subset[-1])
+    candidates = []
+    for prefix, lasts in by_prefix.items():
+        for i, a in enumerate(lasts):
+            for b in lasts[i + 1:]:
+                candidate = prefix + (a, b)
+                if all(candidate[:j] + candidate[j + 1:] in known for j in range(len(candidate) - 2)):
+                    candidates.append(candidate)
+    return candidates
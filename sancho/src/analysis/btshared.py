@@ -0,0 +1,98 @@
+# Standard library imports
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple
+
+# Non-standard library imports
+import numpy as np
+
+# Project imports
+
+
+class SharedArrays:
+    """
+    Publishes a set of NumPy arrays in shared memory so that the worker processes
+    of a pool can attach to them read-only, without copying or pickling them for
+    every task.
+
+    Usage:
+        with SharedArrays({'pnl': pnl, 'set_id': set_id}) as shared:
+            with ProcessPoolExecutor(initializer=attach_worker, initargs=(shared.spec,)):
+                ...
+
+    Instance properties:
+        * spec
+        * arrays
+
+    Instance methods:
+        * close
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        self._segments: List[SharedMemory] = []
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._spec: Dict[str, Tuple[str, tuple, str]] = {}
+        for key, value in arrays.items():
+            value = np.ascontiguousarray(value)
+            shm = SharedMemory(create=True, size=max(value.nbytes, 1))
+            view = np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)
+            view[...] = value
+            view.flags.writeable = False
+            self._segments.append(shm)
+            self._arrays[key] = view
+            self._spec[key] = (shm.name, value.shape, value.dtype.str)
+
+    @property
+    def spec(self) -> Dict[str, Tuple[str, tuple, str]]:
+        """Picklable description of the segments, to be passed to attach()"""
+        return self._spec
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return self._arrays
+
+    def close(self) -> None:
+        self._arrays = {}
+        for shm in self._segments:
+            try:
+                shm.close()
+            except BufferError:
+                # Some view is still alive; the mapping is released with it
+                pass
+            shm.unlink()
+        self._segments = []
+
+    def __enter__(self) -> 'SharedArrays':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# Arrays attached by the current worker process (see attach_worker)
+_WORKER_ARRAYS: Dict[str, np.ndarray] = {}
+_WORKER_SEGMENTS: List[SharedMemory] = []
+
+
+def attach(spec: Dict[str, Tuple[str, tuple, str]]) -> Tuple[Dict[str, np.ndarray], List[SharedMemory]]:
+    """Maps the segments described by spec as read-only arrays. The segments belong to the
+       publishing process, which is the one that unlinks them."""
+    arrays, segments = {}, []
+    for key, (name, shape, dtype) in spec.items():
+        shm = SharedMemory(name=name)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        view.flags.writeable = False
+        arrays[key] = view
+        segments.append(shm)
+    return arrays, segments
+
+
+def attach_worker(spec: Dict[str, Tuple[str, tuple, str]]) -> None:
+    """Pool initializer: attaches the shared arrays once per worker process"""
+    arrays, segments = attach(spec)
+    _WORKER_ARRAYS.clear()
+    _WORKER_ARRAYS.update(arrays)
+    _WORKER_SEGMENTS[:] = segments
+
+
+def worker_arrays() -> Dict[str, np.ndarray]:
+    return _WORKER_ARRAYS
@@ -0,0 +1,196 @@
+# Standard library imports
+import hashlib
+from typing import Dict, List, Optional, Tuple, Union
+
+# Non-standard library imports
+import numpy as np
+
+# Project imports
+from ..parser.bttrades import TRADES_COLUMNS, BtTrades
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Length of the resampled equity vectors
+EQUITY_POINTS = 128
+# Bytes of the trade fingerprints (hex digest has twice as many characters)
+FINGERPRINT_BYTES = 16
+# Vectors compared at once by the brute-force queries
+SIMILARITY_BLOCK = 4096
+# Lloyd iterations to build the partitions of the index
+KMEANS_ITERATIONS = 10
+##########################################################################################################
+
+
+def trade_fingerprint(trades: BtTrades) -> str:
+    """Hash of the open times and directions of the operations. Two backtests with the same
+       fingerprint opened the same operations in the same direction."""
+    digest = hashlib.blake2b(digest_size=FINGERPRINT_BYTES)
+    digest.update(np.ascontiguousarray(trades.open_time.view(np.int64)).tobytes())
+    digest.update(np.ascontiguousarray(trades.direction).tobytes())
+    return digest.hexdigest()
+
+
+def outcome_hash(trades: BtTrades) -> str:
+    """Hash of every column of the operations (times, direction, volume, pips, profit, symbol
+       and costs). Unlike trade_fingerprint, which only tells that two backtests opened the
+       same operations, two backtests with the same outcome hash have the same metrics."""
+    digest = hashlib.blake2b(digest_size=FINGERPRINT_BYTES)
+    for column in TRADES_COLUMNS:
+        digest.update(np.ascontiguousarray(getattr(trades, column)).tobytes())
+    return digest.hexdigest()
+
+
+def equity_vector(trades: BtTrades, points: int = EQUITY_POINTS, pips_mode: bool = True) -> np.ndarray:
+    """Equity curve sampled at evenly spaced times from the first open to the last close,
+       centred and scaled to unit norm (so the dot product of two vectors is the correlation
+       of the curves). A flat curve gives the zero vector."""
+    vector = np.zeros(points, dtype=np.float32)
+    if not len(trades):
+        return vector
+    close = trades.close_time.view(np.int64)
+    order = np.argsort(close, kind='stable')
+    close = close[order]
+    equity = np.concatenate([[0.0], np.cumsum(trades.pnl(pips_mode)[order])])
+    grid = np.linspace(trades.open_time.view(np.int64).min(), close[-1], points)
+    sampled = equity[np.searchsorted(close, grid, side='right')]
+    sampled -= sampled.mean()
+    norm = np.sqrt(sampled @ sampled)
+    if norm > 0:
+        vector[:] = sampled / norm
+    return vector
+
+
+class SimilarityIndex:
+    """
+    Index of backtests by trade fingerprint (exact duplicates) and by normalised equity
+    vector (near duplicates).
+
+    Queries compare the vectors by dot product in blocks (brute force). After partition()
+    the vectors are grouped around k-means centroids and a query only scans the vectors
+    of the n_probe partitions closest to it (inverted file), which is approximate.
+
+    Instance variables:
+        points (int):       Length of the equity vectors
+        pips_mode (bool):   Equity in pips (True) or money (False)
+        names (List[str]):  Name of every backtest, in insertion order
+
+    Instance properties:
+        * vectors
+
+    Instance methods:
+        * duplicate_of
+        * add
+        * partition
+        * nearest
+        * near_duplicates
+    """
+
+    def __init__(self, points: int = EQUITY_POINTS, pips_mode: bool = True) -> None:
+        self.points = points
+        self.pips_mode = pips_mode
+        self.names: List[str] = []
+        self._fingerprints: Dict[str, str] = {}
+        self._rows: List[np.ndarray] = []
+        self._vectors = np.empty((0, points), dtype=np.float32)
+        self._centroids = None
+        self._lists = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Matrix of equity vectors (backtests x points)"""
+        if self._rows:
+            self._vectors = np.vstack([self._vectors] + self._rows)
+            self._rows = []
+        return self._vectors
+
+    def duplicate_of(self, fingerprint: str) -> Optional[str]:
+        """Name of the indexed backtest with that fingerprint, None if there isn't one"""
+        return self._fingerprints.get(fingerprint)
+
+    def add(self, trades: BtTrades, name: str = None, fingerprint: str = None) -> Optional[str]:
+        """Indexes a backtest
+
+        Returns:
+            (str): Name of the backtest it duplicates exactly (it's not indexed then), or None
+        """
+        fingerprint = fingerprint or trade_fingerprint(trades)
+        original = self.duplicate_of(fingerprint)
+        if original is not None:
+            return original
+        self._fingerprints[fingerprint] = trades.name if name is None else name
+        self.names.append(self._fingerprints[fingerprint])
+        self._rows.append(equity_vector(trades, self.points, self.pips_mode)[None, :])
+        self._centroids = self._lists = None
+        return None
+
+    def partition(self, num_lists: int = None, seed: int = 0) -> None:
+        """Groups the vectors in num_lists partitions (sqrt of the size by default) with
+           spherical k-means, for approximate queries"""
+        vectors = self.vectors
+        num_lists = num_lists or max(int(np.sqrt(len(vectors))), 1)
+        num_lists = min(num_lists, len(vectors))
+        if not num_lists:
+            return
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assigned = self._closest_centroid(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+        assigned = self._closest_centroid(vectors, centroids)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assigned == c) for c in range(num_lists)]
+
+    @staticmethod
+    def _closest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), SIMILARITY_BLOCK):
+            out[start:start + SIMILARITY_BLOCK] = np.argmax(vectors[start:start + SIMILARITY_BLOCK] @ centroids.T, axis=1)
+        return out
+
+    def _query_vector(self, query: Union[BtTrades, np.ndarray]) -> np.ndarray:
+        if isinstance(query, BtTrades):
+            return equity_vector(query, self.points, self.pips_mode)
+        return np.asarray(query, dtype=np.float32)
+
+    def nearest(self, query: Union[BtTrades, np.ndarray], k: int = 10, n_probe: int = None) -> List[Tuple[str, float]]:
+        """The k indexed backtests with the most similar equity curves (correlation)
+
+        Args:
+            query (BtTrades or np.ndarray): Backtest or equity vector to look for
+            k (int):                        Number of neighbours
+            n_probe (int):                  Partitions to scan (only after partition()); all
+                                            the vectors are scanned when it's None
+        """
+        vector = self._query_vector(query)
+        vectors = self.vectors
+        if n_probe is not None and self._lists is not None:
+            closest = np.argsort(-(self._centroids @ vector))[:n_probe]
+            candidates = np.concatenate([self._lists[c] for c in closest])
+        else:
+            candidates = np.arange(len(vectors))
+        k = min(k, candidates.size)
+        if not k:
+            return []
+        scores = np.empty(candidates.size, dtype=np.float32)
+        for start in range(0, candidates.size, SIMILARITY_BLOCK):
+            scores[start:start + SIMILARITY_BLOCK] = vectors[candidates[start:start + SIMILARITY_BLOCK]] @ vector
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.names[candidates[i]], float(scores[i])) for i in best]
+
+    def near_duplicates(self, threshold: float = 0.99) -> List[Tuple[str, str, float]]:
+        """Pairs of indexed backtests whose equity curves correlate at least threshold"""
+        vectors = self.vectors
+        pairs = []
+        for start in range(0, len(vectors), SIMILARITY_BLOCK):
+            block = vectors[start:start + SIMILARITY_BLOCK] @ vectors[:start + SIMILARITY_BLOCK].T
+            rows, cols = np.nonzero(np.tril(block >= threshold, k=start - 1))
+            pairs.extend((self.names[start + i], self.names[j], float(block[i, j])) for i, j in zip(rows, cols))
+        return pairs
@@ -0,0 +1,159 @@
+# Standard library imports
+from typing import List, NamedTuple, Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser import btkernels
+from ..parser.btgenbox import BtGenbox
+from ..parser.bttrades import BtTrades, DEFAULT_DEPOSIT
+from .btcosts import money_per_pip
+
+
+class FixedLot(NamedTuple):
+    """Same volume for every operation"""
+    lots: float
+
+    @property
+    def label(self) -> str:
+        return f'fixed lots={self.lots:g}'
+
+
+class FixedFractional(NamedTuple):
+    """Risks a fraction of the current balance per operation, assuming a loss of
+       risk_pips pips is one unit of risk. Volumes are not rounded to a lot step."""
+    fraction: float
+    risk_pips: float = 50.0
+
+    @property
+    def label(self) -> str:
+        return f'fractional f={self.fraction:g} risk={self.risk_pips:g}p'
+
+
+class VolatilityScaled(NamedTuple):
+    """Volume that targets a fixed money volatility per operation, using the standard
+       deviation of the PnL per lot of the previous `window` operations"""
+    target: float
+    window: int = 20
+
+    @property
+    def label(self) -> str:
+        return f'volatility target={self.target:g} window={self.window}'
+
+
+SizingRule = Union[FixedLot, FixedFractional, VolatilityScaled]
+
+
+def sizing_grid(lots: Sequence[float] = (0.01, 0.1, 1.0),
+                fractions: Sequence[float] = (0.005, 0.01, 0.02),
+                risk_pips: Sequence[float] = (50.0,),
+                targets: Sequence[float] = (10.0, 50.0),
+                windows: Sequence[int] = (20,)) -> List[SizingRule]:
+    """Rules for every value of every parameter"""
+    return [FixedLot(lot) for lot in lots] + \
+           [FixedFractional(f, r) for r in risk_pips for f in fractions] + \
+           [VolatilityScaled(t, w) for w in windows for t in targets]
+
+
+def _trailing_std(values: np.ndarray, window: int) -> np.ndarray:
+    """Standard deviation of the `window` values before each position (not including it),
+       with an expanding window at the start. NaN while there are fewer than 2 values."""
+    c1 = np.concatenate([[0.0], np.cumsum(values)])
+    c2 = np.concatenate([[0.0], np.cumsum(values ** 2)])
+    end = np.arange(values.size)
+    start = np.maximum(end - window, 0)
+    n = (end - start).astype(float)
+    s1, s2 = c1[end] - c1[start], c2[end] - c2[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (s2 - s1 ** 2 / n) / (n - 1)
+    return np.where(n >= 2, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+
+class SizingSimulator:
+    """
+    Re-sizes the operations of a backtest under several lot-size rules. The volumes of all
+    the rules are built as one (rules x operations) matrix, and the balance curves and the
+    metrics of every rule come out of the same vectorized kernels used for BtMetrics.
+
+    Instance variables:
+        trades (BtTrades):          Operations of the backtest
+        rules (List[SizingRule]):   Rules to simulate
+        initial_balance (float):    Starting balance for every rule
+
+    Instance methods:
+        * lots
+        * pnl
+        * balance
+        * metrics
+    """
+
+    def __init__(self, bt: Union[BtTrades, BtGenbox], rules: Sequence[SizingRule] = None,
+                 initial_balance: float = DEFAULT_DEPOSIT) -> None:
+        self.trades = bt if isinstance(bt, BtTrades) else BtTrades.from_backtest(bt)
+        self.rules = list(rules) if rules is not None else sizing_grid()
+        self.initial_balance = initial_balance
+        volume = self.trades.volume
+        safe = np.where(volume > 0, volume, 1.0)
+        # PnL and pip value of one lot for every operation
+        self._per_lot = np.where(volume > 0, self.trades.profit / safe, 0.0)
+        self._pip_per_lot = money_per_pip(self.trades) / safe
+        self._lots = None
+
+    def lots(self) -> np.ndarray:
+        """Volume of every operation under every rule, shape (rules, ops)"""
+        if self._lots is not None:
+            return self._lots
+        n = len(self.trades)
+        lots = np.empty((len(self.rules), n))
+        fixed = [i for i, r in enumerate(self.rules) if isinstance(r, FixedLot)]
+        fractional = [i for i, r in enumerate(self.rules) if isinstance(r, FixedFractional)]
+        volatility = [i for i, r in enumerate(self.rules) if isinstance(r, VolatilityScaled)]
+        if fixed:
+            lots[fixed] = np.array([self.rules[i].lots for i in fixed])[:, None]
+        if fractional:
+            # lots = f * balance / (risk_pips * pip value per lot), so the balance grows
+            # geometrically: balance_t = balance_{t-1} * (1 + f * pips_t / risk_pips)
+            f = np.array([self.rules[i].fraction for i in fractional])[:, None]
+            risk = np.array([self.rules[i].risk_pips for i in fractional])[:, None]
+            step = 1.0 + f * self.trades.pips / risk
+            growth = np.cumprod(step, axis=-1)
+            before = self.initial_balance * np.concatenate([np.ones((len(fractional), 1)), growth[:, :-1]], axis=-1)
+            lots[fractional] = np.maximum(f * before / (risk * self._pip_per_lot), 0.0)
+        if volatility:
+            for window in {self.rules[i].window for i in volatility}:
+                rows = [i for i in volatility if self.rules[i].window == window]
+                sigma = _trailing_std(self._per_lot, window)
+                fallback = np.nanstd(self._per_lot, ddof=1) if n > 1 else 1.0
+                sigma = np.where(np.isfinite(sigma) & (sigma > 0), sigma, fallback or 1.0)
+                target = np.array([self.rules[i].target for i in rows])[:, None]
+                lots[rows] = target / sigma
+        self._lots = lots
+        return lots
+
+    def pnl(self) -> np.ndarray:
+        """Money PnL of every operation under every rule, shape (rules, ops)"""
+        return self.lots() * self._per_lot
+
+    def balance(self) -> np.ndarray:
+        """Balance curve of every rule, shape (rules, ops)"""
+        return self.initial_balance + btkernels.equity(self.pnl())
+
+    def metrics(self) -> pd.DataFrame:
+        """Table (one row per rule) with the final balance, drawdown, RF and exposure"""
+        pnl, lots = self.pnl(), self.lots()
+        balance = self.initial_balance + btkernels.equity(pnl)
+        peak = np.maximum.accumulate(np.concatenate(
+            [np.full((len(self.rules), 1), float(self.initial_balance)), balance], axis=-1), axis=-1)[:, 1:]
+        trades = self.trades
+        return pd.DataFrame({
+            'Final Balance': balance[:, -1] if len(trades) else np.full(len(self.rules), self.initial_balance),
+            'DD': btkernels.max_drawdown(pnl),
+            'DD %': ((balance - peak) / peak).min(axis=-1, initial=0.0) * 100,
+            'RF': btkernels.recovery_factor(pnl),
+            'Kratio': btkernels.kratio(pnl),
+            'Max. Exposure': btkernels.max_exposure(trades.open_time, trades.close_time, lots),
+            'Max. Lots': lots.max(axis=-1, initial=0.0),
+            'Min. Lots': lots.min(axis=-1, initial=np.inf),
+        }, index=pd.Index([r.label for r in self.rules], name='Rule'))
@@ -0,0 +1,175 @@
+# Standard library imports
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from ..parser.btkernels import DAY_NS
+from ..parser.bttrades import BtTrades
+from .btcorrelation import resample_daily
+from .btshared import SharedArrays, attach_worker, worker_arrays
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Available tests: White's reality check and Hansen's (consistent) superior predictive ability
+SNOOPING_METHODS = ('rc', 'spa')
+# Bootstrap resamples generated and reduced together (bounds the memory of one batch)
+BOOTSTRAP_BATCH = 250
+##########################################################################################################
+
+
+def stationary_bootstrap_indices(rng: np.random.Generator, n_boot: int, length: int,
+                                 block_length: float) -> np.ndarray:
+    """Indices (n_boot x length) of Politis & Romano's stationary bootstrap, built without
+       a loop over time: every position starts a new block with probability 1 / block_length,
+       and inside a block the index advances by one (wrapping around)."""
+    restart = rng.random((n_boot, length)) < 1.0 / block_length
+    restart[:, 0] = True
+    starts = rng.integers(0, length, size=(n_boot, length))
+    positions = np.arange(length)
+    block_start = np.maximum.accumulate(np.where(restart, positions, 0), axis=1)
+    origin = np.take_along_axis(starts, block_start, axis=1)
+    return (origin + positions - block_start) % length
+
+
+def _bootstrap_max(returns: np.ndarray, centre: np.ndarray, scale: np.ndarray, seed: np.random.SeedSequence,
+                   n_boot: int, block_length: float) -> np.ndarray:
+    """Max over the sets of the centred and scaled bootstrap statistics, one per resample.
+
+    The mean of every set in a resample is returns @ counts / T, where counts is how many
+    times each period was drawn, so a whole batch of resamples is a single matrix product.
+    """
+    rng = np.random.default_rng(seed)
+    num_periods = returns.shape[1]
+    out = np.empty(n_boot)
+    for start in range(0, n_boot, BOOTSTRAP_BATCH):
+        size = min(BOOTSTRAP_BATCH, n_boot - start)
+        indices = stationary_bootstrap_indices(rng, size, num_periods, block_length)
+        flat = (indices + np.arange(size)[:, None] * num_periods).ravel()
+        counts = np.bincount(flat, minlength=size * num_periods).reshape(size, num_periods).astype(float)
+        means = returns @ counts.T / num_periods
+        stats = np.sqrt(num_periods) * (means - centre[:, None]) / scale[:, None]
+        out[start:start + size] = stats.max(axis=0)
+    return out
+
+
+def _bootstrap_max_in_worker(centre: np.ndarray, scale: np.ndarray, seed: np.random.SeedSequence,
+                             n_boot: int, block_length: float) -> np.ndarray:
+    return _bootstrap_max(worker_arrays()['returns'], centre, scale, seed, n_boot, block_length)
+
+
+def _long_run_std(returns: np.ndarray, block_length: float) -> np.ndarray:
+    """Standard deviation of sqrt(T) * mean under the stationary bootstrap, with the kernel
+       of Politis & Romano (1994) and the autocovariances of every set computed by FFT"""
+    num_periods = returns.shape[1]
+    centred = returns - returns.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(centred, n=2 * num_periods, axis=1)
+    autocov = np.fft.irfft(spectrum * np.conj(spectrum), axis=1)[:, :num_periods] / num_periods
+    lags = np.arange(1, num_periods)
+    q = 1.0 / block_length
+    kernel = (1 - lags / num_periods) * (1 - q) ** lags + lags / num_periods * (1 - q) ** (num_periods - lags)
+    variance = autocov[:, 0] + 2 * autocov[:, 1:] @ kernel
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+class RealityCheck:
+    """
+    Data-snooping test for a batch of sets (e.g. all the sets of one optimization).
+
+    The returns of all the sets (sets x periods) are resampled together with the
+    stationary bootstrap, so the dependence between sets is kept. The best set is then
+    compared against the distribution of the max statistic over all the sets, which gives
+    p-values adjusted for having picked the best out of the whole batch:
+        * 'rc':  White's reality check on the mean return
+        * 'spa': Hansen's consistent test for superior predictive ability (studentised,
+                 with the poor sets recentred so they don't inflate the p-values)
+
+    Instance variables:
+        returns (np.ndarray):   Matrix of returns (sets x periods), benchmark is zero
+        names (List[str]):      Name of every set
+        method (str):           'rc' or 'spa'
+        n_boot (int):           Bootstrap resamples
+        block_length (float):   Mean block length of the stationary bootstrap
+        workers (int):          Processes to spread the resamples over
+        p_value (float):        p-value for the best set (after run)
+
+    Instance methods:
+        * from_trades
+        * run
+    """
+
+    def __init__(self, returns: Union[np.ndarray, pd.DataFrame], names: Sequence[str] = None,
+                 method: str = 'spa', n_boot: int = 1000, block_length: float = 10.0,
+                 seed: int = None, workers: int = 1) -> None:
+        if method not in SNOOPING_METHODS:
+            raise ValueError(f'Unknown method {method!r}, expected one of {SNOOPING_METHODS}')
+        if isinstance(returns, pd.DataFrame):
+            names = list(returns.index) if names is None else names
+            returns = returns.to_numpy()
+        self.returns = np.asarray(returns, dtype=float)
+        if self.returns.ndim != 2 or self.returns.shape[1] < 2:
+            raise ValueError('returns must be a (sets x periods) matrix with at least 2 periods')
+        self.names = list(names) if names is not None else [str(i) for i in range(self.returns.shape[0])]
+        self.method = method
+        self.n_boot = n_boot
+        self.block_length = block_length
+        self.seed = seed
+        self.workers = workers
+        self.p_value = None
+
+    @classmethod
+    def from_trades(cls, trades: Sequence[BtTrades], pips_mode: bool = True, **kwargs) -> 'RealityCheck':
+        """Builds the daily returns of the sets on the calendar that spans all of them"""
+        closes = [t.close_time.view(np.int64) // DAY_NS for t in trades if len(t)]
+        first = int(min(c.min() for c in closes))
+        num_days = int(max(c.max() for c in closes)) - first + 1
+        matrix = np.vstack([resample_daily(t, first, num_days, pips_mode) for t in trades])
+        return cls(matrix, [t.name for t in trades], **kwargs)
+
+    def _bootstrap(self, centre: np.ndarray, scale: np.ndarray) -> np.ndarray:
+        seeds = np.random.SeedSequence(self.seed).spawn(max(self.workers, 1))
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(self.n_boot), len(seeds))]
+        if self.workers <= 1:
+            return _bootstrap_max(self.returns, centre, scale, seeds[0], self.n_boot, self.block_length)
+        with SharedArrays({'returns': self.returns}) as shared:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=attach_worker,
+                                     initargs=(shared.spec,)) as executor:
+                futures = [executor.submit(_bootstrap_max_in_worker, centre, scale, seed, size, self.block_length)
+                           for seed, size in zip(seeds, sizes)]
+                return np.concatenate([f.result() for f in futures])
+
+    def run(self, top: int = 20) -> pd.DataFrame:
+        """Runs the bootstrap and returns the top sets by statistic with their adjusted p-values
+
+        Returns:
+            (pd.DataFrame): One row per set (the best `top`), with the columns Mean,
+                            Statistic and p-value
+        """
+        num_periods = self.returns.shape[1]
+        means = self.returns.mean(axis=1)
+        if self.method == 'rc':
+            scale = np.ones_like(means)
+            centre = means
+        else:
+            scale = _long_run_std(self.returns, self.block_length)
+            scale = np.where(scale > 0, scale, np.inf)
+            # Sets clearly below the benchmark are not recentred (Hansen's SPA_c), so their
+            # bootstrap statistics stay negative and don't inflate the p-values
+            threshold = -np.sqrt(2 * np.log(np.log(num_periods)))
+            centre = np.where(np.sqrt(num_periods) * means / scale >= threshold, means, 0.0)
+        statistic = np.sqrt(num_periods) * means / scale
+        max_boot = self._bootstrap(centre, scale)
+        if self.method == 'spa':
+            max_boot = np.maximum(max_boot, 0.0)
+        p_values = (max_boot[None, :] >= statistic[:, None]).mean(axis=1)
+        self.p_value = float(p_values[np.argmax(statistic)])
+        order = np.argsort(-statistic, kind='stable')[:top]
+        return pd.DataFrame({
+            'Mean': means[order],
+            'Statistic': statistic[order],
+            'p-value': p_values[order],
+        }, index=pd.Index([self.names[i] for i in order], name='Set'))
@@ -0,0 +1,66 @@
+# Standard library imports
+import json
+import struct
+import zlib
+from typing import Dict, Tuple
+
+# Non-standard library imports
+import numpy as np
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Blob layout: MAGIC | header length (uint32, little endian) | JSON header | zlib(raw buffers)
+BLOB_MAGIC = b'BTB1'
+BLOB_PREFIX = struct.Struct('<4sI')
+# zlib level (the buffers are mostly small integers and repeated values)
+BLOB_COMPRESSION = 6
+##########################################################################################################
+
+
+def pack_arrays(arrays: Dict[str, np.ndarray], meta: dict = None) -> bytes:
+    """Packs named arrays (and a JSON-serialisable meta dict) into one compressed blob
+
+    Args:
+        arrays (dict):  Arrays to store. Their dtype and shape are kept
+        meta (dict):    Extra values stored in the header
+
+    Returns:
+        (bytes): The blob
+    """
+    columns, buffers, offset = [], [], 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        if values.dtype.hasobject:
+            raise ValueError(f'Array {name} has dtype object and cannot be packed')
+        columns.append({'name': name, 'dtype': values.dtype.str, 'shape': values.shape, 'offset': offset})
+        buffers.append(values.tobytes())
+        offset += values.nbytes
+    header = json.dumps({'columns': columns, 'meta': meta or {}}).encode()
+    body = zlib.compress(b''.join(buffers), BLOB_COMPRESSION)
+    return BLOB_PREFIX.pack(BLOB_MAGIC, len(header)) + header + body
+
+
+def unpack_arrays(blob: bytes) -> Tuple[Dict[str, np.ndarray], dict]:
+    """Arrays and meta dict of a blob made by pack_arrays. The arrays are read-only views
+       over one decompressed buffer (no copy per array).
+
+    Raises:
+        ValueError: If blob is not a packed blob
+    """
+    blob = bytes(blob)
+    if len(blob) < BLOB_PREFIX.size:
+        raise ValueError('Not a packed blob')
+    magic, header_size = BLOB_PREFIX.unpack_from(blob)
+    if magic != BLOB_MAGIC:
+        raise ValueError('Not a packed blob')
+    start = BLOB_PREFIX.size
+    header = json.loads(blob[start:start + header_size])
+    body = zlib.decompress(blob[start + header_size:])
+    arrays = {}
+    for column in header['columns']:
+        dtype = np.dtype(column['dtype'])
+        count = int(np.prod(column['shape'], dtype=np.int64))
+        arrays[column['name']] = np.frombuffer(body, dtype=dtype, count=count,
+                                               offset=column['offset']).reshape(column['shape'])
+    return arrays, header['meta']
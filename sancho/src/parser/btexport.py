@@ -0,0 +1,248 @@
+"""
+Streaming export of the metrics of many backtests to one columnar file (CSV, Parquet or
+Arrow IPC).
+
+Rows are buffered in typed NumPy columns of chunk_rows rows and every full chunk is
+written to the open file (a CSV block, a Parquet row group or an IPC record batch), so
+the memory doesn't grow with the number of rows. Columns are typed:
+    * str:      text
+    * int:      int64
+    * float:    float64
+    * bool:     bool
+    * decimal:  int64 scaled by 10 ** scale (Decimal('1.2345') with scale 4 is 12345)
+    * duration: int64 nanoseconds
+    * datetime: int64 nanoseconds since 1970-01-01 (naive times as they are)
+In Parquet and Arrow the scale and unit of the columns are kept in the field metadata.
+Missing values are nulls (empty cells in CSV).
+
+Parquet and Arrow IPC need pyarrow, which is optional.
+"""
+
+# Standard library imports
+import csv
+from decimal import Decimal
+from pathlib import Path
+from typing import Iterable, Mapping
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:     # Optional: only for Parquet and Arrow IPC
+    pa = None
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Formats by file suffix
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+# Rows buffered before every write
+EXPORT_CHUNK_ROWS = 8192
+# Decimal places kept by the decimal columns (same as the DecimalFields of Metrics)
+DECIMAL_SCALE = 4
+# Columns exported for every backtest: identification plus the fields of the Metrics model
+METRICS_SCHEMA = {
+    'name': 'str',
+    'optimization': 'int',
+    'period': 'str',
+    'symbol': 'str',
+    'timeframe': 'str',
+    'is_valid': 'bool',
+    'profit': 'decimal',
+    'loss': 'decimal',
+    'num_ops': 'int',
+    'pf': 'decimal',
+    'rf': 'decimal',
+    'dd': 'decimal',
+    'ep': 'decimal',
+    'kratio': 'decimal',
+    'max_losing_strike': 'int',
+    'max_winning_strike': 'int',
+    'avg_losing_strike': 'int',
+    'avg_winning_strike': 'int',
+    'max_lots': 'decimal',
+    'min_lots': 'decimal',
+    'max_exposure': 'decimal',
+    'time_in_market': 'duration',
+    'pct_winner': 'decimal',
+    'closing_days': 'int',
+    'sqn': 'decimal',
+    'sharpe_ratio': 'decimal',
+    'best_operation_pips': 'int',
+    'best_operation_datetime': 'datetime',
+    'worst_operation_pips': 'int',
+    'worst_operation_datetime': 'datetime',
+    'avg_win': 'decimal',
+    'avg_loss': 'decimal',
+    'total_bt_duration': 'duration',
+    'avg_op_duration': 'duration',
+    'longest_op_duration': 'duration',
+    'shortest_op_duration': 'duration',
+}
+# NumPy buffer of every column type
+_BUFFER_DTYPES = {'str': object, 'int': np.int64, 'float': np.float64, 'bool': np.bool_,
+                  'decimal': np.int64, 'duration': np.int64, 'datetime': np.int64}
+##########################################################################################################
+
+
+def _to_scaled(value, scale: int) -> int:
+    return int(Decimal(str(value) if isinstance(value, float) else value).scaleb(scale).to_integral_value())
+
+
+def _to_ns(value, kind: str) -> int:
+    return (pd.Timedelta(value) if kind == 'duration' else pd.Timestamp(value)).value
+
+
+class MetricsExporter:
+    """
+    Writes rows (dicts) of metrics to one CSV, Parquet or Arrow IPC file in chunks.
+
+        with MetricsExporter('metrics.parquet') as exporter:
+            for row in rows:
+                exporter.add(row)
+
+    Instance variables:
+        path (Path):            Output file (overwritten)
+        fmt (str):              'csv', 'parquet' or 'arrow' (from the suffix by default)
+        schema (Dict[str, str]): Column name -> type (see the module docstring)
+        chunk_rows (int):       Rows per write
+        scale (int):            Decimal places of the decimal columns
+        rows (int):             Rows written so far
+
+    Instance methods:
+        * add
+        * extend
+        * flush
+        * close
+    """
+
+    def __init__(self, path: Path, fmt: str = None, schema: Mapping[str, str] = METRICS_SCHEMA,
+                 chunk_rows: int = EXPORT_CHUNK_ROWS, scale: int = DECIMAL_SCALE) -> None:
+        self.path = Path(path)
+        self.fmt = fmt or EXPORT_FORMATS.get(self.path.suffix.lower())
+        if self.fmt not in EXPORT_FORMATS.values():
+            raise ValueError(f'Unknown export format for {self.path}, expected one of {sorted(EXPORT_FORMATS)}')
+        if self.fmt != 'csv' and pa is None:
+            raise ImportError(f'Exporting to {self.fmt} requires pyarrow')
+        self.schema = dict(schema)
+        self.chunk_rows = chunk_rows
+        self.scale = scale
+        self.rows = 0
+        self._size = 0
+        self._values = {name: np.empty(chunk_rows, dtype=_BUFFER_DTYPES[kind]) for name, kind in self.schema.items()}
+        self._valid = {name: np.zeros(chunk_rows, dtype=bool) for name in self.schema}
+        self._writer = None
+        self._file = None
+
+    def __enter__(self) -> 'MetricsExporter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _convert(self, value, kind: str):
+        match kind:
+            case 'decimal':
+                return _to_scaled(value, self.scale)
+            case 'duration' | 'datetime':
+                return _to_ns(value, kind)
+            case 'str':
+                return str(value)
+            case _:
+                return value
+
+    def add(self, row: Mapping) -> None:
+        """Buffers one row. Columns of the schema missing from row are null."""
+        i = self._size
+        for name, kind in self.schema.items():
+            value = row.get(name)
+            valid = value is not None and not (isinstance(value, float) and np.isnan(value) and kind != 'float')
+            self._valid[name][i] = valid
+            if valid:
+                self._values[name][i] = self._convert(value, kind)
+        self._size += 1
+        if self._size == self.chunk_rows:
+            self.flush()
+
+    def extend(self, rows: Iterable[Mapping]) -> int:
+        """Adds every row of an iterable (e.g. a QuerySet.values().iterator()). Returns the rows added."""
+        count = 0
+        for row in rows:
+            self.add(row)
+            count += 1
+        return count
+
+    def _arrow_schema(self):
+        fields = []
+        for name, kind in self.schema.items():
+            arrow_type = {'str': pa.string(), 'float': pa.float64(), 'bool': pa.bool_()}.get(kind, pa.int64())
+            metadata = {'scale': str(self.scale)} if kind == 'decimal' else \
+                {'unit': 'ns'} if kind in ('duration', 'datetime') else None
+            fields.append(pa.field(name, arrow_type, metadata=metadata))
+        return pa.schema(fields)
+
+    def _arrow_batch(self, size: int):
+        schema = self._arrow_schema()
+        columns = [pa.array(self._values[name][:size], type=schema.field(name).type, mask=~self._valid[name][:size])
+                   for name in self.schema]
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    def _open(self) -> None:
+        match self.fmt:
+            case 'csv':
+                self._file = open(self.path, 'w', newline='')
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(list(self.schema))
+            case 'parquet':
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, self._arrow_schema())
+            case 'arrow':
+                self._file = pa.OSFile(str(self.path), 'wb')
+                self._writer = pyarrow.ipc.new_file(self._file, self._arrow_schema())
+
+    def flush(self) -> None:
+        """Writes the buffered rows"""
+        if self._writer is None:
+            self._open()
+        size = self._size
+        if not size:
+            return
+        if self.fmt == 'csv':
+            columns = [[v if ok else '' for v, ok in zip(self._values[name][:size].tolist(), self._valid[name][:size])]
+                       for name in self.schema]
+            self._writer.writerows(zip(*columns))
+        elif self.fmt == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([self._arrow_batch(size)]))
+        else:
+            self._writer.write_batch(self._arrow_batch(size))
+        self.rows += size
+        self._size = 0
+
+    def close(self) -> None:
+        """Writes what is left and closes the file (an empty export still gets its header)"""
+        self.flush()
+        if self.fmt != 'csv' and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        self._writer = self._file = None
+
+
+def read_export(path: Path, schema: Mapping[str, str] = METRICS_SCHEMA,
+                scale: int = DECIMAL_SCALE) -> pd.DataFrame:
+    """Reads an exported CSV back into a DataFrame with Decimal, Timedelta and Timestamp
+       values (mainly to check the exports)"""
+    df = pd.read_csv(path, dtype={name: 'string' for name, kind in schema.items() if kind == 'str'})
+    for name, kind in schema.items():
+        if name not in df:
+            continue
+        match kind:
+            case 'decimal':
+                df[name] = [Decimal(int(v)).scaleb(-scale) if pd.notna(v) else None for v in df[name]]
+            case 'duration':
+                df[name] = pd.to_timedelta(df[name], unit='ns')
+            case 'datetime':
+                df[name] = pd.to_datetime(df[name], unit='ns')
+    return df
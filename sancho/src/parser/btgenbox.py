@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 # Project imports
+from .btinstrument import stage, timed
 from .btparser import (BtParser,
                        BtPlatforms, 
                        BtPeriods, 
@@ -29,6 +30,19 @@ OPS_FINAL_COLUMN_NAMES = ['Open Time', 'Close Time', 'S/L', 'T/P', 'Duration',
 ##########################################################################################################
 
 
+def report_key(file: str, field_sep: str = GENBOX_FIELD_SEP) -> tuple:
+    """Name and period (BtPeriods) of a Genbox report from its file name alone, i.e. without
+       parsing it. The IS, OS and ISOS reports of a set share the name."""
+    fields = file.split(EXTENSION_SEP)[0].split(field_sep)
+    match fields[-1]:
+        case 'IS':
+            return field_sep.join(fields[:-1]), BtPeriods.IS
+        case 'OS':
+            return field_sep.join(fields[:-1]), BtPeriods.OS
+        case _:
+            return file.split(EXTENSION_SEP)[0], BtPeriods.ISOS
+
+
 class BtGenbox(BtParser):
     """
     Represents a Genbox Backtest object
@@ -48,6 +62,7 @@ class BtGenbox(BtParser):
         * period
         * symbol
         * ordertype
+        * costs
 
     Instance methods (inherited):
         * get_order_multiplier
@@ -59,7 +74,7 @@ class BtGenbox(BtParser):
         * _bt_platform
     """
 
-    def __init__(self, path: Path, file: str) -> None:
+    def __init__(self, path: Path, file: str, table: pd.DataFrame = None) -> None:
         """
         Creates and returns a Genbox object
 
@@ -71,19 +86,25 @@ class BtGenbox(BtParser):
         file: str
                 Filename for the Genbox backtest to be parsed
 
+        table: pandas.DataFrame, optional
+                Raw table of the report already read (e.g. by btstream.ReportTableParser
+                while it was uploaded); the file is not read then
+
         Returns
         -------
         None
         """
 
         super().__init__(path, file)
+        self._table = table
         # TODO: Change self.operations for something more descriptive
         
         if path == '.' or path is None:             
             self.operations = Path(self.file)
         else:
             self.operations = Path(self.path/self.file)
-        self.platform = self._bt_platform()
+        # Con la tabla ya leída no se vuelve a leer el fichero (solo un informe de Genbox la trae)
+        self.platform = BtPlatforms.GBX if table is not None else self._bt_platform()
         self.period = self._bt_period()
         
     
@@ -93,10 +114,7 @@ class BtGenbox(BtParser):
            The name of the backtest is the same for 3 backtests (IS, OS, and ISOS)
            since it should be the same parametrization over different periods of time
         """
-        if self.period == BtPeriods.ISOS:
-            return self.file.split(EXTENSION_SEP)[0]
-        else:
-            return '_'.join(self.file.split(EXTENSION_SEP)[0].split(GENBOX_FIELD_SEP)[:-1])
+        return report_key(self.file)[0]
 
     @property
     def platform(self) -> BtPlatforms:
@@ -129,6 +147,12 @@ class BtGenbox(BtParser):
         '''
         self._ops = self.parse_html()
     
+    @property
+    def costs(self) -> pd.DataFrame:
+        """Read-only property with the cost columns dropped from the operations
+           (Commission, Taxes and Swap), aligned with the operations index"""
+        return self._costs
+
     @property
     # TODO - for next version, try to check symbol really exists
     #        i.e. it is valid
@@ -144,6 +168,7 @@ class BtGenbox(BtParser):
     def timeframe(self) -> str:
         return ''
 
+    @timed('parse.parse_html')
     def parse_html(self,  deposit: float = 10000.00) -> pd.DataFrame:
         """
         Parses Backtest for Genbox-like backtest as html file.
@@ -160,72 +185,81 @@ class BtGenbox(BtParser):
             information such as open and close times, prices.
             This information is used later to get the metrics
         """
-        if self.path == '.':
-            pd.read_html(Path(self.file))
+        if self._table is not None:
+            raw_table = self._table
         else:
-            raw_data = pd.read_html(Path(self.path/self.file))
+            with stage('parse.read_html'):
+                if self.path == '.':
+                    raw_table = pd.read_html(Path(self.file))[0]
+                else:
+                    raw_table = pd.read_html(Path(self.path/self.file))[0]
         
-        # Read operations
-        ops = raw_data[0].iloc[2:, :]
-
-        # Quitar las filas que contienen la cadena "Genbox"
-        # Estas filas tienen NaN en las celdas
-        ops = ops.dropna()
-
-        # Reseteamos el índice
-        ops.reset_index(inplace=True, drop=True)
-
-        # Asignar el nombre de las columnas
-        # Eliminar la fila con el nombre de las columnas
-        ops.columns = ops.iloc[0, :]
-
-        # Quitamos la fila con las columnas y la que
-        # marca el depósito
-        ops.drop([0, 1], inplace=True)
-        # ops.drop(1, inplace=True)
-        ops.reset_index(inplace=True, drop=True)
-
-        # El informe termina con la cadena 'Closed P/L:'        
-        end_of_data = 'Closed P/L:'
-        if (ops.Ticket == end_of_data).any():
-            idx = ops.index[ops.Ticket == end_of_data].to_list()[0]
-        else:
-            idx = ops.index.to_list()[-1]
-
-        # Seleccionamos sólo las operaciones
-        ops = ops.iloc[0:idx, :]
-
-        # Reseteamos el índice de nuevo
-        ops.set_index('Ticket', drop=True, inplace=True)
-
-        # Convertimos al formato adecuado las columnas
-        # Columnas temporales
-        ops[ops.columns[0]] = pd.to_datetime(ops[ops.columns[0]])
-        ops[ops.columns[7]] = pd.to_datetime(ops[ops.columns[7]])
-
-        # Columnas de texto
-        ops[ops.columns[1]].astype(str)
-        ops[ops.columns[3]].astype(str)
-
-        # Columnas numéricas
-        num_col = [2, 4, 5, 6, 8, 9, 10, 11, 12]
-        for col in num_col:
-            ops[ops.columns[col]] = ops[ops.columns[col]].astype(float)
-
-        # Nombre inicial de las columnas        
-        ops.columns = OPS_INITIAL_COLUMN_NAMES
-
-        ops['Duration'] = ops['Close Time'] - ops['Open Time']
-        ops['Balance'] = deposit + ops['Profit'].cumsum()
-
-        # Quitamos las columnas que sobran        
+        with stage('parse.select'):
+            # Read operations
+            ops = raw_table.iloc[2:, :]
+
+            # Quitar las filas que contienen la cadena "Genbox"
+            # Estas filas tienen NaN en las celdas
+            ops = ops.dropna()
+
+            # Reseteamos el índice
+            ops.reset_index(inplace=True, drop=True)
+
+            # Asignar el nombre de las columnas
+            # Eliminar la fila con el nombre de las columnas
+            ops.columns = ops.iloc[0, :]
+
+            # Quitamos la fila con las columnas y la que
+            # marca el depósito
+            ops.drop([0, 1], inplace=True)
+            # ops.drop(1, inplace=True)
+            ops.reset_index(inplace=True, drop=True)
+
+            # El informe termina con la cadena 'Closed P/L:'        
+            end_of_data = 'Closed P/L:'
+            if (ops.Ticket == end_of_data).any():
+                idx = ops.index[ops.Ticket == end_of_data].to_list()[0]
+            else:
+                idx = ops.index.to_list()[-1]
+
+            # Seleccionamos sólo las operaciones
+            ops = ops.iloc[0:idx, :]
+
+            # Reseteamos el índice de nuevo
+            ops.set_index('Ticket', drop=True, inplace=True)
+
+        with stage('parse.types', len(ops)):
+            # Convertimos al formato adecuado las columnas
+            # Columnas temporales
+            ops[ops.columns[0]] = pd.to_datetime(ops[ops.columns[0]])
+            ops[ops.columns[7]] = pd.to_datetime(ops[ops.columns[7]])
+
+            # Columnas de texto
+            ops[ops.columns[1]].astype(str)
+            ops[ops.columns[3]].astype(str)
+
+            # Columnas numéricas
+            num_col = [2, 4, 5, 6, 8, 9, 10, 11, 12]
+            for col in num_col:
+                ops[ops.columns[col]] = ops[ops.columns[col]].astype(float)
+
+            # Nombre inicial de las columnas        
+            ops.columns = OPS_INITIAL_COLUMN_NAMES
+
+            ops['Duration'] = ops['Close Time'] - ops['Open Time']
+            ops['Balance'] = deposit + ops['Profit'].cumsum()
+
+        # Quitamos las columnas que sobran, pero guardamos los costes
+        # para poder simular otros escenarios de costes
+        self._costs = ops[OPS_DROP_COLUMN_NAMES].reset_index(drop=True)
         ops.drop(OPS_DROP_COLUMN_NAMES, axis=1, inplace=True)
 
         # Reordenamos las columnas del dataframe para que tanto los de GBX como los de MT4
         # tengan el mismo orden de columnas
         
         # Pips must be split in two different lines if we want to avoid to have all Pips NaN
-        ops['Pips'] = self.get_pips(ops)
+        with stage('parse.pips', len(ops)):
+            ops['Pips'] = self.get_pips(ops)
         ops = ops[OPS_FINAL_COLUMN_NAMES]
 
         # Reasignar número de ticker
@@ -249,11 +283,4 @@ class BtGenbox(BtParser):
         """
 
         # For Genbox-generated BTs, the fields are separated with _
-        period = self.file.split(EXTENSION_SEP)[0].split(field_sep)[-1]
-        match period:
-            case 'IS':
-                return BtPeriods.IS
-            case 'OS':
-                return BtPeriods.OS
-            case _:
-                return BtPeriods.ISOS        
+        return report_key(self.file, field_sep)[1]
@@ -0,0 +1,192 @@
+"""
+Timing instrumentation for the parser and metrics layers.
+
+Every instrumented call records its wall time, and optionally the size of its input
+(e.g. the number of operations), under a name such as 'metrics.calculate_kratio' or
+'parse.read_html'. Records go to the Collector of the current context (one per request
+or Celery task, see collect) and, when it closes, to a process-wide summary.
+
+Collection is switched on and off at runtime with enable(). When it's off an
+instrumented call costs one global lookup and one extra function call. The switch and the
+summary belong to the process: every web or worker process has its own.
+"""
+
+# Standard library imports
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Non-standard library imports
+
+# Project imports
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Collection enabled at import (overridden at runtime with enable)
+ENABLED_AT_START = os.environ.get('SANCHO_INSTRUMENT', '').lower() in ('1', 'true', 'yes')
+# Fields of every entry of a summary
+SUMMARY_FIELDS = ('name', 'calls', 'total_ms', 'mean_ms', 'max_ms', 'size')
+##########################################################################################################
+
+
+_enabled = ENABLED_AT_START
+
+
+def enable(flag: bool = True) -> None:
+    """Switches the collection on (or off)"""
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class Collector:
+    """
+    Aggregated timings by name: calls, total and max wall time (ns) and total input size.
+
+    Instance methods:
+        * record
+        * merge
+        * summary
+        * as_log
+        * reset
+    """
+
+    def __init__(self) -> None:
+        self._stats: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, elapsed_ns: int, size: int = 0) -> None:
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, elapsed_ns, elapsed_ns, size]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed_ns
+                stats[2] = max(stats[2], elapsed_ns)
+                stats[3] += size
+
+    def merge(self, other: 'Collector') -> None:
+        with other._lock:
+            items = [(name, list(stats)) for name, stats in other._stats.items()]
+        with self._lock:
+            for name, (calls, total, longest, size) in items:
+                stats = self._stats.setdefault(name, [0, 0, 0, 0])
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], longest)
+                stats[3] += size
+
+    def summary(self) -> List[dict]:
+        """One entry per name (see SUMMARY_FIELDS), slowest total first"""
+        with self._lock:
+            items = [(name, list(stats)) for name, stats in self._stats.items()]
+        entries = [{
+            'name': name,
+            'calls': calls,
+            'total_ms': round(total / 1e6, 3),
+            'mean_ms': round(total / calls / 1e6, 3),
+            'max_ms': round(longest / 1e6, 3),
+            'size': size,
+        } for name, (calls, total, longest, size) in items]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def as_log(self, **context) -> str:
+        """Single-line JSON with the context values and the summary"""
+        return json.dumps({**context, 'timings': self.summary()}, default=str)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def __bool__(self) -> bool:
+        return bool(self._stats)
+
+
+# Collector of the current request (context) and the summary of the whole process
+_current: ContextVar[Optional[Collector]] = ContextVar('sancho_instrument_collector', default=None)
+_process = Collector()
+
+
+def _record(name: str, elapsed_ns: int, size: int) -> None:
+    collector = _current.get()
+    (collector if collector is not None else _process).record(name, elapsed_ns, size)
+
+
+def timed(name: str, size: Callable[..., int] = None) -> Callable:
+    """Decorator that records the calls of a function under name
+
+    Args:
+        name (str):         Name of the records
+        size (Callable):    Called with the same arguments as the function, returns the size
+                            of its input (only evaluated while the collection is on)
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter_ns() - start, size(*args, **kwargs) if size else 0)
+        wrapper.__instrumented__ = name
+        return wrapper
+    return decorator
+
+
+def instrumented(prefix: str, size: Callable[..., int] = None) -> Callable:
+    """Class decorator that applies timed to every public method defined in the class,
+       named prefix.method (properties and inherited methods are not timed)"""
+    def decorator(cls: type) -> type:
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or not callable(value) or isinstance(value, (staticmethod, classmethod, type)):
+                continue
+            setattr(cls, attr, timed(f'{prefix}.{attr}', size)(value))
+        return cls
+    return decorator
+
+
+@contextmanager
+def stage(name: str, size: int = 0) -> Iterator[None]:
+    """Records the block as one call of name"""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter_ns() - start, size)
+
+
+@contextmanager
+def collect() -> Iterator[Collector]:
+    """Collects the records of the block (e.g. a request) in a new Collector, which is
+       merged into the process summary at the end"""
+    collector = Collector()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+        _process.merge(collector)
+
+
+def summary() -> List[dict]:
+    """Summary of everything recorded by this process"""
+    return _process.summary()
+
+
+def reset() -> None:
+    _process.reset()
@@ -0,0 +1,182 @@
+"""
+Vectorized kernels for the metrics in BtMetrics.
+
+Every kernel works over the last axis of NumPy arrays, so the same call evaluates one backtest
+(shape (n,)) or a whole batch of scenarios/subsets (shape (..., n)) at once. The optional
+`where` argument is a boolean mask with the same shape as the PnL that selects the operations
+taking part in each row, which lets many subsets of one merged backtest be evaluated without
+compacting the arrays.
+
+The kernels return plain floats/ndarrays; BtMetrics keeps the Decimal presentation layer. They
+follow the formulas in BtMetrics, including its conventions (e.g. the drawdown peak starts at the
+first operation, not at zero), so results are comparable with the stored metrics.
+"""
+
+# Standard library imports
+from typing import Optional
+
+# Non-standard library imports
+import numpy as np
+
+# Project imports
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Nanoseconds in one day (close times are handled as datetime64[ns] / int64)
+DAY_NS = 86_400 * 10 ** 9
+# Rows of the containment matrix evaluated at once by exposure_volumes
+EXPOSURE_BLOCK = 1024
+##########################################################################################################
+
+
+def _masked(pnl: np.ndarray, where: Optional[np.ndarray]) -> np.ndarray:
+    pnl = np.asarray(pnl, dtype=float)
+    return pnl if where is None else np.where(where, pnl, 0.0)
+
+
+def _count(pnl: np.ndarray, where: Optional[np.ndarray]) -> np.ndarray:
+    if where is None:
+        return np.full(pnl.shape[:-1], pnl.shape[-1], dtype=float)
+    return np.asarray(where).sum(axis=-1, dtype=float)
+
+
+def _safe_div(num: np.ndarray, den: np.ndarray, fill: float = np.inf) -> np.ndarray:
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), np.asarray(den, dtype=float))
+    out = np.full(num.shape, fill, dtype=float)
+    np.divide(num, den, out=out, where=den != 0)
+    return out if out.ndim else out.item()
+
+
+def num_ops(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    return _count(np.asarray(pnl), where)
+
+
+def equity(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cumulative PnL (balance curve without the initial deposit)"""
+    return np.cumsum(_masked(pnl, where), axis=-1)
+
+
+def drawdown(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same as BtMetrics.drawdown: equity minus its running maximum"""
+    eq = equity(pnl, where)
+    if where is None:
+        return eq - np.maximum.accumulate(eq, axis=-1)
+    # The running peak must start at the first selected operation, as it does for
+    # a compacted series
+    started = np.logical_or.accumulate(where, axis=-1)
+    peak = np.maximum.accumulate(np.where(started, eq, -np.inf), axis=-1)
+    return np.where(started, eq - np.where(started, peak, 0.0), 0.0)
+
+
+def max_drawdown(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same as BtMetrics.max_dd (a negative value)"""
+    return drawdown(pnl, where).min(axis=-1)
+
+
+def gross_profit(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    pnl = _masked(pnl, where)
+    return np.where(pnl >= 0, pnl, 0.0).sum(axis=-1)
+
+
+def gross_loss(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    pnl = _masked(pnl, where)
+    return np.where(pnl < 0, pnl, 0.0).sum(axis=-1)
+
+
+def profit_factor(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    return _safe_div(gross_profit(pnl, where), -gross_loss(pnl, where))
+
+
+def recovery_factor(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same as BtMetrics.calculate_rf: gross profit over the max drawdown"""
+    return _safe_div(gross_profit(pnl, where), -max_drawdown(pnl, where))
+
+
+def expectancy(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    return _safe_div(_masked(pnl, where).sum(axis=-1), _count(np.asarray(pnl), where), np.nan)
+
+
+def pct_win(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    wins = (_masked(pnl, where) > 0).sum(axis=-1)
+    return _safe_div(wins * 100.0, _count(np.asarray(pnl), where), np.nan)
+
+
+def avg_win(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    pnl = np.asarray(pnl, dtype=float)
+    sel = pnl >= 0 if where is None else (pnl >= 0) & where
+    return _safe_div(np.where(sel, pnl, 0.0).sum(axis=-1), sel.sum(axis=-1), np.nan)
+
+
+def avg_loss(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    pnl = np.asarray(pnl, dtype=float)
+    sel = pnl < 0 if where is None else (pnl < 0) & where
+    return _safe_div(np.where(sel, pnl, 0.0).sum(axis=-1), sel.sum(axis=-1), np.nan)
+
+
+def sqn(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same as BtMetrics.calculate_sqn (sample standard deviation)"""
+    pnl = np.asarray(pnl, dtype=float)
+    w = np.ones_like(pnl) if where is None else np.asarray(where, dtype=float)
+    n = w.sum(axis=-1)
+    mean = _safe_div((pnl * w).sum(axis=-1), n, np.nan)
+    var = _safe_div((w * (pnl - np.expand_dims(mean, -1)) ** 2).sum(axis=-1), n - 1, np.nan)
+    return _safe_div(mean, np.sqrt(var) / np.sqrt(n), np.nan)
+
+
+def kratio(pnl: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same as BtMetrics.calculate_kratio: slope of the equity curve against the operation
+    number, divided by its standard error and the number of operations"""
+    pnl = np.asarray(pnl, dtype=float)
+    w = np.ones_like(pnl) if where is None else np.asarray(where, dtype=float)
+    n = w.sum(axis=-1)
+    x = np.cumsum(w, axis=-1) - 1.0
+    y = np.cumsum(pnl * w, axis=-1)
+    xm = np.expand_dims(_safe_div((w * x).sum(axis=-1), n, np.nan), -1)
+    ym = np.expand_dims(_safe_div((w * y).sum(axis=-1), n, np.nan), -1)
+    xdev = (w * (x - xm) ** 2).sum(axis=-1)
+    ydev = (w * (y - ym) ** 2).sum(axis=-1)
+    sxy = (w * (x - xm) * (y - ym)).sum(axis=-1)
+    slope = _safe_div(sxy, xdev, np.nan)
+    resid = np.around(_safe_div(ydev - _safe_div(sxy ** 2, xdev, np.nan), n - 2, np.nan), decimals=8)
+    error = np.sqrt(np.maximum(resid, 0.0)) / np.sqrt(xdev)
+    return _safe_div(slope, error * n, np.nan)
+
+
+def closing_days(close_time: np.ndarray, where: Optional[np.ndarray] = None) -> np.ndarray:
+    """Number of different days with at least one closed operation.
+       close_time must be sorted when a 2-D mask is given."""
+    days = np.asarray(close_time).astype('datetime64[ns]').view(np.int64) // DAY_NS
+    if where is None:
+        return np.unique(days).size
+    where = np.asarray(where)
+    if where.ndim == 1:
+        return np.unique(days[where]).size
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return np.logical_or.reduceat(where, starts, axis=-1).sum(axis=-1)
+
+
+def containment_blocks(open_time: np.ndarray, close_time: np.ndarray, block: int = EXPOSURE_BLOCK):
+    """Yields (start, matrix) tiles of the containment matrix used by BtMetrics.exposures,
+       where matrix[i, j] is True when operation j opens and closes within operation start + i."""
+    ot = np.asarray(open_time).astype('datetime64[ns]').view(np.int64)
+    ct = np.asarray(close_time).astype('datetime64[ns]').view(np.int64)
+    for start in range(0, ot.size, block):
+        stop = min(start + block, ot.size)
+        yield start, (ot[None, :] >= ot[start:stop, None]) & (ct[None, :] <= ct[start:stop, None])
+
+
+def exposure_volumes(open_time: np.ndarray, close_time: np.ndarray, volume: np.ndarray,
+                     block: int = EXPOSURE_BLOCK) -> np.ndarray:
+    """Same as BtMetrics.exposures()[1]: for every operation, the volume of the operations that
+       open and close within it. volume can be (n,) or (r, n) to size several rules at once."""
+    volume = np.asarray(volume, dtype=float)
+    out = np.empty(volume.shape, dtype=float)
+    for start, tile in containment_blocks(open_time, close_time, block):
+        out[..., start:start + tile.shape[0]] = (tile.astype(float) @ volume.T).T
+    return out
+
+
+def max_exposure(open_time: np.ndarray, close_time: np.ndarray, volume: np.ndarray,
+                 block: int = EXPOSURE_BLOCK) -> np.ndarray:
+    return exposure_volumes(open_time, close_time, volume, block).max(axis=-1)
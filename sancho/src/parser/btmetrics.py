@@ -13,6 +13,7 @@ from sklearn.linear_model import LinearRegression
 
 # Project imports
 from .btgenbox import BtGenbox
+from .btinstrument import instrumented
 
 ################################################################
 # CONSTANTS AND ENUMERATIONS USED BY THIS CLASS
@@ -81,6 +82,14 @@ DEFAULT_CRITERIA = {
 
 ################################################################
 
+
+def _num_ops(metrics: 'BtMetrics', *args, **kwargs) -> int:
+    """Input size recorded by the instrumentation: operations of the backtest"""
+    ops = getattr(metrics, '_ops', None)
+    return len(ops) if ops is not None else 0
+
+
+@instrumented('metrics', size=_num_ops)
 class BtMetrics:
     """
     Represents a Btmetrics object. From a backtest, it calculates different metrics to characterize the
@@ -480,8 +489,8 @@ class BtMetrics:
         # TODO: Add a parameter to select the drawdown function
         # TODO: Check why pips_mode changes the result (stagnation should be the same)
         dd = self.drawdown(pips_mode).to_list()
-        stagnation = [self.operations['Close Time'].iloc[dd.index(d)] for \
-                      d in dd if d != 0]
+        stagnation = [self.operations['Close Time'].iloc[i] for \
+                      i, d in enumerate(dd) if d != 0]
 
         durations = pd.Series(stagnation).diff().to_list()
 
@@ -571,7 +580,7 @@ class BtMetrics:
 
     def get_avg_losing_strike(self, pips_mode: bool = True) -> Decimal:
         strikes = self._get_strikes(pips_mode)
-        pairs = zip(strikes[-1].keys(), strikes[1].values())
+        pairs = zip(strikes[-1].keys(), strikes[-1].values())
         average = sum(pair[0] * pair[1] for pair in pairs)
         avg_losing_strike = average / sum(strikes[-1].values())
         return Decimal(avg_losing_strike).quantize(Decimal(DEC_PREC))
@@ -0,0 +1,40 @@
+# Standard library imports
+import hashlib
+import json
+from typing import Set
+
+# Project imports
+from .btmetrics import DEFAULT_CRITERIA
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Revisions of the metric formulas: (revision, Metrics fields whose values changed with it).
+# Every Metrics row records the revision it was calculated with (Metrics.metric_version),
+# so the fields changed by a later revision are known to be stale.
+# Add a revision here whenever a change in btmetrics alters a stored value.
+METRIC_REVISIONS = (
+    (1, ()),
+    # get_avg_losing_strike zipped the losing strikes with the winning counts, and
+    # ingest compared is_valid (a bool) with 'Y'
+    (2, ('avg_losing_strike', 'is_valid')),
+)
+# Revision of the current formulas
+METRIC_VERSION = METRIC_REVISIONS[-1][0]
+##########################################################################################################
+
+
+def stale_fields(version: int) -> Set[str]:
+    """Metrics fields changed by the revisions after version"""
+    return {field for revision, fields in METRIC_REVISIONS if revision > version for field in fields}
+
+
+def criteria_hash(criteria: dict = DEFAULT_CRITERIA) -> str:
+    """Short digest of a criteria dict: Metrics.is_valid is stale when the digest stored with
+       it is not the one of the current criteria"""
+    text = json.dumps(criteria, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+# Digest of the current criteria, computed once (compared with every Metrics row read)
+CRITERIA_HASH = criteria_hash()
@@ -0,0 +1,141 @@
+"""
+Incremental parsing of the table of operations of a report while its bytes arrive (e.g.
+from the chunks of an upload), instead of reading the whole file with pandas.read_html
+once it is complete.
+
+ReportTableParser is fed with chunks of bytes and keeps only the texts of the rows of the
+first table of the report; the elements already read are dropped, so the memory doesn't
+hold the whole document tree. close() returns the same raw DataFrame as
+pandas.read_html(report)[0], which BtGenbox takes as table= to skip reading the file:
+
+    parser = ReportTableParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    bt = BtGenbox(path, name, table=parser.close())
+
+dump_table and load_table keep a raw table as JSON between the upload and the ingest job
+(loading JSON runs no code, unlike a pickle).
+"""
+
+# Standard library imports
+import json
+from pathlib import Path
+from typing import List, Optional
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Bytes read at a time by parse_report_table
+READ_CHUNK_SIZE = 64 * 1024
+##########################################################################################################
+
+
+class ReportTableParser:
+    """
+    Builds the raw table of a report from chunks of its bytes.
+
+    Instance variables:
+        rows (List[list]):  Texts of the rows read so far (None for the empty cells)
+        size (int):         Bytes fed so far
+
+    Instance methods:
+        * feed
+        * close
+    """
+
+    def __init__(self) -> None:
+        self.rows: List[list] = []
+        self.size = 0
+        self._parser = etree.HTMLPullParser(events=('start', 'end'), tag=('table', 'tr'))
+        self._table = None          # first <table> of the report
+        self._done = False          # first table already closed
+        self._result: Optional[pd.DataFrame] = None
+
+    def feed(self, data: bytes) -> None:
+        """Parses one more chunk of the report"""
+        if self._done:
+            return
+        self.size += len(data)
+        self._parser.feed(data)
+        self._read_events()
+
+    def _read_events(self) -> None:
+        for event, element in self._parser.read_events():
+            if self._done:
+                continue
+            if element.tag == 'table':
+                if event == 'start' and self._table is None:
+                    self._table = element
+                elif event == 'end' and element is self._table:
+                    self._done = True
+            elif event == 'end' and self._table is not None:
+                self.rows.append(self._row(element))
+                # Las filas ya leídas no hacen falta
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    @staticmethod
+    def _row(tr) -> list:
+        # Igual que read_html: colspan repite el texto y las celdas vacías son NaN
+        cells = []
+        for cell in tr:
+            if cell.tag not in ('td', 'th'):
+                continue
+            text = ' '.join(''.join(cell.itertext()).split())
+            try:
+                span = max(int(cell.get('colspan', 1)), 1)
+            except ValueError:
+                span = 1
+            cells.extend([text or None] * span)
+        return cells
+
+    def close(self) -> pd.DataFrame:
+        """Ends the parsing and returns the raw table (as pandas.read_html(report)[0])"""
+        if self._result is None:
+            if not self._done:
+                self._parser.close()
+                self._read_events()
+            if self._table is None:
+                raise ValueError('No tables found')
+            self._result = table_frame(self.rows)
+            self.rows = []
+        return self._result
+
+
+def table_frame(rows: List[list]) -> pd.DataFrame:
+    """Raw table of rows of texts (None for the empty cells), as pandas.read_html builds it"""
+    width = max((len(row) for row in rows), default=0)
+    rows = [row + [None] * (width - len(row)) for row in rows]
+    return pd.DataFrame(rows, dtype=object).fillna(np.nan)
+
+
+def dump_table(table: pd.DataFrame) -> bytes:
+    """Raw table as JSON: a list of rows of texts, null for the empty cells"""
+    return json.dumps(table.astype(object).where(table.notna(), None).values.tolist()).encode()
+
+
+def load_table(data: bytes) -> pd.DataFrame:
+    """Raw table written by dump_table
+
+    Raises:
+        ValueError: If data is not a table written by dump_table
+    """
+    rows = json.loads(data)
+    if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+        raise ValueError('Not a raw table')
+    return table_frame(rows)
+
+
+def parse_report_table(path: Path, chunk_size: int = READ_CHUNK_SIZE) -> pd.DataFrame:
+    """Raw table of a report file read in chunks (mainly to check ReportTableParser)"""
+    parser = ReportTableParser()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            parser.feed(chunk)
+    return parser.close()
@@ -0,0 +1,68 @@
+# Standard library imports
+from typing import Sequence
+
+# Non-standard library imports
+import numpy as np
+
+# Project imports
+from .btparser import BtPeriods
+from .bttrades import BtTrades
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Symbols drawn for the synthetic operations
+SYNTHETIC_SYMBOLS = ('EURUSD', 'GBPUSD', 'AUDUSD', 'USDJPY', 'EURJPY')
+# Money per pip and lot (about 10 for the majors)
+SYNTHETIC_PIP_VALUE = 10.0
+# Lot sizes drawn for the operations
+SYNTHETIC_LOTS = (0.01, 0.05, 0.1, 0.5, 1.0)
+##########################################################################################################
+
+
+def synthetic_trades(num_ops: int, seed: int = 0, symbols: Sequence[str] = SYNTHETIC_SYMBOLS,
+                     start: str = '2010-01-01', mean_gap_hours: float = 6.0, mean_duration_hours: float = 12.0,
+                     streak: float = 0.75, win_pips: float = 40.0, loss_pips: float = 30.0,
+                     name: str = None) -> BtTrades:
+    """Random operations with the properties of a real backtest, ordered by close time:
+        * arrivals every mean_gap_hours and log-normal durations around mean_duration_hours,
+          so many operations overlap (and some contain others)
+        * outcomes from a two-state Markov chain: an operation has the outcome of the previous
+          one with probability streak, which gives long winning and losing streaks
+        * several symbols, both directions and a few lot sizes
+
+    Args:
+        num_ops (int):  Number of operations
+        seed (int):     Seed for the generator (same seed, same operations)
+
+    Returns:
+        (BtTrades): The operations, named synthetic_<num_ops>_<seed> by default
+    """
+    rng = np.random.default_rng(seed)
+    hour = np.timedelta64(3600, 's').astype('timedelta64[ns]').astype(np.int64)
+    gaps = rng.exponential(mean_gap_hours * hour, num_ops).astype(np.int64)
+    open_time = np.datetime64(start, 'ns').astype(np.int64) + np.cumsum(gaps)
+    sigma = 1.0
+    durations = rng.lognormal(np.log(mean_duration_hours * hour) - sigma ** 2 / 2, sigma, num_ops).astype(np.int64)
+    close_time = open_time + np.maximum(durations, 60 * 10 ** 9)
+    # Outcome changes with probability 1 - streak: the parity of the changes so far
+    changes = np.cumsum(rng.random(num_ops) > streak)
+    win = (changes + rng.integers(0, 2)) % 2 == 1
+    pips = np.where(win, rng.exponential(win_pips, num_ops), -rng.exponential(loss_pips, num_ops)).round(1)
+    volume = rng.choice(SYNTHETIC_LOTS, num_ops)
+    # Report times have a resolution of seconds
+    open_time -= open_time % 10 ** 9
+    close_time -= close_time % 10 ** 9
+    order = np.argsort(close_time, kind='stable')
+    return BtTrades(
+        name=name or f'synthetic_{num_ops}_{seed}',
+        period=BtPeriods.ISOS,
+        open_time=open_time[order].astype('datetime64[ns]'),
+        close_time=close_time[order].astype('datetime64[ns]'),
+        direction=rng.choice(np.array([1, -1], dtype=np.int8), num_ops),
+        volume=volume[order],
+        pips=pips[order],
+        profit=(pips * volume * SYNTHETIC_PIP_VALUE).round(2)[order],
+        symbol=np.asarray(symbols)[rng.integers(0, len(symbols), num_ops)],
+        commission=-(volume * 7.0)[order],
+    )
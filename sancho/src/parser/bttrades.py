@@ -0,0 +1,193 @@
+# Standard library imports
+from typing import Sequence, Union
+
+# Non-standard library imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+from .btblob import pack_arrays, unpack_arrays
+from .btparser import BtPeriods, BtOrderType
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS CLASS
+# Array columns held by BtTrades and their dtypes
+TRADES_COLUMNS = {
+    'open_time': 'datetime64[ns]',
+    'close_time': 'datetime64[ns]',
+    'direction': 'int8',
+    'volume': 'float64',
+    'pips': 'float64',
+    'profit': 'float64',
+    'symbol': 'U12',
+    'commission': 'float64',
+    'taxes': 'float64',
+    'swap': 'float64',
+}
+# Cost columns (optional: zero when the source doesn't report them)
+COST_COLUMNS = {'commission': 'Commission', 'taxes': 'Taxes', 'swap': 'Swap'}
+# Initial deposit used to rebuild the Balance column
+DEFAULT_DEPOSIT = 10000.00
+##########################################################################################################
+
+
+class BtTrades:
+    """
+    Represents the operations of a backtest as read-only NumPy columns. It is the
+    input for the vectorized engines (portfolios, costs, sizing...) and it can be
+    passed to BtMetrics in place of a BtGenbox object.
+
+    Instance variables:
+        name (str):         Name of the backtest
+        period (BtPeriods): Period of the backtest
+        open_time, close_time, direction, volume, pips, profit, symbol,
+        commission, taxes, swap (np.ndarray):
+                            One array per column (see TRADES_COLUMNS). direction is
+                            1 for buy and -1 for sell operations. The costs are the
+                            amounts recorded in the report (usually <= 0).
+
+    Instance properties:
+        * operations
+        * symbol_name
+        * ordertype
+
+    Instance methods:
+        * from_operations
+        * from_backtest
+        * pnl
+        * take
+        * sorted_by_close
+        * from_period_to_text
+        * to_bytes
+        * from_bytes
+    """
+
+    def __init__(self, name: str = '', period: BtPeriods = BtPeriods.ISOS, **columns) -> None:
+        """Creates and returns a BtTrades object
+
+        Args:
+            name (str):         Name of the backtest
+            period (BtPeriods): Period of the backtest
+            **columns:          Arrays for every column in TRADES_COLUMNS (the
+                                cost columns default to zeros)
+
+        Returns:
+            None
+        """
+        if 'close_time' in columns:
+            for column in COST_COLUMNS:
+                columns.setdefault(column, np.zeros(len(columns['close_time'])))
+        missing = set(TRADES_COLUMNS) - set(columns)
+        if missing:
+            raise ValueError(f'Missing trade columns: {sorted(missing)}')
+        self.name = name
+        self.period = period
+        self._ops = None
+        size = None
+        for column, dtype in TRADES_COLUMNS.items():
+            values = np.asarray(columns[column], dtype=dtype)
+            if size is not None and values.shape[0] != size:
+                raise ValueError(f'Column {column} has {values.shape[0]} rows, expected {size}')
+            size = values.shape[0]
+            values.flags.writeable = False
+            setattr(self, column, values)
+
+    @classmethod
+    def from_operations(cls, ops: pd.DataFrame, name: str = '',
+                        period: BtPeriods = BtPeriods.ISOS, costs: pd.DataFrame = None) -> 'BtTrades':
+        """Builds the arrays from an operations DataFrame as returned by BtGenbox.parse_html.
+           The costs are taken from costs, or from ops if it still has the cost columns."""
+        direction = np.where(ops['Type'].astype(str).str.lower() == 'buy', 1, -1)
+        costs = ops if costs is None else costs
+        cost_columns = {column: costs[source].to_numpy(dtype=float)
+                        for column, source in COST_COLUMNS.items() if source in costs}
+        return cls(
+            name=name,
+            period=period,
+            open_time=ops['Open Time'].to_numpy(dtype='datetime64[ns]'),
+            close_time=ops['Close Time'].to_numpy(dtype='datetime64[ns]'),
+            direction=direction,
+            volume=ops['Volume'].to_numpy(dtype=float),
+            pips=ops['Pips'].to_numpy(dtype=float),
+            profit=ops['Profit'].to_numpy(dtype=float),
+            symbol=ops['Symbol'].astype(str).str.upper().to_numpy(),
+            **cost_columns,
+        )
+
+    @classmethod
+    def from_backtest(cls, bt) -> 'BtTrades':
+        """Builds the arrays from a BtGenbox (or any object with name, period and operations)"""
+        return cls.from_operations(bt.operations, bt.name, bt.period, getattr(bt, 'costs', None))
+
+    def __len__(self) -> int:
+        return self.close_time.shape[0]
+
+    def __repr__(self) -> str:
+        return f'BtTrades(name={self.name!r}, ops={len(self)})'
+
+    @property
+    def operations(self) -> pd.DataFrame:
+        """Operations DataFrame with the columns used by BtMetrics, built once on demand"""
+        if self._ops is None:
+            self._ops = pd.DataFrame({
+                'Open Time': self.open_time,
+                'Close Time': self.close_time,
+                'Duration': self.close_time - self.open_time,
+                'Type': np.where(self.direction > 0, 'buy', 'sell'),
+                'Volume': self.volume,
+                'Symbol': self.symbol,
+                'Pips': self.pips,
+                'Profit': self.profit,
+                'Balance': DEFAULT_DEPOSIT + np.cumsum(self.profit),
+            })
+        return self._ops
+
+    @property
+    def symbol_name(self) -> str:
+        return str(self.symbol[0]) if len(self) else ''
+
+    @property
+    def ordertype(self) -> BtOrderType:
+        directions = np.unique(self.direction)
+        if directions.size > 1:
+            return BtOrderType.BOTH
+        return BtOrderType.BUY if directions.size and directions[0] > 0 else BtOrderType.SELL
+
+    def pnl(self, pips_mode: bool = True) -> np.ndarray:
+        return self.pips if pips_mode else self.profit
+
+    def take(self, indices: Union[np.ndarray, Sequence[int]], name: str = None) -> 'BtTrades':
+        """Returns a new BtTrades with the operations at indices (or a boolean mask)"""
+        return BtTrades(
+            name=self.name if name is None else name,
+            period=self.period,
+            **{column: getattr(self, column)[indices] for column in TRADES_COLUMNS},
+        )
+
+    def sorted_by_close(self) -> 'BtTrades':
+        """Returns the operations ordered by close time (stable), or self if already sorted"""
+        ct = self.close_time.view(np.int64)
+        if ct.size < 2 or (ct[1:] >= ct[:-1]).all():
+            return self
+        return self.take(np.argsort(ct, kind='stable'))
+
+    def from_period_to_text(self, period: BtPeriods) -> str:
+        return period.name
+
+    def to_bytes(self) -> bytes:
+        """Compact blob (see btblob) to store the operations. The symbols are stored as codes
+           into the list of distinct symbols"""
+        symbols, codes = np.unique(self.symbol, return_inverse=True)
+        arrays = {column: getattr(self, column) for column in TRADES_COLUMNS if column != 'symbol'}
+        arrays['symbol'] = codes.astype(np.uint16)
+        return pack_arrays(arrays, {'name': self.name, 'period': self.period.name, 'symbols': symbols.tolist()})
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'BtTrades':
+        """BtTrades from a blob made by to_bytes. Every column but symbol is a view over the
+           decompressed blob (no copies)"""
+        arrays, meta = unpack_arrays(blob)
+        arrays['symbol'] = np.asarray(meta['symbols'], dtype=TRADES_COLUMNS['symbol'])[arrays['symbol']] \
+            if meta['symbols'] else np.empty(0, dtype=TRADES_COLUMNS['symbol'])
+        return cls(name=meta['name'], period=BtPeriods[meta['period']], **arrays)
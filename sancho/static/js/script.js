@@ -1,42 +1,119 @@
-$(document).ready(function() {
-    $('#backtest-form').submit(function(event) {
-    event.preventDefault();
-    var form = $(this);
-    var url = form.attr('action');
-    var formData = new FormData(form[0]);
-    var progressBar = $('.progress');
-    progressBar.show();
-    $.ajax({
-        xhr: function() {
-        var xhr = new window.XMLHttpRequest();
-        xhr.upload.addEventListener('progress', function(evt) {
-            if (evt.lengthComputable) {
-            var percentComplete = evt.loaded / evt.total;
-            percentComplete = parseInt(percentComplete * 100);
-            var progressbar = $('.progress-bar');
-            progressbar.width(percentComplete + '%');
-            progressbar.attr('aria-valuenow', percentComplete);
-            progressbar.text(percentComplete + '%');
+// Progress of an ingest job (see sancho.views.IngestJobProgress / IngestJobEvents).
+// Polls the JSON endpoint. With an eventsUrl (SANCHO_PROGRESS_EVENTS) it listens to the
+// server-sent events of the job instead, and falls back to polling when EventSource is not
+// available or the stream fails.
+//
+//   watchIngestJob(eventsUrl, progressUrl, function (progress) { ... }, function (progress) { ... });
+//
+// progress has the fields total, parsed, computed, committed, failed, skipped, throughput (reports
+// per second), eta_s (seconds left), status and errors.
+function watchIngestJob(eventsUrl, progressUrl, onProgress, onDone, pollInterval) {
+    var finished = false;
+    var last = null;
+    pollInterval = pollInterval || 1000;
+
+    function update(progress) {
+        last = progress;
+        onProgress(progress);
+        if (progress.status === 'DONE' || progress.status === 'FAILED') {
+            finish();
+        }
+    }
+
+    function finish() {
+        if (!finished) {
+            finished = true;
+            if (onDone) {
+                onDone(last);
             }
-        }, false);
-        return xhr;
-        },
-        type: 'POST',
-        url: url,
-        data: formData,
-        processData: false,
-        contentType: false,
-        success: function(data) {
-        var result = $('#result');
-        var progressBar = $('.progress');
-        progressBar.hide();
-        result.show();
-        },
-        error: function() {
-        alert('Ha ocurrido un error.');
         }
+    }
+
+    function poll() {
+        if (finished) {
+            return;
+        }
+        fetch(progressUrl, {credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (progress) {
+                update(progress);
+                if (!finished) {
+                    setTimeout(poll, pollInterval);
+                }
+            })
+            .catch(function () { setTimeout(poll, pollInterval * 5); });
+    }
+
+    if (!eventsUrl || !window.EventSource) {
+        poll();
+        return;
+    }
+    var source = new EventSource(eventsUrl);
+    source.addEventListener('progress', function (event) {
+        update(JSON.parse(event.data));
     });
+    source.addEventListener('done', function () {
+        source.close();
+        finish();
     });
-});
+    source.onerror = function () {
+        // The stream ends every few seconds and the browser reconnects; only a closed
+        // source means the endpoint is not available
+        if (source.readyState === EventSource.CLOSED && !finished) {
+            poll();
+        }
+    };
+}
+
+// Report files not ingested yet as those reports of the optimization (see
+// sancho.views.KnownReports). The SHA-256 of every file is calculated in the browser and sent
+// first, so the files the server already has are not uploaded again. The files are hashed one
+// after another, so only one of them is in memory at a time. Resolves to every file when
+// hashing is not available (no secure context) or the request fails.
+//
+//   missingReports(hashesUrl, csrfToken, files, optimization).then(function (missing) { ... });
+function hashReport(file) {
+    return file.arrayBuffer()
+        .then(function (buffer) { return crypto.subtle.digest('SHA-256', buffer); })
+        .then(function (digest) {
+            return Array.from(new Uint8Array(digest))
+                .map(function (byte) { return byte.toString(16).padStart(2, '0'); })
+                .join('');
+        });
+}
 
+function hashReports(files) {
+    var reports = [];
+    return files.reduce(function (chain, file) {
+        return chain
+            .then(function () { return hashReport(file); })
+            .then(function (hash) { reports.push({name: file.name, hash: hash}); });
+    }, Promise.resolve()).then(function () { return reports; });
+}
 
+function missingReports(hashesUrl, csrfToken, files, optimization) {
+    files = Array.from(files);
+    if (!window.crypto || !crypto.subtle || !files.length) {
+        return Promise.resolve(files);
+    }
+    return hashReports(files)
+        .then(function (reports) {
+            return fetch(hashesUrl, {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+                body: JSON.stringify({optimization: optimization, reports: reports})
+            })
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+                    return response.json();
+                })
+                .then(function (result) {
+                    var known = new Set(result.known);
+                    return files.filter(function (file) { return !known.has(file.name); });
+                });
+        })
+        .catch(function () { return files; });
+}
@@ -0,0 +1,73 @@
+# Python imports
+import logging
+import multiprocessing
+import time
+from contextlib import contextmanager
+
+# Django imports
+from django.conf import settings
+from django.utils import timezone
+
+# Non-standard library imports
+from celery import shared_task
+from celery.signals import worker_init
+
+# Project imports
+from .ingest import finish_ingest_job, ingest_job_file, ingest_job_pooled, plan_ingest_job
+from .models import IngestJob
+from .src.parser import btinstrument
+
+logger = logging.getLogger(__name__)
+instrument_logger = logging.getLogger('sancho.instrument')
+
+
+@worker_init.connect
+def enable_instrumentation(**kwargs) -> None:
+    """Los workers no pasan por InstrumentationMiddleware: SANCHO_INSTRUMENT se aplica aquí
+       (los procesos del worker lo heredan)"""
+    if settings.SANCHO_INSTRUMENT:
+        btinstrument.enable()
+
+
+@contextmanager
+def instrumented_task(task: str, **context):
+    """Collects the timings of the block (a task) and writes them as one JSON log line, like
+       InstrumentationMiddleware does for a request (only while btinstrument is enabled)"""
+    if not btinstrument.is_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    with btinstrument.collect() as collector:
+        yield
+    if collector:
+        instrument_logger.info(collector.as_log(task=task, **context,
+                                                total_ms=round((time.perf_counter() - start) * 1000, 3)))
+
+
+@shared_task
+def run_ingest_job(job_id: int) -> None:
+    """Processes the reports of the job in a pool of SANCHO_INGEST_WORKERS processes, or sends
+       one task per report so the Celery workers process them concurrently. The pool is not
+       used inside a (daemonic) prefork worker, which cannot have children."""
+    job = IngestJob.objects.select_related('user').get(pk=job_id)
+    IngestJob.objects.filter(pk=job_id).update(status=IngestJob.Status.RUNNING, started=timezone.now())
+    with instrumented_task('run_ingest_job', job=job_id):
+        # Los informes que ya existen se omiten o se marcan para actualizar antes de leerlos
+        files = plan_ingest_job(job)
+        if settings.SANCHO_INGEST_WORKERS > 1 and files and not multiprocessing.current_process().daemon:
+            ingest_job_pooled(job, settings.SANCHO_INGEST_WORKERS, files)
+            finish_ingest_job(job)
+        elif not files:
+            finish_ingest_job(job)
+        else:
+            for name in files:
+                ingest_file.delay(job_id, name)
+
+
+@shared_task
+def ingest_file(job_id: int, name: str) -> None:
+    """Processes one report of a job; the last one to finish closes the job"""
+    job = IngestJob.objects.select_related('user').get(pk=job_id)
+    with instrumented_task('ingest_file', job=job_id, file=name):
+        if ingest_job_file(job, name):
+            finish_ingest_job(job)
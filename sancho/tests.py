@@ -1,8 +1,70 @@
 # sancho/tests.py
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from datetime import date
+from io import StringIO
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
 import pytest
-from django.test import SimpleTestCase
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 
+from .src.analysis.btcalendar import CalendarCube
+from .src.analysis.btcorrelation import DailyReturns
+from .src.analysis.btcosts import CostModel, CostScenarios
+from .src.analysis.btcriteria import CompiledCriteria
+from .src.analysis.btpareto import non_dominated_fronts, pareto_ranking
+from .src.analysis.btportfolio import BtPortfolio, PortfolioSearch, merge_trades
+from .benchmark import build_row, run_benchmark
+from .ingest import (analyse_report, commit_reports, ingest_job_pooled, ingest_report, job_dates, read_report,
+                     recompute_fields, refresh_metrics)
+from .models import Backtest, IngestJob, Metrics
+from .persist import persist_reports
+from .watch import ReportWatcher
+from .src.analysis.btsimilarity import SimilarityIndex, trade_fingerprint
+from .src.analysis.btsizing import FixedFractional, FixedLot, SizingSimulator, VolatilityScaled
+from .src.analysis.btsnooping import RealityCheck
+from .src.parser import btinstrument, btkernels
+from .src.parser.btexport import MetricsExporter, read_export
+from .src.parser.btgenbox import BtGenbox
+from .src.parser.btmetrics import BtMetrics
+from .src.parser.btstream import ReportTableParser, dump_table, load_table
+from .src.parser.btsynthetic import synthetic_trades
+from .src.parser.bttrades import BtTrades
+
+PAYLOAD = Path(__file__).resolve().parent / 'src' / 'payload'
+
+
+def analyse_or_die(directory, name, *args):
+    """analyse_report that kills its worker with the report of set1"""
+    if 'set1' in name:
+        os._exit(1)
+    return analyse_report(directory, name, *args)
+
+
+class CreatesFileWhenUnpickled:
+    """Pickle that creates the file path when it is loaded"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def payload_trades(*sets: int) -> list:
+    return [BtTrades.from_backtest(BtGenbox(PAYLOAD, f'au6_L_5_01_221231_set{i}.htm')) for i in sets]
+
+
 class HomepageTests(SimpleTestCase):
     def test_url_exists_at_correct_location(self):
         response = self.client.get("/")
@@ -21,4 +83,593 @@ class AboutpageTests(SimpleTestCase):
     def test_url_available_by_name(self):
         response = self.client.get(reverse("about"))
         assert response.status_code == 200
-        
+
+
+class PortfolioTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.trades = payload_trades(0, 1, 2, 3)
+
+    def test_merge_is_ordered_by_close_time(self):
+        merged, sources = merge_trades(self.trades)
+        assert len(merged) == sum(len(t) for t in self.trades)
+        assert (np.diff(merged.close_time.view(np.int64)) >= 0).all()
+        assert np.bincount(sources).tolist() == [len(t) for t in self.trades]
+
+    def test_kernels_match_btmetrics(self):
+        portfolio = BtPortfolio(self.trades[:2])
+        metrics = portfolio.metrics()
+        pips = portfolio.trades.pips
+        assert float(metrics.calculate_kratio()) == pytest.approx(btkernels.kratio(pips), abs=0.005)
+        assert float(metrics.calculate_rf()) == pytest.approx(btkernels.recovery_factor(pips), abs=0.005)
+
+    def test_search_respects_exposure_cap(self):
+        search = PortfolioSearch(self.trades, objective='rf', max_exposure=0.3)
+        best = search.exhaustive(max_size=3)
+        assert best.max_exposure <= 0.3
+        single = search.evaluate([best.members])[0]
+        assert single.score == pytest.approx(best.score)
+        merged = search.portfolio(best).trades
+        assert single.score == pytest.approx(btkernels.recovery_factor(merged.pips))
+
+
+
+class DailyReturnsTests(SimpleTestCase):
+    def test_incremental_correlation_matches_full_matrix(self):
+        trades = payload_trades(0, 1, 2, 3, 4)
+        with tempfile.TemporaryDirectory() as path:
+            store = DailyReturns(path, '2010-01-01', '2023-12-31')
+            store.add(trades[:3])
+            store.update_correlation(block=2)
+            store.add(trades[3:])
+            assert store.update_correlation(block=2) == 2
+            full = np.corrcoef(np.asarray(store.returns, dtype=float))
+            for i, a in enumerate(trades):
+                for j, b in enumerate(trades):
+                    assert store.correlation(a.name, b.name) == pytest.approx(full[i, j], abs=1e-5)
+            top = store.top_k(trades[0].name, k=2)
+            assert [score for _, score in top] == pytest.approx(sorted(full[0, 1:], reverse=True)[:2], abs=1e-5)
+
+    def test_writes_are_all_or_nothing_and_shared_between_instances(self):
+        trades = payload_trades(0, 1, 3)
+        with tempfile.TemporaryDirectory() as path:
+            store = DailyReturns(path, '2011-01-08', '2022-12-31')
+            store.add(trades[:1])
+            store.update_correlation()
+            size = (Path(path) / 'returns.f32').stat().st_size
+            # set3 empieza antes del calendario: no se guarda ninguno de los dos
+            with pytest.raises(ValueError):
+                store.add(trades[1:])
+            assert store.names == [trades[0].name] and (Path(path) / 'returns.f32').stat().st_size == size
+            # Restos de una escritura interrumpida
+            for name in ('returns.f32', 'correlation.f32'):
+                with open(Path(path) / name, 'ab') as f:
+                    f.write(b'\xff' * 12)
+            assert DailyReturns(path).add(trades[1:2]) == [1]
+            assert store.update_correlation() == 1 and store.names == [trades[0].name, trades[1].name]
+            full = np.corrcoef(np.asarray(store.returns, dtype=float))
+            assert store.correlation(trades[0].name, trades[1].name) == pytest.approx(full[0, 1], abs=1e-5)
+
+
+class CostScenariosTests(SimpleTestCase):
+    def test_zero_cost_scenario_matches_kernels(self):
+        trades = payload_trades(0)[0]
+        scenarios = CostScenarios(trades, [CostModel(), CostModel(slippage_pips=1.0), CostModel(commission_per_lot=7.0)])
+        metrics = scenarios.metrics()
+        assert metrics['Kratio'].iloc[0] == pytest.approx(btkernels.kratio(trades.pips))
+        assert metrics['EP'].iloc[1] == pytest.approx(btkernels.expectancy(trades.pips) - 1.0)
+        assert (metrics['Gross Profit'].iloc[1:] < metrics['Gross Profit'].iloc[0]).all()
+        validity = scenarios.validity({'EP': {'Min': metrics['EP'].iloc[1], 'Max': np.inf}})
+        assert validity['Valid'].tolist()[:2] == [True, True]
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_synthetic_trades_and_engine_parity(self):
+        trades = synthetic_trades(500, seed=1)
+        assert len(trades) == 500 and (np.diff(trades.close_time.view(np.int64)) >= 0).all()
+        assert set(np.unique(trades.direction)) == {-1, 1} and len(np.unique(trades.symbol)) > 1
+        assert btkernels.max_exposure(trades.open_time, trades.close_time, trades.volume) > trades.volume.max()
+        results = run_benchmark([300], ['calculate_kratio', 'calculate_rf', 'exposures', 'drawdown'], memory=False)
+        assert all(entry['status'] == 'ok' for entry in results['timings'])
+        assert {p['metric'] for p in results['parity']} == {'Kratio', 'RF', 'Max. Exposure', 'DD'}
+        assert all(p['ok'] for p in results['parity'])
+
+
+class CalendarCubeTests(SimpleTestCase):
+    def test_rollups_match_the_operations(self):
+        trades = payload_trades(0)[0]
+        cube = CalendarCube.from_bytes(CalendarCube.from_trades(trades).to_bytes())
+        ops = trades.operations
+        monthly = ops.groupby(ops['Close Time'].dt.to_period('M'))['Pips'].sum()
+        assert np.allclose(cube.rollup('month')['Pips'], monthly)
+        assert cube.rollup('year')['Trades'].sum() == len(trades)
+        hourly = ops.groupby(ops['Close Time'].dt.hour)['Profit'].sum().reindex(range(24), fill_value=0)
+        assert np.allclose(cube.rollup('hour')['Profit'], hourly)
+        assert cube.rollup('weekday')['Wins'].sum() == (trades.pips > 0).sum()
+
+
+class CompiledCriteriaTests(SimpleTestCase):
+    def test_reports_the_first_failed_criterion(self):
+        table = {'Kratio': np.array([0.3, 0.1, 0.3, np.nan]),
+                 'RF': np.array([10.0, 10.0, 5.0, 10.0])}
+        criteria = CompiledCriteria({'Kratio': {'Min': 0.2, 'Max': np.inf}, 'RF': {'Min': 8.9, 'Max': np.inf}})
+        screened = criteria.screen(table)
+        assert screened['Valid'].tolist() == [True, False, False, False]
+        assert screened['Failed'].tolist() == ['', 'Kratio', 'RF', 'Kratio']
+        assert criteria.order_by_selectivity(table).valid(table).tolist() == [True, False, False, False]
+        # Se evalúan en el orden de names: el criterio más selectivo pasa a ser el primero
+        table['RF'] = np.array([10.0, 5.0, 5.0, 5.0])
+        assert criteria.order_by_selectivity(table).names == ['RF', 'Kratio']
+        assert criteria.screen(table)['Failed'].tolist() == ['', 'RF', 'RF', 'RF']
+
+
+class MetricsExporterTests(SimpleTestCase):
+    def test_csv_round_trip_in_chunks(self):
+        trades = synthetic_trades(200, seed=2)
+        row = {'name': trades.name, 'optimization': 1, 'period': 'ISOS', **build_row(trades)}
+        path = Path(tempfile.mkdtemp()) / 'metrics.csv'
+        with MetricsExporter(path, chunk_rows=2) as exporter:
+            exporter.extend([row] * 5 + [{'name': 'empty'}])
+        assert exporter.rows == 6
+        df = read_export(path)
+        assert len(df) == 6 and df['kratio'][0] == row['kratio'].quantize(Decimal('0.0001'))
+        assert df['time_in_market'][4] == row['time_in_market'] and df['kratio'][5] is None
+        assert df['best_operation_datetime'][0] == row['best_operation_datetime']
+
+    def test_parquet_and_arrow_round_trip_in_chunks(self):
+        import pyarrow.ipc
+        import pyarrow.parquet
+        trades = synthetic_trades(200, seed=2)
+        row = {'name': trades.name, 'optimization': 1, 'period': 'ISOS', **build_row(trades)}
+        directory = Path(tempfile.mkdtemp())
+        for name in ('metrics.parquet', 'metrics.arrow'):
+            with MetricsExporter(directory / name, chunk_rows=2) as exporter:
+                exporter.extend([row] * 5 + [{'name': 'empty'}])
+            assert exporter.rows == 6
+        parquet = pyarrow.parquet.ParquetFile(directory / 'metrics.parquet')
+        assert parquet.metadata.num_row_groups == 3
+        table = parquet.read()
+        with pyarrow.ipc.open_file(directory / 'metrics.arrow') as reader:
+            assert reader.num_record_batches == 3
+            assert reader.read_all().equals(table)
+        assert table.schema.field('kratio').metadata == {b'scale': b'4'}
+        assert table.schema.field('time_in_market').metadata == {b'unit': b'ns'}
+        df = table.to_pandas()
+        assert len(df) == 6 and df['name'][5] == 'empty' and pd.isna(df['kratio'][5])
+        assert Decimal(int(df['kratio'][0])).scaleb(-4) == row['kratio'].quantize(Decimal('0.0001'))
+        assert pd.Timedelta(int(df['time_in_market'][4]), unit='ns') == row['time_in_market']
+        assert pd.Timestamp(int(df['best_operation_datetime'][0]), unit='ns') == row['best_operation_datetime']
+
+
+class ReportTableParserTests(SimpleTestCase):
+    def test_chunks_give_the_table_of_read_html(self):
+        path = PAYLOAD / 'au6_L_5_01_221231_set3.htm'
+        data = path.read_bytes()
+        parser = ReportTableParser()
+        for i in range(0, len(data), 1000):
+            parser.feed(data[i:i + 1000])
+        table = parser.close()
+        pd.testing.assert_frame_equal(table, pd.read_html(path)[0])
+        streamed = BtGenbox(PAYLOAD, path.name, table=table)
+        pd.testing.assert_frame_equal(streamed.operations, BtGenbox(PAYLOAD, path.name).operations)
+
+
+class ReportWatcherTests(SimpleTestCase):
+    def test_reports_are_handed_out_settled_and_by_backtest(self):
+        directory = Path(tempfile.mkdtemp())
+        now = 1_000_000.0
+        def write(name, age):
+            (directory / name).write_text('report')
+            os.utime(directory / name, (now - age, now - age))
+        for name in ('a_set0.htm', 'a_set0_IS.htm', 'b_set1.htm', 'notes.txt'):
+            write(name, 10)
+        write('a_set0_OS.htm', 1)
+        watcher = ReportWatcher(directory, settle=5, group_timeout=60)
+        # a_set0_OS aún se está escribiendo y b_set1 espera al resto de su grupo
+        assert watcher.poll(now) == []
+        assert watcher.poll(now + 5) == ['a_set0.htm', 'a_set0_IS.htm', 'a_set0_OS.htm']
+        assert watcher.poll(now + 65) == ['b_set1.htm']
+        assert watcher.poll(now + 70) == [] and not watcher.pending
+        write('b_set1.htm', 8)
+        restarted = ReportWatcher(directory, settle=5, seen=watcher.seen)
+        assert restarted.poll(now + 70, flush=True) == ['b_set1.htm']
+
+
+class InstrumentationTests(SimpleTestCase):
+    def test_collects_metric_and_parse_timings_only_when_enabled(self):
+        btinstrument.enable()
+        try:
+            with btinstrument.collect() as collector:
+                BtMetrics(BtGenbox(PAYLOAD, 'au6_L_5_01_221231_set0.htm'))
+        finally:
+            btinstrument.enable(False)
+        timings = {entry['name']: entry for entry in collector.summary()}
+        assert timings['metrics.calculate_kratio']['calls'] >= 1
+        assert timings['metrics.calculate_kratio']['size'] > 0
+        assert {'parse.read_html', 'parse.types', 'parse.pips'} <= set(timings)
+        # Sólo los métodos públicos
+        assert not any(name.startswith('metrics._') for name in timings)
+        with btinstrument.collect() as collector:
+            BtMetrics(BtGenbox(PAYLOAD, 'au6_L_5_01_221231_set0.htm'))
+        assert not collector
+
+
+class ParetoTests(SimpleTestCase):
+    @staticmethod
+    def peel(points):
+        fronts, left, k = np.full(len(points), -1), np.arange(len(points)), 0
+        while left.size:
+            p = points[left]
+            dominated = ((p[None] <= p[:, None]).all(-1) & (p[None] < p[:, None]).any(-1)).any(1)
+            fronts[left[~dominated]] = k
+            left, k = left[dominated], k + 1
+        return fronts
+
+    def test_fronts_match_pairwise_peeling(self):
+        rng = np.random.default_rng(0)
+        for dims in (2, 3, 4):
+            points = rng.integers(0, 5, (150, dims)).astype(float)
+            assert (non_dominated_fronts(points) == self.peel(points)).all()
+
+    def test_ranking_uses_the_sense_of_every_metric(self):
+        table = {'Kratio': [0.3, 0.2, 0.1], 'Max. Exposure': [0.3, 0.1, 0.2]}
+        ranking = pareto_ranking(table, 'kratio,max_exposure')
+        assert ranking['Front'].tolist() == [0, 0, 1]
+        assert ranking.index[-1] == 2
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    def test_exact_and_near_duplicates(self):
+        trades = payload_trades(0, 1)
+        index = SimilarityIndex()
+        assert index.add(trades[0]) is None
+        assert index.add(trades[0].take(np.arange(len(trades[0])), 'copy')) == trades[0].name
+        assert index.add(trades[1]) is None
+        assert trade_fingerprint(trades[0]) != trade_fingerprint(trades[1])
+        name, score = index.nearest(trades[1], k=1)[0]
+        assert name == trades[1].name and score == pytest.approx(1.0, abs=1e-5)
+        index.partition(2)
+        assert index.nearest(trades[0], k=1, n_probe=2)[0][0] == trades[0].name
+
+
+class SizingSimulatorTests(SimpleTestCase):
+    def test_recorded_fixed_lot_reproduces_the_report(self):
+        trades = payload_trades(0)[0]
+        lot = float(trades.volume[0])
+        simulator = SizingSimulator(trades, [FixedLot(lot), FixedLot(2 * lot), FixedFractional(0.01),
+                                             VolatilityScaled(10.0)])
+        metrics = simulator.metrics()
+        assert metrics['Final Balance'].iloc[0] == pytest.approx(10000 + trades.profit.sum())
+        assert metrics['RF'].iloc[0] == pytest.approx(btkernels.recovery_factor(trades.profit))
+        assert metrics['DD'].iloc[1] == pytest.approx(2 * metrics['DD'].iloc[0])
+        assert metrics['Max. Exposure'].iloc[1] == pytest.approx(2 * metrics['Max. Exposure'].iloc[0])
+        assert np.isfinite(simulator.balance()).all()
+
+
+class RealityCheckTests(SimpleTestCase):
+    def test_only_a_real_edge_survives_the_batch(self):
+        returns = np.random.default_rng(0).normal(0.0, 1.0, (200, 500))
+        returns[7] += 0.3
+        check = RealityCheck(returns, method='spa', n_boot=300, seed=1)
+        table = check.run(top=5)
+        assert table.index[0] == '7'
+        assert check.p_value < 0.05
+        assert ((table['p-value'] >= 0) & (table['p-value'] <= 1)).all()
+        assert table['p-value'].iloc[1:].min() > 0.05
+
+    def test_from_trades_on_payload(self):
+        check = RealityCheck.from_trades(payload_trades(0, 1, 2), method='rc', n_boot=200, seed=1)
+        assert check.returns.shape[0] == 3
+        assert len(check.run()) == 3
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ProcessBacktestsTests(TestCase):
+    def upload(self, *names, mode=IngestJob.Mode.INSERT):
+        files = [SimpleUploadedFile(name, source if isinstance(source, bytes) else (PAYLOAD / source).read_bytes())
+                 for name, source in names]
+        return self.client.post(reverse('sancho:process_backtests'), {
+            'backtests': files, 'bt-start': '2011-01-01', 'bt-end': '2022-12-31',
+            'opti-number': 1, 'tfs': 'H4', 'mode': mode})
+
+    def test_duplicates_reuse_the_metrics_of_the_original(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        response = self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                               ('au6_L_5_01_221231_set9.htm', 'au6_L_5_01_221231_set0.htm'))
+        assert response.status_code == 200
+        assert set(response.wsgi_request.report_tables) == {'au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set9.htm'}
+        original, copy = Backtest.objects.order_by('name')
+        assert original.fingerprint and original.fingerprint == copy.fingerprint
+        assert original.outcome_hash and original.outcome_hash == copy.outcome_hash
+        metrics = Metrics.objects.get(backtest=original)
+        assert metrics.kratio == Metrics.objects.get(backtest=copy).kratio
+        assert Metrics.objects.get(backtest=copy).calendar_cube().trades.sum() == metrics.num_ops
+        trades = original.load_trades()
+        assert len(trades) == metrics.num_ops and trade_fingerprint(trades) == original.fingerprint
+        assert (trades.pips == payload_trades(0)[0].pips).all()
+
+    def test_same_entries_with_other_exits_or_lots_are_measured(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        report = (PAYLOAD / 'au6_L_5_01_221231_set0.htm').read_text()
+        first = report.index('1674269943254')
+        row = report[first:report.index('</tr>', first)]
+        changed = row.replace('<td class=mspt>0.01</td>', '<td class=mspt>0.05</td>').replace('>-5.0<', '>-25.0<')
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                    ('au6_L_5_01_221231_set9.htm', report.replace(row, changed).encode()))
+        original, other = Backtest.objects.order_by('name')
+        assert original.fingerprint == other.fingerprint and original.outcome_hash != other.outcome_hash
+        metrics, other_metrics = Metrics.objects.get(backtest=original), Metrics.objects.get(backtest=other)
+        assert other_metrics.max_lots == Decimal('0.05') != metrics.max_lots
+
+    def test_upload_runs_as_an_ingest_job(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        files = [SimpleUploadedFile('au6_L_5_01_221231_set0.htm', (PAYLOAD / 'au6_L_5_01_221231_set0.htm').read_bytes()),
+                 SimpleUploadedFile('au6_L_5_01_221231_set1.htm', b'<html>not a report</html>')]
+        response = self.client.post(reverse('sancho:process_backtests'), {
+            'backtests': files, 'bt-start': '2011-01-01', 'bt-end': '2022-12-31', 'opti-number': 1, 'tfs': 'H4'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        job = IngestJob.objects.get(pk=response.json()['job'])
+        assert (job.status, job.processed, job.failed) == (IngestJob.Status.DONE, 1, 1)
+        assert job.errors[0]['file'] == 'au6_L_5_01_221231_set1.htm'
+        assert list(job.backtests.values_list('name', flat=True)) == [Backtest.objects.get().name]
+        assert not job.uploads.exists()
+        progress = self.client.get(reverse('sancho:job_progress', args=[job.pk])).json()
+        assert (progress['parsed'], progress['computed'], progress['committed'], progress['failed']) == (1, 1, 1, 1)
+        assert progress['status'] == 'DONE' and progress['eta_s'] is None
+        assert self.client.get(reverse('sancho:job_events', args=[job.pk])).status_code == 404
+        with self.settings(SANCHO_PROGRESS_EVENTS=True):
+            events = b''.join(self.client.get(reverse('sancho:job_events', args=[job.pk])).streaming_content).decode()
+        assert events.count('event: progress') == 1 and events.endswith('event: done\ndata: {}\n\n')
+        self.client.force_login(User.objects.create_user('other'))
+        assert self.client.get(reverse('sancho:job_progress', args=[job.pk])).status_code == 404
+
+    def test_only_reports_are_uploaded_and_no_table_is_unpickled(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        name = 'au6_L_5_01_221231_set0.htm'
+        marker = Path(tempfile.mkdtemp()) / 'unpickled'
+        payload = pickle.dumps(CreatesFileWhenUnpickled(str(marker)))
+        files = [SimpleUploadedFile(name, (PAYLOAD / name).read_bytes()),
+                 SimpleUploadedFile(name + '.table.pkl', payload)]
+        response = self.client.post(reverse('sancho:process_backtests'), {
+            'backtests': files, 'bt-start': '2011-01-01', 'bt-end': '2022-12-31', 'opti-number': 1, 'tfs': 'H4'})
+        assert response.status_code == 400 and not IngestJob.objects.exists() and not marker.exists()
+        assert not any(path.exists() for path in response.wsgi_request.report_tables.values())
+        # Tampoco se cargan tablas junto a los informes de un directorio
+        directory = Path(tempfile.mkdtemp())
+        (directory / name).write_bytes((PAYLOAD / name).read_bytes())
+        (directory / (name + '.table.pkl')).write_bytes(payload)
+        assert read_report(directory, name).operations.equals(BtGenbox(PAYLOAD, name).operations) and not marker.exists()
+        # Las tablas leídas durante la subida se guardan como JSON
+        parser = ReportTableParser()
+        parser.feed((PAYLOAD / name).read_bytes())
+        table = parser.close()
+        pd.testing.assert_frame_equal(load_table(dump_table(table)), table)
+        with pytest.raises(ValueError):
+            load_table(json.dumps({'rows': []}).encode())
+
+    @override_settings(SANCHO_INGEST_WORKERS=2)
+    def test_pooled_ingest_isolates_failures_and_copies_duplicates(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'))
+        response = self.upload(('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm'),
+                               ('au6_L_5_01_221231_set2.htm', 'au6_L_5_01_221231_set2.htm'),
+                               ('au6_L_5_01_221231_set3.htm', 'au6_L_5_01_221231_set0.htm'),
+                               ('au6_L_5_01_221231_set4.htm', b'<html>not a report</html>'))
+        job = response.context['job']
+        assert (job.status, job.processed, job.failed) == (IngestJob.Status.DONE, 3, 1)
+        assert job.errors[0]['file'] == 'au6_L_5_01_221231_set4.htm'
+        kratios = dict(Metrics.objects.values_list('backtest__name', 'kratio'))
+        assert kratios['au6_L_5_01_221231_set3'] == kratios['au6_L_5_01_221231_set0']
+        assert kratios['au6_L_5_01_221231_set1'] == BtMetrics(BtGenbox(PAYLOAD, 'au6_L_5_01_221231_set1.htm')).calculate_kratio()
+
+    @override_settings(SANCHO_INGEST_WORKERS=2, SANCHO_PERSIST_BATCH=2)
+    def test_pooled_ingest_commits_in_chunks_and_keeps_compact_rows(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        names = [f'au6_L_5_01_221231_set{i}.htm' for i in range(5)]
+        response = self.upload(*[(name, name) for name in names])
+        job = response.context['job']
+        assert (job.processed, job.failed, job.backtests.count()) == (5, 0, 5)
+        assert [row['name'] for row in response.context['mts']] == [name[:-4] for name in names]
+        assert not any(path.exists() for path in response.wsgi_request.report_tables.values())
+
+    def test_a_report_that_kills_its_worker_fails_alone(self):
+        user = User.objects.create_user('tester')
+        names = [f'au6_L_5_01_221231_set{i}.htm' for i in range(4)]
+        job = IngestJob.objects.create(user=user, optimization=1, timeframe='H4', files=names, source=str(PAYLOAD),
+                                       date_from=date(2011, 1, 1), date_to=date(2022, 12, 31))
+        with mock.patch('sancho.ingest.analyse_report', analyse_or_die):
+            ingest_job_pooled(job, 2)
+        job.refresh_from_db()
+        assert (job.processed, job.failed) == (3, 1) and job.errors[0]['file'] == names[1]
+
+    def test_reports_persist_in_bulk_and_conflicts_fail_alone(self):
+        user = User.objects.create_user('tester')
+        names = [f'au6_L_5_01_221231_set{i}.htm' for i in range(3)]
+        job = IngestJob.objects.create(user=user, optimization=1, timeframe='H4', files=names,
+                                       date_from=date(2011, 1, 1), date_to=date(2022, 12, 31))
+        start, end = job_dates(job)
+        reports = [(name, *ingest_report(PAYLOAD, name, user, 1, 'H4', start, end)) for name in names]
+        stats = persist_reports([(backtest, metrics) for _, backtest, metrics in reports[:2]])
+        assert (stats.rows, stats.method) == (4, 'bulk_create') and stats.rows_per_second > 0
+        assert all(metrics.backtest_id == backtest.pk for _, backtest, metrics in reports[:2])
+        again = [(name, *ingest_report(PAYLOAD, name, user, 1, 'H4', start, end)) for name in names[1:]]
+        commit_reports(job, again)
+        job.refresh_from_db()
+        assert (job.processed, job.failed) == (1, 1) and Metrics.objects.count() == 3
+
+    def test_reuploads_skip_or_update_the_stored_backtests(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'))
+        stored = Backtest.objects.get()
+        job = self.upload(('au6_L_5_01_221231_set0.htm', b'<html>never parsed</html>'),
+                          ('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm'),
+                          mode=IngestJob.Mode.SKIP).context['job']
+        assert (job.status, job.skipped, job.parsed, job.processed, job.failed) == (IngestJob.Status.DONE, 1, 1, 1, 0)
+        job = self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set2.htm'),
+                          mode=IngestJob.Mode.UPDATE).context['job']
+        assert (job.processed, job.failed, Backtest.objects.count(), Metrics.objects.count()) == (1, 0, 2, 2)
+        metrics = Metrics.objects.get(backtest=stored)
+        assert metrics.kratio == BtMetrics(BtGenbox(PAYLOAD, 'au6_L_5_01_221231_set2.htm')).calculate_kratio()
+
+    def test_files_already_ingested_are_skipped_by_content(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'))
+        digest = hashlib.sha256((PAYLOAD / 'au6_L_5_01_221231_set0.htm').read_bytes()).hexdigest()
+        assert Backtest.objects.get().content_hash == digest
+        job = self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                          ('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm')).context['job']
+        assert (job.skipped, job.parsed, job.processed, job.failed) == (1, 1, 1, 0)
+        # Sólo es conocido lo que una subida con esa optimización omitiría
+        reports = [{'name': 'au6_L_5_01_221231_set0.htm', 'hash': digest},
+                   {'name': 'au6_L_5_01_221231_set7.htm', 'hash': digest},
+                   {'name': 'au6_L_5_01_221231_set8.htm', 'hash': '0' * 64},
+                   {'name': 'au6_L_5_01_221231_set9.htm', 'hash': 'x'}]
+        response = self.client.post(reverse('sancho:known_reports'), {'optimization': 1, 'reports': reports},
+                                    content_type='application/json')
+        assert response.json() == {'known': ['au6_L_5_01_221231_set0.htm'],
+                                   'missing': ['au6_L_5_01_221231_set7.htm', 'au6_L_5_01_221231_set8.htm']}
+        response = self.client.post(reverse('sancho:known_reports'), {'optimization': 2, 'reports': reports[:1]},
+                                    content_type='application/json')
+        assert response.json() == {'known': [], 'missing': ['au6_L_5_01_221231_set0.htm']}
+        assert self.client.post(reverse('sancho:known_reports'), {'hashes': [digest]},
+                                content_type='application/json').status_code == 400
+
+    def test_ingest_backtests_command_resumes_and_keeps_the_reports(self):
+        User.objects.create_user('tester')
+        directory = Path(tempfile.mkdtemp())
+        for i in range(3):
+            (directory / f'au6_L_5_01_221231_set{i}.htm').write_bytes((PAYLOAD / f'au6_L_5_01_221231_set{i}.htm').read_bytes())
+        (directory / 'au6_L_5_01_221231_set5.htm').write_bytes(b'<html>not a report</html>')
+        options = dict(user='tester', optimization=1, timeframe='H4', date_from=date(2011, 1, 1),
+                       date_to=date(2022, 12, 31), workers=1, batch_size=2)
+        params = {'directory': str(directory.resolve()), 'user': 'tester', 'optimization': 1, 'timeframe': 'H4',
+                  'date_from': '2011-01-01', 'date_to': '2022-12-31', 'mode': 'SKIP'}
+        checkpoint = directory / '.ingest_backtests.json'
+        checkpoint.write_text(json.dumps(
+            {'params': params, 'done': ['au6_L_5_01_221231_set0.htm'], 'failed': {}, 'processed': 1, 'skipped': 0}))
+        out = StringIO()
+        call_command('ingest_backtests', str(directory), stdout=out, stderr=StringIO(), **options)
+        assert sorted(Backtest.objects.values_list('name', flat=True)) == ['au6_L_5_01_221231_set1', 'au6_L_5_01_221231_set2']
+        assert '3 reports saved' in out.getvalue() and '1 errors' in out.getvalue() and 'files/s' in out.getvalue()
+        assert len(list(directory.glob('*.htm'))) == 4
+        assert list(json.loads(checkpoint.read_text())['failed']) == ['au6_L_5_01_221231_set5.htm']
+        # Al reanudar solo se repite el informe que falló
+        (directory / 'au6_L_5_01_221231_set5.htm').write_bytes((PAYLOAD / 'au6_L_5_01_221231_set5.htm').read_bytes())
+        call_command('ingest_backtests', str(directory), stdout=out, **options)
+        assert IngestJob.objects.order_by('-pk').first().files == ['au6_L_5_01_221231_set5.htm']
+        assert Backtest.objects.count() == 3 and not checkpoint.exists()
+
+    def test_watch_backtests_ingests_the_new_reports_once(self):
+        User.objects.create_user('tester')
+        directory = Path(tempfile.mkdtemp())
+        for name in ('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0_IS.htm', 'au6_L_5_01_221231_set0_OS.htm'):
+            (directory / name).write_bytes((PAYLOAD / name).read_bytes())
+            os.utime(directory / name, (0, 0))
+        broken = directory / 'au6_L_5_01_221231_set5.htm'
+        broken.write_bytes(b'<html>not a report</html>')
+        os.utime(broken, (0, 0))
+        options = dict(user='tester', optimization=1, timeframe='H4', date_from=date(2011, 1, 1),
+                       date_to=date(2022, 12, 31), workers=1, once=True, stderr=StringIO())
+        out = StringIO()
+        with mock.patch('sancho.management.commands.watch_backtests.process_ingest_job', side_effect=KeyboardInterrupt):
+            call_command('watch_backtests', str(directory), stdout=out, batch_size=2, **options)
+        assert json.loads((directory / '.watch_backtests.json').read_text()) == {}
+        call_command('watch_backtests', str(directory), stdout=out, **options)
+        assert Backtest.objects.count() == 3 and '3 reports saved' in out.getvalue()
+        state = json.loads((directory / '.watch_backtests.json').read_text())
+        assert len(state) == 3 and broken.name not in state
+        # El informe que falló se repite (aquí ya corregido); los guardados no
+        broken.write_bytes((PAYLOAD / broken.name).read_bytes())
+        os.utime(broken, (0, 0))
+        call_command('watch_backtests', str(directory), stdout=out, **options)
+        assert IngestJob.objects.order_by('-pk').first().files == [broken.name] and Backtest.objects.count() == 4
+        jobs = IngestJob.objects.count()
+        call_command('watch_backtests', str(directory), stdout=out, **options)
+        assert IngestJob.objects.count() == jobs
+
+    def test_recompute_metrics_refreshes_stale_rows(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                    ('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm'))
+        expected = dict(Metrics.objects.values_list('id', 'kratio'))
+        Metrics.objects.update(kratio=0, is_valid=False)
+        checkpoint = Path(tempfile.mkdtemp()) / 'checkpoint.json'
+        first = min(expected)
+
+        def fail_first(item):
+            return (item[0], None, 'boom') if item[0] == first else recompute_fields(item)
+        with mock.patch('sancho.management.commands.recompute_metrics.recompute_fields', fail_first):
+            call_command('recompute_metrics', workers=1, batch_size=1, checkpoint=checkpoint,
+                         stdout=StringIO(), stderr=StringIO())
+        assert json.loads(checkpoint.read_text())['failed'] == {str(first): 'boom'}
+        assert Metrics.objects.get(pk=first).kratio == 0
+        # Al reanudar sólo se repite la que falló
+        out = StringIO()
+        call_command('recompute_metrics', workers=1, batch_size=1, checkpoint=checkpoint, stdout=out)
+        assert '1/1 metrics' in out.getvalue() and '2 metrics recalculated (0 errors)' in out.getvalue()
+        assert dict(Metrics.objects.values_list('id', 'kratio')) == expected
+        assert not checkpoint.exists()
+
+    def test_stale_metrics_are_refreshed_on_read(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'))
+        metrics = Metrics.objects.get()
+        assert not metrics.is_stale and metrics.is_valid == (BtMetrics(payload_trades(0)[0]).valid == 'Y')
+        Metrics.objects.update(metric_version=1, avg_losing_strike=999, criteria_hash='', is_valid=not metrics.is_valid)
+        assert Metrics.objects.get().stale_fields() == {'avg_losing_strike', 'is_valid'}
+        response = self.client.get(reverse('sancho:list_backtests'))
+        assert response.status_code == 200
+        refreshed = Metrics.objects.get()
+        assert not refreshed.is_stale and refreshed.avg_losing_strike == metrics.avg_losing_strike
+        assert refreshed.is_valid == metrics.is_valid
+
+    @override_settings(SANCHO_LAZY_RECOMPUTE=1)
+    def test_reads_refresh_a_bounded_number_of_legacy_rows(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                    ('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm'))
+        Metrics.objects.update(criteria_hash='')
+        assert self.client.get(reverse('sancho:list_backtests')).status_code == 200
+        assert sorted(mt.is_stale for mt in Metrics.objects.all()) == [False, True]
+
+    @override_settings(SANCHO_INGEST_WORKERS=1)
+    def test_ingest_tasks_log_their_timings(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        btinstrument.enable()
+        try:
+            with self.assertLogs('sancho.instrument', 'INFO') as logs:
+                self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'))
+        finally:
+            btinstrument.enable(False)
+        tasks = [json.loads(line) for line in (record.getMessage() for record in logs.records) if '"task"' in line]
+        assert [(entry['task'], entry['file']) for entry in tasks] == [('ingest_file', 'au6_L_5_01_221231_set0.htm')]
+        assert 'metrics.calculate_kratio' in {timing['name'] for timing in tasks[0]['timings']}
+
+    def test_list_shows_the_pareto_fronts_of_the_selected_objectives(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(*[(f'au6_L_5_01_221231_set{i}.htm', f'au6_L_5_01_221231_set{i}.htm') for i in range(3)])
+        response = self.client.get(reverse('sancho:list_backtests'))
+        assert response.context['pareto_objectives'] is None and 'Crowding' not in response.content.decode()
+        response = self.client.get(reverse('sancho:list_backtests'),
+                                   {'order': 'pareto', 'objectives': ['kratio', 'rf']})
+        assert response.context['pareto_objectives'] == ['Kratio', 'RF']
+        assert [mt.front for mt in response.context['mts']] == sorted(mt.front for mt in response.context['mts'])
+        content = response.content.decode()
+        assert '<th scope="col" style="text-align: center;">Crowding</th>' in content
+        assert 'value="rf" id="objective-rf" checked' in content
+        assert 'value="max_exposure" id="objective-max_exposure">' in content
+
+    def test_rows_without_operations_dont_use_up_the_refresh_limit(self):
+        self.client.force_login(User.objects.create_user('tester'))
+        self.upload(('au6_L_5_01_221231_set0.htm', 'au6_L_5_01_221231_set0.htm'),
+                    ('au6_L_5_01_221231_set1.htm', 'au6_L_5_01_221231_set1.htm'))
+        legacy, stale = Metrics.objects.order_by('id')
+        Backtest.objects.filter(pk=legacy.backtest_id).update(trades=None)
+        Metrics.objects.update(metric_version=1)
+        metrics = list(Metrics.objects.select_related('backtest').defer('backtest__trades').order_by('id'))
+        assert refresh_metrics(metrics, limit=1) == 1
+        assert [mt.is_stale for mt in Metrics.objects.order_by('id')] == [True, False]
+        out = StringIO()
+        call_command('recompute_metrics', legacy=True, stdout=out)
+        assert f'Metrics {legacy.pk}: {legacy.backtest.name}' in out.getvalue() and '1 stale metrics' in out.getvalue()
@@ -0,0 +1,88 @@
+# Python imports
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+# Django imports
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+# Project imports
+from .src.parser.btstream import ReportTableParser, dump_table
+
+logger = logging.getLogger(__name__)
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Field of the form with the reports of the backtests
+REPORT_FIELD = 'backtests'
+# Suffix of the temporary files with the tables (JSON, see btstream.dump_table)
+TABLE_SUFFIX = '.table.json'
+##########################################################################################################
+
+
+class ReportUploadHandler(FileUploadHandler):
+    """Parses and hashes the reports of the backtests field while the body of the request
+       arrives, so that most of them are already read when the view runs. It doesn't store
+       the files: the chunks go on to the next handler (a temporary file, see
+       FILE_UPLOAD_HANDLERS).
+
+       By file name, the raw table of every report (see btstream.ReportTableParser) is left in
+       a temporary file whose path goes in request.report_tables, so that the tables of a big
+       upload are not kept in memory, and its SHA-256 in request.report_hashes. A report that
+       can't be parsed here is just left out of report_tables: it is read from its file when
+       it is ingested. The tables not taken by an ingest job are removed with
+       discard_report_tables."""
+
+    def __init__(self, request=None) -> None:
+        super().__init__(request)
+        self.parser = None
+        self.hasher = None
+
+    def new_file(self, field_name, file_name, *args, **kwargs) -> None:
+        super().new_file(field_name, file_name, *args, **kwargs)
+        report = field_name == REPORT_FIELD
+        self.parser = ReportTableParser() if report else None
+        self.hasher = hashlib.sha256() if report else None
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        if self.hasher is not None:
+            self.hasher.update(raw_data)
+        if self.parser is not None:
+            try:
+                self.parser.feed(raw_data)
+            except Exception as error:
+                logger.debug('Report %s not parsed while uploaded: %r', self.file_name, error)
+                self.parser = None
+        return raw_data
+
+    def file_complete(self, file_size: int) -> None:
+        if self.hasher is None or self.request is None:
+            return None
+        name = Path(self.file_name).name
+        self._results('report_hashes')[name] = self.hasher.hexdigest()
+        if self.parser is not None:
+            try:
+                table = self.parser.close()
+                fd, path = tempfile.mkstemp(suffix=TABLE_SUFFIX, dir=settings.FILE_UPLOAD_TEMP_DIR)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(dump_table(table))
+                self._results('report_tables')[name] = Path(path)
+            except Exception as error:
+                logger.debug('Report %s not parsed while uploaded: %r', self.file_name, error)
+        self.parser = self.hasher = None
+        return None
+
+    def _results(self, attr: str) -> dict:
+        if not hasattr(self.request, attr):
+            setattr(self.request, attr, {})
+        return getattr(self.request, attr)
+
+
+def discard_report_tables(request) -> None:
+    """Removes the temporary files of the tables of request left (see ReportUploadHandler)"""
+    for path in getattr(request, 'report_tables', {}).values():
+        Path(path).unlink(missing_ok=True)
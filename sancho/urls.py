@@ -20,4 +20,8 @@ urlpatterns = [
     ),
     path("about", views.About.as_view(), name="about"),
     path("export/", login_required(views.ExportBacktests.as_view()), name='export_backtests'),
+    path("backtests/hashes/", login_required(views.KnownReports.as_view()), name='known_reports'),
+    path("jobs/<int:pk>/progress/", login_required(views.IngestJobProgress.as_view()), name='job_progress'),
+    path("jobs/<int:pk>/events/", login_required(views.IngestJobEvents.as_view()), name='job_events'),
+    path("instrumentation/", login_required(views.InstrumentationSummary.as_view()), name='instrumentation'),
 ]
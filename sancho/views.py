@@ -1,25 +1,34 @@
 # Python imports
 import os
 import csv
-from datetime import datetime, timedelta
+import json
+import logging
+import re
+import time
+from datetime import datetime
 from decimal import Decimal
-from pathlib import Path
 
 # Django imports
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.views.generic import ListView, View, TemplateView
 from django.shortcuts import render, get_object_or_404, redirect
 # from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 #from django.contrib.auth.models import User
-from django.db import transaction
 from django.db.models import Case, CharField, Value, When, ExpressionWrapper, F, FloatField
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 
 # Project imports
-from .models import Backtest, Metrics
-from .src.parser.btgenbox import BtGenbox, BtPeriods, BtOrderType
-from .src.parser.btmetrics import BtMetrics, DEC_PREC, DEFAULT_CRITERIA
+from .ingest import create_ingest_job, is_same_report, known_contents, refresh_metrics
+from .models import Backtest, IngestJob, Metrics
+from .src.parser import btinstrument
+from .src.parser.btmetrics import DEC_PREC
+from .src.analysis.btcriteria import CRITERIA_FIELDS
+from .src.analysis.btpareto import DEFAULT_OBJECTIVES, OBJECTIVE_SENSES, objective_names, pareto_ranking
+from .tasks import run_ingest_job
+from .uploadhandlers import discard_report_tables
+
+logger = logging.getLogger(__name__)
 
 
 class About(TemplateView):
@@ -64,6 +73,8 @@ class ListBacktests(ListView):
     
     def get_queryset(self):        
         queryset = super().get_queryset().filter(backtest__period_type=Backtest.PeriodType.ISOS)       
+        # Las operaciones guardadas no se leen en los listados
+        queryset = queryset.select_related('backtest').defer('backtest__trades', 'calendar')
         
         # Fine tune output
         queryset = queryset.annotate(
@@ -81,198 +92,198 @@ class ListBacktests(ListView):
             ),
         )
 
+        # Métricas calculadas con fórmulas o criterios anteriores
+        refresh_metrics([mt for mt in queryset if mt.is_stale], settings.SANCHO_LAZY_RECOMPUTE)
+
         for mt in queryset:    
             mt.backtest.timeframe_display = mt.backtest.get_timeframe_display()
             #mt.backtest.ordertype_display = mt.backtest.ordertype_display()
             #mt.backtest.family_display = mt.backtest.get_family_display()
             mt.ratio = Decimal(-mt.avg_win / mt.avg_loss).quantize(Decimal(DEC_PREC))
+
+        # Objetivos del orden de Pareto aplicado (None si no se ordena por frentes)
+        self.objectives = None
+        if self.request.GET.get('order') == 'pareto':
+            # Como lista separada por comas o con un parámetro por objetivo (el formulario)
+            objectives = ','.join(self.request.GET.getlist('objectives')) or DEFAULT_OBJECTIVES
+            return self.pareto_order(queryset, objectives)
                        
         return queryset
+
+    def pareto_order(self, queryset, objectives) -> list:
+        """Metrics sorted by Pareto front and crowding distance over the objectives
+           (?order=pareto&objectives=kratio,rf,max_exposure)"""
+        try:
+            names = objective_names(objectives)
+        except ValueError as error:
+            logger.warning('Pareto ordering ignored: %s', error)
+            return queryset
+        self.objectives = names
+        mts = list(queryset)
+        table = {name: [getattr(mt, CRITERIA_FIELDS[name]) for mt in mts] for name in names}
+        ranking = pareto_ranking(table, names)
+        for position, front, crowding in zip(ranking.index, ranking['Front'], ranking['Crowding']):
+            mts[position].front, mts[position].crowding = int(front), crowding
+        return [mts[position] for position in ranking.index]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Columnas Front/Crowding y selector de objetivos del orden de Pareto
+        selected = self.objectives or list(DEFAULT_OBJECTIVES)
+        context['pareto_objectives'] = self.objectives
+        context['objective_choices'] = [(CRITERIA_FIELDS[name], name, name in selected) for name in OBJECTIVE_SENSES]
+        return context
     
 
 class ProcessBacktests(View):
     def get(self, request):
-        return render(request, 'sancho/backtests/process.html')
+        return render(request, 'sancho/backtests/process.html', self.page_context())
     
     def post(self, request):
-        
-        if request.FILES.getlist('backtests'):            
-            backtests = request.FILES.getlist('backtests')
-            bt_start = datetime.strptime(request.POST.get('bt-start'), '%Y-%m-%d')
-            bt_end = datetime.strptime(request.POST.get('bt-end'), '%Y-%m-%d')
-            opti_number = int(request.POST.get('opti-number'))
-            timeframe = request.POST.get('tfs')
-            user = request.user
-            
-            bts = [] # Store GenboxBacktest model
-            mts = [] # Store Metrics model
-            gbx = [] # Store BtGenbox
-            mtx = [] # Store BtMetrics
+        try:
+            return self.ingest(request)
+        finally:
+            # Tablas leídas durante la subida que no se ha llevado ningún trabajo
+            discard_report_tables(request)
 
-            total_backtests = len(backtests)
-            progress_step = 100 / total_backtests
-            current_progress = 0
+    @staticmethod
+    def page_context() -> dict:
+        # Sin SANCHO_PROGRESS_EVENTS la página consulta el progreso periódicamente
+        return {'progress_events': settings.SANCHO_PROGRESS_EVENTS}
 
-            
-            inicio = datetime.now()
-            for i, bt in enumerate(backtests):
-                # Guardamos el archivo en el directorio uploads
-                
-                ruta_bt = Path(settings.MEDIA_ROOT)/Path(bt.name)
-                with open(ruta_bt, "wb+") as dest:
-                    for chunk in bt.chunks():
-                        dest.write(chunk)
-                
-                                # Create BtGenbox object y BtMetrics
-                bt_gbx = BtGenbox(Path(settings.MEDIA_ROOT), bt.name)
-                bt_mts = BtMetrics(bt_gbx)
-                gbx.append(bt_gbx)
-                mtx.append(bt_mts)
-                
-                # Creamos los objetos correspondientes a los modelos
-                
-                match bt_gbx.ordertype:
-                    case BtOrderType.BUY:
-                        order_type_for_db = Backtest.OrderType.BUY
-                    case BtOrderType.SELL:
-                        order_type_for_db = Backtest.OrderType.SELL
-                    case BtOrderType.BOTH:
-                        order_type_for_db = Backtest.OrderType.BOTH
-
-                match bt_gbx.period:
-                    case BtPeriods.IS:
-                        period_type_for_db = Backtest.PeriodType.IS
-                    case BtPeriods.OS:
-                        period_type_for_db = Backtest.PeriodType.OS
-                    case BtPeriods.ISOS:
-                        period_type_for_db = Backtest.PeriodType.ISOS
-
-                match timeframe:
-                    case 'M1':
-                        tf_for_db = Backtest.TimeFrame.M1
-                    case 'M5':
-                        tf_for_db = Backtest.TimeFrame.M5
-                    case 'M15':
-                        tf_for_db = Backtest.TimeFrame.M15
-                    case 'M30':
-                        tf_for_db = Backtest.TimeFrame.M30
-                    case 'H1':
-                        tf_for_db = Backtest.TimeFrame.H1
-                    case 'H4':
-                        tf_for_db = Backtest.TimeFrame.H4
-                    case 'D1':
-                        tf_for_db = Backtest.TimeFrame.D1
-                    case 'W':
-                        tf_for_db = Backtest.TimeFrame.W
-                    case 'M':
-                        tf_for_db = Backtest.TimeFrame.M
-                
-
-                # btname = bt_gbx.name + bt_gbx.from_period_to_text(bt_gbx.period)
-                backtest = Backtest(
-                    user=user,
-                    name=bt_gbx.name,
-                    optimization=opti_number,
-                    period_type=period_type_for_db,
-                    symbol=bt_gbx.symbol,
-                    timeframe=tf_for_db,
-                    ordertype=order_type_for_db,
-                    date_from=bt_start,
-                    date_to=bt_end,
-                )
-                
-                bts.append(backtest)
-                
-                valido = True if bt_mts.is_valid(DEFAULT_CRITERIA) == 'Y' else False
-                days, hours, minutes, seconds = bt_mts.calculate_time_in_market()                
-                time_in_market = timedelta(days=days, hours=hours, \
-                        minutes=minutes, seconds=seconds)
-                op_promedio = bt_gbx.operations.Duration.sum() / bt_gbx.operations.shape[0]
-                avg_days = op_promedio.days
-                avg_hours = (op_promedio - timedelta(days=avg_days)).seconds // 3600
-                avg_minutes = (op_promedio - timedelta(days=avg_days, hours=avg_hours)).seconds //60
-                metrics = Metrics(
-                    backtest=backtest,
-                    is_valid=valido,                    
-                    profit=bt_mts.gross_profit(),
-                    loss=bt_mts.gross_loss(),
-                    num_ops=bt_mts.num_ops,
-                    pf=bt_mts.calculate_pf(),
-                    rf=bt_mts.calculate_rf(),
-                    dd=Decimal(bt_mts.drawdown().min()).quantize(Decimal(DEC_PREC)),
-                    ep=bt_mts.esp(),
-                    kratio=bt_mts.calculate_kratio(),
-                    max_losing_strike=bt_mts.get_max_losing_strike(),
-                    max_winning_strike=bt_mts.get_max_winning_strike(),
-                    avg_losing_strike=bt_mts.get_avg_losing_strike(),
-                    avg_winning_strike=bt_mts.get_avg_winning_strike(),
-                    max_lots=bt_gbx.operations.Volume.max(),
-                    min_lots=bt_gbx.operations.Volume.min(),
-                    max_exposure=Decimal(max(bt_mts.exposures()[1])).quantize(Decimal(DEC_PREC)),
-                    time_in_market=time_in_market,
-                    pct_winner=Decimal(bt_mts.pct_win()).quantize(Decimal(DEC_PREC)),
-                    closing_days=bt_mts.calculate_closing_days(),
-                    sqn=bt_mts.calculate_sqn(),
-                    sharpe_ratio=bt_mts.calculate_sharpe(),
-                    best_operation_pips=int(bt_mts.best_operation()[0]),
-                    best_operation_datetime=bt_mts.best_operation()[1], 
-                    worst_operation_pips=int(bt_mts.worst_operation()[0]),
-                    worst_operation_datetime=bt_mts.worst_operation()[1],
-                    avg_win=bt_mts.calculate_avg_win(),
-                    avg_loss=bt_mts.calculate_avg_loss(),
-                    total_bt_duration=bt_end-bt_start,
-                    avg_op_duration=timedelta(days=avg_days, hours=avg_hours, minutes=avg_minutes),
-                    longest_op_duration=bt_gbx.operations.Duration.max(),
-                    shortest_op_duration=bt_gbx.operations.Duration.min(),
-                )
-                mts.append(metrics)                              
-                os.remove(ruta_bt)
-
-                 # Actualizar el progreso
-                current_progress = (i + 1) * progress_step
-                progress_data = {
-                    'progress': int(current_progress),
-                }
-                self.update_progress(request, progress_data)
-        
-        
-        if settings.DEBUG:        
-            print(f'Duración del procesamiento de backtest {(datetime.now() - inicio).seconds} segundos')
-        self.create_registers(bts, mts)
-        
-        # Create lists to pass formated data to the template
-        
-        mt_data = []
-        for mt in mtx:
-            mt_data.append({
-                'name': mt.bt.name,
-                'optimization': opti_number,
-                'symbol': mt.bt.symbol,
-                'ordertype_text': mt.bt.from_ordertype_to_text(mt.bt.ordertype),
-                'period_text': mt.bt.from_period_to_text(mt.bt.period),
-                'timeframe': timeframe,
-                'valid': 'Y' if valido else 'N'
-            })           
-        context = {
-            'bts': gbx,
-            'num_periods': len(bts),
-            'num_bts': len(bts) / 3,
+    def ingest(self, request):
+        backtests = request.FILES.getlist('backtests')
+        if not backtests:
+            return render(request, 'sancho/backtests/process.html', self.page_context())
+        bt_start = datetime.strptime(request.POST.get('bt-start'), '%Y-%m-%d')
+        bt_end = datetime.strptime(request.POST.get('bt-end'), '%Y-%m-%d')
+        opti_number = int(request.POST.get('opti-number'))
+        timeframe = request.POST.get('tfs')
+        mode = request.POST.get('mode', IngestJob.Mode.INSERT)
+        mode = mode if mode in IngestJob.Mode.values else IngestJob.Mode.INSERT
+
+        # Los informes se guardan y se procesan en segundo plano (sancho/tasks.py)
+        try:
+            job = create_ingest_job(request.user, backtests, opti_number, timeframe, bt_start, bt_end,
+                                    getattr(request, 'report_tables', None), mode,
+                                    getattr(request, 'report_hashes', None))
+        except ValueError as error:
+            # Sólo se aceptan informes (.htm/.html)
+            return HttpResponseBadRequest(str(error))
+        run_ingest_job.delay(job.pk)
+        job.refresh_from_db()
+
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({'job': job.pk, 'status': job.status, 'total': job.total,
+                                 'processed': job.processed, 'failed': job.failed, 'skipped': job.skipped})
+        return render(request, 'sancho/backtests/processed.html', context=self.job_context(job))
+
+    def job_context(self, job: IngestJob) -> dict:
+        """Context of the results page for the backtests ingested by job, as compact rows
+           (no models, operations or metrics beyond what the page shows)"""
+        ordertypes = dict(Backtest.OrderType.choices)
+        rows = Metrics.objects.filter(backtest__ingest_jobs=job) \
+            .order_by('backtest__name', 'backtest__period_type') \
+            .values_list('backtest__name', 'backtest__optimization', 'backtest__symbol', 'backtest__ordertype',
+                         'backtest__period_type', 'backtest__timeframe', 'is_valid')
+        mt_data = [{
+            'name': name,
+            'optimization': optimization,
+            'symbol': symbol,
+            'ordertype_text': ordertypes.get(ordertype, ordertype),
+            'period_text': period,
             'timeframe': timeframe,
+            'valid': 'Y' if is_valid else 'N',
+        } for name, optimization, symbol, ordertype, period, timeframe, is_valid in rows.iterator()]
+        return {
+            'job': job,
+            'bts': mt_data,
+            'num_periods': len(mt_data),
+            'num_bts': len(mt_data) / 3,
+            'timeframe': job.timeframe,
             'mts': mt_data,
-        }        
-        
-        # Enviar datos al formulario de salida
-        return render(request, 'sancho/backtests/processed.html', context=context)
-    
-    def update_progress(self, request, data):
-        if request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest':
-            return JsonResponse(data)
-    
-    
-    @transaction.atomic
-    def create_registers(self, bts: list, mts: list) -> None:
-        Backtest.objects.bulk_create(bts)
-        Metrics.objects.bulk_create(mts)
+        }
+
+
+class KnownReports(View):
+    """Which of the report files sent ({"optimization": n, "reports": [{"name": ..., "hash": SHA-256}]})
+       an upload with that optimization would skip, i.e. the user already ingested that very file as
+       that report (see ingest.plan_ingest_job), so that the browser uploads only the others
+       ({"known": [names], "missing": [names]})"""
+    def post(self, request):
+        try:
+            body = json.loads(request.body)
+            reports, optimization = body['reports'], int(body['optimization'])
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest('Expected {"optimization": n, "reports": [{"name": ..., "hash": ...}]}')
+        if not isinstance(reports, list) or len(reports) > settings.DATA_UPLOAD_MAX_NUMBER_FILES:
+            return HttpResponseBadRequest('Too many reports')
+        hashes = {}
+        for report in reports:
+            if isinstance(report, dict) and re.fullmatch(r'[0-9a-fA-F]{64}', str(report.get('hash'))):
+                hashes[os.path.basename(str(report.get('name')))] = str(report['hash']).lower()
+        contents = known_contents(request.user, hashes, ('backtest__trades', 'calendar'))
+        known = {name for name, original in contents.items() if is_same_report(name, optimization, original)}
+        return JsonResponse({'known': sorted(known), 'missing': [name for name in hashes if name not in known]})
+
+
+class IngestJobProgress(View):
+    """Progress of an ingest job of the user as JSON (polling)"""
+    def get(self, request, pk):
+        job = get_object_or_404(IngestJob, pk=pk, user=request.user)
+        return JsonResponse(job.progress())
+
+
+class IngestJobEvents(View):
+    """Progress of an ingest job of the user as server-sent events: one 'progress' event per
+       change until the job finishes or SANCHO_PROGRESS_STREAM_SECONDS pass (the browser
+       then reconnects). Only served with SANCHO_PROGRESS_EVENTS, since every stream holds a
+       server worker"""
+    def get(self, request, pk):
+        if not settings.SANCHO_PROGRESS_EVENTS:
+            raise Http404('Progress events are disabled')
+        job = get_object_or_404(IngestJob, pk=pk, user=request.user)
+        response = StreamingHttpResponse(self.events(job), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def events(self, job: IngestJob):
+        interval = settings.SANCHO_PROGRESS_INTERVAL
+        deadline = time.monotonic() + settings.SANCHO_PROGRESS_STREAM_SECONDS
+        last = None
+        yield f'retry: {int(interval * 1000)}\n\n'
+        while True:
+            progress = job.progress()
+            if progress != last:
+                yield f'event: progress\ndata: {json.dumps(progress)}\n\n'
+                last = progress
+            if job.is_finished or time.monotonic() >= deadline:
+                break
+            time.sleep(interval)
+            job.refresh_from_db()
+        if job.is_finished:
+            yield 'event: done\ndata: {}\n\n'
+
+
+class InstrumentationSummary(View):
+    """Timings collected by this process (GET) and runtime switch (POST enabled=0/1), staff only.
+       Both are per process: with several server processes a request reaches only one of them,
+       and the Celery workers are never reached (they log the timings of every task instead).
+       SANCHO_INSTRUMENT switches every process on at start."""
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({'error': 'forbidden'}, status=403)
+        return JsonResponse({'enabled': btinstrument.is_enabled(), 'timings': btinstrument.summary()})
+
+    def post(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({'error': 'forbidden'}, status=403)
+        if 'enabled' in request.POST:
+            btinstrument.enable(request.POST['enabled'].lower() in ('1', 'true', 'yes', 'on'))
+        if request.POST.get('reset'):
+            btinstrument.reset()
+        return self.get(request)
 
 
 class ProcessedBacktests(ListView):
@@ -308,6 +319,7 @@ class ExportBacktests(ListView):
 
     def get_queryset(self):        
         queryset = super().get_queryset().filter(backtest__period_type=Backtest.PeriodType.ISOS)       
+        queryset = queryset.select_related('backtest').defer('backtest__trades', 'calendar')
        
         return queryset
     
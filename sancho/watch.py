@@ -0,0 +1,118 @@
+# Python imports
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+# Project imports
+from .src.parser.btgenbox import BtPeriods, report_key
+
+
+##########################################################################################################
+# CONSTANTS AND ENUMERATIONS USED BY THIS MODULE
+# Extensions of the reports
+REPORT_SUFFIXES = ('.htm', '.html')
+# Seconds without changes before a report is taken as written
+SETTLE_SECONDS = 5.0
+# Seconds to wait for the rest of the IS/OS/ISOS reports of a backtest
+GROUP_TIMEOUT = 60.0
+# Seconds between full listings of the directory even if its mtime didn't change (coarse
+# mtimes, reports rewritten in place)
+RESCAN_SECONDS = 60.0
+##########################################################################################################
+
+
+class ReportWatcher:
+    """
+    Change index of a directory where Genbox writes its reports. Every poll returns the new
+    or changed reports that are ready to be ingested:
+        * the directory is only listed when its mtime changes (or every RESCAN_SECONDS); the
+          reports already handed out are recognised by their (size, mtime) without reading them
+        * a report is ready once it hasn't been modified for settle seconds
+        * the IS, OS and ISOS reports of a backtest are handed out together, or whatever there
+          is of them after group_timeout seconds
+
+    Instance variables:
+        directory (Path):       Directory watched
+        settle (float):         Seconds without changes to take a report as written
+        group_timeout (float):  Seconds to wait for the other periods of a backtest
+        seen (Dict[str, Tuple[int, int]]):
+                                Reports handed out: file name -> (size, mtime_ns)
+
+    Instance properties:
+        * pending
+
+    Instance methods:
+        * poll
+    """
+
+    def __init__(self, directory: Path, settle: float = SETTLE_SECONDS, group_timeout: float = GROUP_TIMEOUT,
+                 seen: Dict[str, Tuple[int, int]] = None) -> None:
+        self.directory = Path(directory)
+        self.settle = settle
+        self.group_timeout = group_timeout
+        self.seen = {name: tuple(stat) for name, stat in (seen or {}).items()}
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        self._groups: Dict[str, float] = {}     # backtest name -> first time seen
+        self._dir_mtime = None
+        self._scanned = None
+
+    @property
+    def pending(self) -> Set[str]:
+        """Reports found but not handed out yet"""
+        return set(self._pending)
+
+    def _scan(self, now: float) -> None:
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._dir_mtime and now - self._scanned < RESCAN_SECONDS:
+            return
+        self._dir_mtime, self._scanned = mtime, now
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name in self._pending or os.path.splitext(entry.name)[1].lower() not in REPORT_SUFFIXES \
+                        or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if self.seen.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    self._pending[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+    def _settled(self, now: float) -> Set[str]:
+        settled = set()
+        for name in list(self._pending):
+            try:
+                stat = os.stat(self.directory / name)
+            except FileNotFoundError:
+                del self._pending[name]
+                continue
+            self._pending[name] = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size and now - stat.st_mtime_ns / 1e9 >= self.settle:
+                settled.add(name)
+        return settled
+
+    def poll(self, now: float = None, flush: bool = False) -> List[str]:
+        """Reports ready to be ingested (see the class docstring), which count as seen from
+           now on. flush hands out the settled reports without waiting for their groups.
+
+        Args:
+            now (float):    Current time (time.time() by default)
+            flush (bool):   Don't wait for the other periods of the backtests
+
+        Returns:
+            (List[str]): File names of the reports, by name
+        """
+        now = time.time() if now is None else now
+        self._scan(now)
+        settled = self._settled(now)
+        groups = {}
+        for name in self._pending:
+            groups.setdefault(report_key(name)[0], []).append(name)
+        ready = []
+        for bt_name, names in groups.items():
+            first = self._groups.setdefault(bt_name, now)
+            complete = {report_key(name)[1] for name in names} == set(BtPeriods)
+            if all(name in settled for name in names) and (complete or flush or now - first >= self.group_timeout):
+                ready += names
+                del self._groups[bt_name]
+        for name in ready:
+            self.seen[name] = self._pending.pop(name)
+        return sorted(ready)